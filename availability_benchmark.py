@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-slot x per-busy availability check vs. backend/availability_engine.py
+
+Generates synthetic busy calendars and answers "which trainers are free" over the whole range
+both ways. Usage: python availability_benchmark.py [--trainers 1000] [--days 30] [--busy-per-day 4]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from availability_engine import AvailabilityConfig, find_available_trainers
+
+# The seven hard-coded slots CalendarService used before the engine
+LEGACY_WORKING_HOURS = [
+    ("09:00", "10:00"), ("10:00", "11:00"), ("11:00", "12:00"),
+    ("14:00", "15:00"), ("15:00", "16:00"), ("16:00", "17:00"), ("17:00", "18:00")
+]
+
+
+def generate_busy_times(trainers: int, days: int, busy_per_day: int, first_day: datetime, seed: int) -> dict:
+    rng = random.Random(seed)
+    busy_times = {}
+    for trainer in range(trainers):
+        busy = []
+        for day in range(days):
+            day_start = first_day + timedelta(days=day)
+            for _ in range(busy_per_day):
+                start = day_start + timedelta(minutes=rng.randrange(6 * 60, 20 * 60, 15))
+                end = start + timedelta(minutes=rng.choice([30, 45, 60, 90]))
+                busy.append({"start": start.isoformat() + "Z", "end": end.isoformat() + "Z"})
+        rng.shuffle(busy)
+        busy_times[f"trainer_{trainer}"] = busy
+    return busy_times
+
+
+def legacy_search(busy_times: dict, first_day: datetime, days: int) -> dict:
+    """The old _calculate_available_slots loop, run for every trainer and day"""
+    available = {}
+    for trainer_id, busy in busy_times.items():
+        slots = []
+        for day in range(days):
+            date = (first_day + timedelta(days=day)).strftime("%Y-%m-%d")
+            for slot_start_time, slot_end_time in LEGACY_WORKING_HOURS:
+                slot_start = datetime.fromisoformat(f"{date}T{slot_start_time}:00+00:00")
+                slot_end = datetime.fromisoformat(f"{date}T{slot_end_time}:00+00:00")
+                is_available = True
+                for busy_time in busy:
+                    busy_start = datetime.fromisoformat(busy_time['start'].replace('Z', '+00:00'))
+                    busy_end = datetime.fromisoformat(busy_time['end'].replace('Z', '+00:00'))
+                    if slot_start < busy_end and slot_end > busy_start:
+                        is_available = False
+                        break
+                if is_available:
+                    slots.append(slot_start)
+        if slots:
+            available[trainer_id] = slots
+    return available
+
+
+def timed(label: str, func):
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<24} {elapsed * 1000:>10.1f} ms   {len(result):>6} trainers with a free slot")
+    return elapsed, result
+
+
+def main(args):
+    first_day = datetime(2025, 1, 6)
+    busy_times = generate_busy_times(args.trainers, args.days, args.busy_per_day, first_day, args.seed)
+    configs = {trainer_id: AvailabilityConfig() for trainer_id in busy_times}
+    window_start = first_day.isoformat() + "Z"
+    window_end = (first_day + timedelta(days=args.days)).isoformat() + "Z"
+    print(f"{args.trainers} trainers x {args.days} days, {args.busy_per_day} busy blocks per day\n")
+
+    engine_seconds, engine_result = timed(
+        "availability engine", lambda: find_available_trainers(configs, busy_times, window_start, window_end)
+    )
+    if args.skip_legacy:
+        return
+
+    legacy_seconds, legacy_result = timed("legacy slot x busy loop", lambda: legacy_search(busy_times, first_day, args.days))
+    engine_slots = sum(len(slots) for slots in engine_result.values())
+    legacy_slots = sum(len(slots) for slots in legacy_result.values())
+    print(f"\nfree slots: engine {engine_slots}, legacy {legacy_slots}"
+          f"{'' if engine_slots == legacy_slots else '  (MISMATCH)'}")
+    print(f"speedup: {legacy_seconds / max(engine_seconds, 1e-9):.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--trainers", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--busy-per-day", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--skip-legacy", action="store_true", help="only time the engine")
+    main(parser.parse_args())
@@ -0,0 +1,198 @@
+"""
+Slot engine for trainer availability across many trainers and multi-week ranges
+"""
+from bisect import bisect_left
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# 09:00-12:00 and 14:00-18:00 in one-hour sessions: the seven slots the app has always offered
+DEFAULT_WORKING_HOURS = [
+    {"start_time": "09:00", "end_time": "12:00"},
+    {"start_time": "14:00", "end_time": "18:00"}
+]
+DEFAULT_SESSION_MINUTES = 60
+DEFAULT_BUFFER_MINUTES = 0
+
+# Longest range a single search may cover
+MAX_SEARCH_DAYS = 62
+
+SECONDS_PER_DAY = 24 * 60 * 60
+EPOCH_WEEKDAY = 3  # 1970-01-01 was a Thursday (Monday = 0)
+
+
+def parse_timestamp(value) -> int:
+    """Epoch seconds for an ISO-8601 string or datetime; naive values are taken as UTC"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def format_timestamp(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def _minute_of_day(hhmm: str) -> int:
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def merge_intervals(intervals: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Sort and sweep overlapping or touching intervals into a disjoint list"""
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(intervals):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class BusyIndex:
+    """A trainer's busy time as merged, sorted intervals.
+
+    Merged intervals are disjoint, so their ends are sorted too: the only interval that can
+    overlap [start, end) is the last one starting before end, found by binary search.
+    """
+
+    def __init__(self, busy_times: Iterable = ()):
+        self.intervals = merge_intervals(
+            (parse_timestamp(busy["start"]), parse_timestamp(busy["end"])) if isinstance(busy, dict) else busy
+            for busy in busy_times
+        )
+        self._starts = [start for start, _ in self.intervals]
+
+    def overlaps(self, start: int, end: int) -> bool:
+        position = bisect_left(self._starts, end) - 1
+        return position >= 0 and self.intervals[position][1] > start
+
+
+class AvailabilityConfig:
+    """A trainer's bookable hours, in UTC.
+
+    working_hours applies to every day unless weekly_hours overrides it for a weekday
+    ("0" = Monday ... "6" = Sunday); days_off lists weekdays with no slots at all.
+    Slots are session_minutes long, spaced by buffer_minutes, and need the buffer free on both sides.
+    """
+
+    def __init__(self, working_hours: List[Dict] = None, session_minutes: int = DEFAULT_SESSION_MINUTES,
+                 buffer_minutes: int = DEFAULT_BUFFER_MINUTES, weekly_hours: Dict[str, List[Dict]] = None,
+                 days_off: List[int] = None, calendar_id: str = "primary"):
+        if session_minutes <= 0 or buffer_minutes < 0:
+            raise ValueError("session_minutes must be positive and buffer_minutes non-negative")
+
+        self.working_hours = working_hours or DEFAULT_WORKING_HOURS
+        self.session_minutes = session_minutes
+        self.buffer_minutes = buffer_minutes
+        self.weekly_hours = {str(day): hours for day, hours in (weekly_hours or {}).items()}
+        self.days_off = sorted(set(days_off or []))
+        self.calendar_id = calendar_id
+
+        # Slot start offsets (seconds after midnight) per weekday, computed once
+        self._day_slots = [self._slot_offsets(weekday) for weekday in range(7)]
+
+    @classmethod
+    def from_dict(cls, doc: Optional[Dict]) -> "AvailabilityConfig":
+        doc = doc or {}
+        return cls(
+            working_hours=doc.get("working_hours"),
+            session_minutes=doc.get("session_minutes", DEFAULT_SESSION_MINUTES),
+            buffer_minutes=doc.get("buffer_minutes", DEFAULT_BUFFER_MINUTES),
+            weekly_hours=doc.get("weekly_hours"),
+            days_off=doc.get("days_off"),
+            calendar_id=doc.get("calendar_id", "primary")
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "working_hours": self.working_hours,
+            "session_minutes": self.session_minutes,
+            "buffer_minutes": self.buffer_minutes,
+            "weekly_hours": self.weekly_hours,
+            "days_off": self.days_off,
+            "calendar_id": self.calendar_id
+        }
+
+    def _slot_offsets(self, weekday: int) -> List[int]:
+        if weekday in self.days_off:
+            return []
+        offsets = []
+        step = self.session_minutes + self.buffer_minutes
+        for window in self.weekly_hours.get(str(weekday), self.working_hours):
+            start = _minute_of_day(window["start_time"])
+            end = _minute_of_day(window["end_time"])
+            while start + self.session_minutes <= end:
+                offsets.append(start * 60)
+                start += step
+        return offsets
+
+    def slots(self, start: int, end: int) -> Iterator[Tuple[int, int]]:
+        """Every bookable slot that lies entirely inside [start, end)"""
+        duration = self.session_minutes * 60
+        day_start = start - start % SECONDS_PER_DAY
+        while day_start < end:
+            weekday = (day_start // SECONDS_PER_DAY + EPOCH_WEEKDAY) % 7
+            for offset in self._day_slots[weekday]:
+                slot_start = day_start + offset
+                if slot_start >= start and slot_start + duration <= end:
+                    yield slot_start, slot_start + duration
+            day_start += SECONDS_PER_DAY
+
+
+def is_free(config: AvailabilityConfig, busy: BusyIndex, slot_start: int, slot_end: int) -> bool:
+    buffer = config.buffer_minutes * 60
+    return not busy.overlaps(slot_start - buffer, slot_end + buffer)
+
+
+def day_slots(config: AvailabilityConfig, date: str, busy: BusyIndex) -> List[Dict]:
+    """One day's slots with their availability, in the shape the app's scheduling screens use"""
+    day_start = parse_timestamp(f"{date}T00:00:00")
+    return [
+        {
+            "start_time": format_timestamp(slot_start)[11:16],
+            "end_time": format_timestamp(slot_end)[11:16],
+            "available": is_free(config, busy, slot_start, slot_end)
+        }
+        for slot_start, slot_end in config.slots(day_start, day_start + SECONDS_PER_DAY)
+    ]
+
+
+def free_slots(config: AvailabilityConfig, busy: BusyIndex, start: int, end: int,
+               limit: Optional[int] = None) -> List[Dict]:
+    """Free slots for one trainer inside [start, end)"""
+    found = []
+    for slot_start, slot_end in config.slots(start, end):
+        if is_free(config, busy, slot_start, slot_end):
+            found.append({"start": format_timestamp(slot_start), "end": format_timestamp(slot_end)})
+            if limit and len(found) >= limit:
+                break
+    return found
+
+
+def search_window(start, end) -> Tuple[int, int]:
+    """Validated [start, end) in epoch seconds; raises ValueError for empty or oversized windows"""
+    start, end = parse_timestamp(start), parse_timestamp(end)
+    if end <= start:
+        raise ValueError("end must be after start")
+    if end - start > MAX_SEARCH_DAYS * SECONDS_PER_DAY:
+        raise ValueError(f"Search window is limited to {MAX_SEARCH_DAYS} days")
+    return start, end
+
+
+def find_available_trainers(configs: Dict[str, AvailabilityConfig], busy_times: Dict[str, Iterable],
+                            start, end, limit_per_trainer: Optional[int] = None) -> Dict[str, List[Dict]]:
+    """Free slots per trainer in the window [start, end); trainers with none are left out"""
+    start, end = search_window(start, end)
+
+    available = {}
+    for trainer_id, config in configs.items():
+        slots = free_slots(config, BusyIndex(busy_times.get(trainer_id, ())), start, end, limit_per_trainer)
+        if slots:
+            available[trainer_id] = slots
+    return available
@@ -2,16 +2,40 @@
 Google Calendar integration for LiftLink trainer scheduling
 """
 import os
+import asyncio
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import Iterable, List, Dict, Optional, Tuple
 import logging
-import httpx
 from urllib.parse import urlencode
+from http_clients import HttpClientRegistry
+from availability_engine import AvailabilityConfig, BusyIndex, day_slots, parse_timestamp, SECONDS_PER_DAY
+from ttl_cache import TTLCache, MISSING
+from single_flight import SingleFlight
+
+# Google accepts at most 50 calendars per freebusy query (calendarExpansionMax)
+FREEBUSY_MAX_CALENDARS = 50
+FREEBUSY_MAX_CONCURRENCY = int(os.environ.get('FREEBUSY_MAX_CONCURRENCY', '4'))
+FREEBUSY_CACHE_SECONDS = int(os.environ.get('FREEBUSY_CACHE_SECONDS', '60'))
+FREEBUSY_CACHE_MAX_ENTRIES = 10000
+SCHEDULE_CACHE_SECONDS = int(os.environ.get('SCHEDULE_CACHE_SECONDS', '60'))
+SCHEDULE_CACHE_MAX_ENTRIES = 2048
 
 class CalendarService:
-    def __init__(self):
+    def __init__(self, http_clients: HttpClientRegistry = None, shared_cache=None):
         self.api_key = os.environ.get('GOOGLE_CALENDAR_API_KEY')
         self.base_url = "https://www.googleapis.com/calendar/v3"
+        self.http_clients = http_clients or HttpClientRegistry()
+        self._freebusy_semaphore = asyncio.Semaphore(FREEBUSY_MAX_CONCURRENCY)
+        # Event lists keyed by trainer and range, busy intervals keyed by (calendar, day);
+        # shared_cache is an optional MongoDB collection shared by every worker
+        self.schedule_cache = TTLCache("calendar_schedule", SCHEDULE_CACHE_MAX_ENTRIES, SCHEDULE_CACHE_SECONDS, shared_cache)
+        self.busy_cache = TTLCache("calendar_freebusy", FREEBUSY_CACHE_MAX_ENTRIES, FREEBUSY_CACHE_SECONDS, shared_cache)
+        # Concurrent cache misses for the same upstream request share one call
+        self.single_flight = SingleFlight("google_calendar")
+    
+    def _client(self):
+        """Pooled client shared by every Calendar call (keeps TCP/TLS connections alive)"""
+        return self.http_clients.get("google_calendar")
         
     async def get_trainer_schedule(self, trainer_id: str, start_date: str = None, end_date: str = None) -> List[Dict]:
         """Get trainer schedule from Google Calendar with proper error handling"""
@@ -20,48 +44,62 @@ class CalendarService:
                 print("⚠️  Google Calendar API not configured, using mock data")
                 return self._get_mock_schedule()
             
-            print(f"🔑 Attempting Google Calendar API call for trainer {trainer_id}")
-            
-            # Use real Google Calendar API
-            if not start_date:
-                start_date = datetime.now().isoformat() + 'Z'
-            if not end_date:
-                end_date = (datetime.now() + timedelta(days=7)).isoformat() + 'Z'
-            
             # Try to get primary calendar first
             calendar_id = "primary"  # Use primary calendar for now
             
-            params = {
-                'key': self.api_key,
-                'timeMin': start_date,
-                'timeMax': end_date,
-                'singleEvents': 'true',
-                'orderBy': 'startTime'
-            }
+            cache_key = f"{trainer_id}|{start_date or 'now'}|{end_date or 'now+7d'}"
+            cached = await self.schedule_cache.get(cache_key)
+            if cached is not MISSING:
+                return cached
             
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.base_url}/calendars/{calendar_id}/events",
-                    params=params
-                )
+            return await self.single_flight.do(
+                ("events", calendar_id, cache_key),
+                lambda: self._fetch_schedule(trainer_id, calendar_id, cache_key, start_date, end_date)
+            )
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    events = self._format_calendar_events(data.get('items', []))
-                    print(f"📅 GOOGLE CALENDAR SUCCESS: Retrieved {len(events)} events")
-                    return events
-                elif response.status_code == 403:
-                    print(f"❌ Google Calendar 403 Error: API not properly configured in Google Cloud Console")
-                    print("🔧 Using mock data - Please configure Google Calendar API in Google Cloud Console")
-                    return self._get_mock_schedule()
-                else:
-                    print(f"❌ Google Calendar API error: {response.status_code} - {response.text}")
-                    return self._get_mock_schedule()
-                    
         except Exception as e:
             print(f"❌ Calendar service error: {e}")
             return self._get_mock_schedule()
     
+    async def _fetch_schedule(self, trainer_id: str, calendar_id: str, cache_key: str,
+                              start_date: Optional[str], end_date: Optional[str]) -> List[Dict]:
+        """One events.list call, cached when Google answers"""
+        print(f"🔑 Attempting Google Calendar API call for trainer {trainer_id}")
+        
+        # Use real Google Calendar API
+        if not start_date:
+            start_date = datetime.now().isoformat() + 'Z'
+        if not end_date:
+            end_date = (datetime.now() + timedelta(days=7)).isoformat() + 'Z'
+        
+        params = {
+            'key': self.api_key,
+            'timeMin': start_date,
+            'timeMax': end_date,
+            'singleEvents': 'true',
+            'orderBy': 'startTime'
+        }
+        
+        client = self._client()
+        response = await client.get(
+            f"{self.base_url}/calendars/{calendar_id}/events",
+            params=params
+        )
+        
+        if response.status_code == 200:
+            data = response.json()
+            events = self._format_calendar_events(data.get('items', []))
+            print(f"📅 GOOGLE CALENDAR SUCCESS: Retrieved {len(events)} events")
+            await self.schedule_cache.set(cache_key, events, tags=[f"schedule:{calendar_id}"])
+            return events
+        elif response.status_code == 403:
+            print(f"❌ Google Calendar 403 Error: API not properly configured in Google Cloud Console")
+            print("🔧 Using mock data - Please configure Google Calendar API in Google Cloud Console")
+            return self._get_mock_schedule()
+        else:
+            print(f"❌ Google Calendar API error: {response.status_code} - {response.text}")
+            return self._get_mock_schedule()
+    
     def _format_calendar_events(self, events: List[Dict]) -> List[Dict]:
         """Format Google Calendar events to LiftLink format"""
         formatted_events = []
@@ -129,21 +167,22 @@ class CalendarService:
                 }
             }
             
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.base_url}/calendars/primary/events",
-                    json=event_data,
-                    params={'key': self.api_key}
-                )
+            client = self._client()
+            response = await client.post(
+                f"{self.base_url}/calendars/primary/events",
+                json=event_data,
+                params={'key': self.api_key}
+            )
+            
+            if response.status_code == 200:
+                created_event = response.json()
+                print(f"📅 GOOGLE CALENDAR APPOINTMENT CREATED: {created_event['summary']}")
+                await self.invalidate_calendar("primary", [(event_data['start']['dateTime'], event_data['end']['dateTime'])])
+                return self._format_created_event(created_event)
+            else:
+                logging.warning(f"Google Calendar create error: {response.status_code}")
+                return self._create_mock_appointment(trainer_id, appointment_data)
                 
-                if response.status_code == 200:
-                    created_event = response.json()
-                    print(f"📅 GOOGLE CALENDAR APPOINTMENT CREATED: {created_event['summary']}")
-                    return self._format_created_event(created_event)
-                else:
-                    logging.warning(f"Google Calendar create error: {response.status_code}")
-                    return self._create_mock_appointment(trainer_id, appointment_data)
-                    
         except Exception as e:
             logging.error(f"Appointment creation failed: {e}")
             return self._create_mock_appointment(trainer_id, appointment_data)
@@ -168,115 +207,174 @@ class CalendarService:
                 return True
                 
             # Get existing event first
-            async with httpx.AsyncClient() as client:
-                get_response = await client.get(
-                    f"{self.base_url}/calendars/primary/events/{appointment_id}",
-                    params={'key': self.api_key}
-                )
-                
-                if get_response.status_code != 200:
-                    return False
-                
-                event = get_response.json()
-                
-                # Update event with new data
-                if 'title' in update_data:
-                    event['summary'] = update_data['title']
-                if 'start_time' in update_data:
-                    event['start']['dateTime'] = update_data['start_time']
-                if 'end_time' in update_data:
-                    event['end']['dateTime'] = update_data['end_time']
-                if 'notes' in update_data:
-                    event['description'] = update_data['notes']
-                
-                # Update event in Google Calendar
-                update_response = await client.put(
-                    f"{self.base_url}/calendars/primary/events/{appointment_id}",
-                    json=event,
-                    params={'key': self.api_key}
-                )
+            client = self._client()
+            get_response = await client.get(
+                f"{self.base_url}/calendars/primary/events/{appointment_id}",
+                params={'key': self.api_key}
+            )
+            
+            if get_response.status_code != 200:
+                return False
+            
+            event = get_response.json()
+            previous_times = (event.get('start', {}).get('dateTime'), event.get('end', {}).get('dateTime'))
+            
+            # Update event with new data
+            if 'title' in update_data:
+                event['summary'] = update_data['title']
+            if 'start_time' in update_data:
+                event['start']['dateTime'] = update_data['start_time']
+            if 'end_time' in update_data:
+                event['end']['dateTime'] = update_data['end_time']
+            if 'notes' in update_data:
+                event['description'] = update_data['notes']
+            
+            # Update event in Google Calendar
+            update_response = await client.put(
+                f"{self.base_url}/calendars/primary/events/{appointment_id}",
+                json=event,
+                params={'key': self.api_key}
+            )
+            
+            if update_response.status_code == 200:
+                print(f"📝 GOOGLE CALENDAR APPOINTMENT UPDATED: {appointment_id}")
+                await self.invalidate_calendar("primary", [
+                    previous_times, (event['start'].get('dateTime'), event['end'].get('dateTime'))
+                ])
+                return True
+            else:
+                return False
                 
-                if update_response.status_code == 200:
-                    print(f"📝 GOOGLE CALENDAR APPOINTMENT UPDATED: {appointment_id}")
-                    return True
-                else:
-                    return False
-                    
         except Exception as e:
             logging.error(f"Appointment update failed: {e}")
             return False
     
-    async def get_available_slots(self, trainer_id: str, date: str) -> List[Dict]:
+    async def get_available_slots(self, trainer_id: str, date: str, config: AvailabilityConfig = None) -> List[Dict]:
         """Get available time slots for a trainer"""
         try:
             if not self.api_key or self.api_key == 'your_google_calendar_api_key_here':
-                return self._get_mock_available_slots()
-            
-            # Get busy times from Google Calendar
-            start_time = f"{date}T00:00:00Z"
-            end_time = f"{date}T23:59:59Z"
+                if config is None:
+                    return self._get_mock_available_slots()
+                return self._calculate_available_slots([], date, config)
             
-            freebusy_request = {
-                "timeMin": start_time,
-                "timeMax": end_time,
-                "items": [{"id": "primary"}]
-            }
+            config = config or AvailabilityConfig()
             
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.base_url}/freebusy",
-                    json=freebusy_request,
-                    params={'key': self.api_key}
-                )
+            # Get busy times from Google Calendar
+            busy_times = (await self.get_busy_times(
+                {trainer_id: config.calendar_id}, f"{date}T00:00:00Z", f"{date}T23:59:59Z"
+            ))[trainer_id]
+            if busy_times is None:
+                return self._get_mock_available_slots()
+            return self._calculate_available_slots(busy_times, date, config)
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    busy_times = data.get('calendars', {}).get('primary', {}).get('busy', [])
-                    return self._calculate_available_slots(busy_times, date)
-                else:
-                    return self._get_mock_available_slots()
-                    
         except Exception as e:
             logging.error(f"Available slots error: {e}")
             return self._get_mock_available_slots()
     
-    def _calculate_available_slots(self, busy_times: List[Dict], date: str) -> List[Dict]:
-        """Calculate available slots based on busy times"""
-        # Standard working hours: 9 AM to 6 PM
-        working_hours = [
-            {"start_time": "09:00", "end_time": "10:00"},
-            {"start_time": "10:00", "end_time": "11:00"},
-            {"start_time": "11:00", "end_time": "12:00"},
-            {"start_time": "14:00", "end_time": "15:00"},
-            {"start_time": "15:00", "end_time": "16:00"},
-            {"start_time": "16:00", "end_time": "17:00"},
-            {"start_time": "17:00", "end_time": "18:00"}
-        ]
+    async def get_busy_times(self, calendar_ids: Dict[str, str], time_min: str, time_max: str) -> Dict[str, Optional[List[Dict]]]:
+        """Busy intervals per trainer (trainer_id -> calendar_id) covering the days of [time_min, time_max].
+
+        Calendars are packed FREEBUSY_MAX_CALENDARS per freebusy query and the queries run concurrently;
+        answers are cached per (calendar, day). None marks a trainer whose calendar could not be read;
+        the result is empty when Calendar is not configured.
+        """
+        if not self.api_key or self.api_key == 'your_google_calendar_api_key_here':
+            return {}
         
-        available_slots = []
+        days = self._days_between(time_min, time_max)
+        busy_by_calendar: Dict[str, Optional[List[Dict]]] = {}
+        missing = []
+        for calendar_id in dict.fromkeys(calendar_ids.values()):
+            cached = [await self.busy_cache.get(f"{calendar_id}|{day}", None) for day in days]
+            if any(day_busy is None for day_busy in cached):
+                missing.append(calendar_id)
+            else:
+                busy_by_calendar[calendar_id] = [busy for day_busy in cached for busy in day_busy]
         
-        for slot in working_hours:
-            slot_start = datetime.fromisoformat(f"{date}T{slot['start_time']}:00")
-            slot_end = datetime.fromisoformat(f"{date}T{slot['end_time']}:00")
-            
-            # Check if slot conflicts with busy times
-            is_available = True
-            for busy_time in busy_times:
-                busy_start = datetime.fromisoformat(busy_time['start'].replace('Z', '+00:00'))
-                busy_end = datetime.fromisoformat(busy_time['end'].replace('Z', '+00:00'))
-                
-                # Check for overlap
-                if (slot_start < busy_end and slot_end > busy_start):
-                    is_available = False
-                    break
-            
-            available_slots.append({
-                "start_time": slot['start_time'],
-                "end_time": slot['end_time'],
-                "available": is_available
-            })
+        if missing:
+            first_day = datetime.fromisoformat(days[0])
+            time_min = f"{days[0]}T00:00:00Z"
+            time_max = (first_day + timedelta(days=len(days))).strftime('%Y-%m-%dT00:00:00Z')
+            chunks = [missing[i:i + FREEBUSY_MAX_CALENDARS] for i in range(0, len(missing), FREEBUSY_MAX_CALENDARS)]
+            results = await asyncio.gather(*(
+                self.single_flight.do(
+                    ("freebusy", tuple(chunk), time_min, time_max),
+                    lambda chunk=chunk: self._fetch_busy_chunk(chunk, time_min, time_max)
+                )
+                for chunk in chunks
+            ))
+            for fetched in results:
+                for calendar_id, busy in fetched.items():
+                    if busy is not None:
+                        await self._cache_busy(calendar_id, days, busy)
+                    busy_by_calendar[calendar_id] = busy
+        
+        return {trainer_id: busy_by_calendar.get(calendar_id) for trainer_id, calendar_id in calendar_ids.items()}
+    
+    async def _fetch_busy_chunk(self, calendar_ids: List[str], time_min: str, time_max: str) -> Dict[str, Optional[List[Dict]]]:
+        """One freebusy query for up to FREEBUSY_MAX_CALENDARS calendars"""
+        freebusy_request = {
+            "timeMin": time_min,
+            "timeMax": time_max,
+            "calendarExpansionMax": FREEBUSY_MAX_CALENDARS,
+            "items": [{"id": calendar_id} for calendar_id in calendar_ids]
+        }
+        
+        try:
+            async with self._freebusy_semaphore:
+                client = self._client()
+                response = await client.post(
+                    f"{self.base_url}/freebusy",
+                    json=freebusy_request,
+                    params={'key': self.api_key}
+                )
+        except Exception as e:
+            logging.error(f"Google Calendar freebusy failed for {len(calendar_ids)} calendars: {e}")
+            return {calendar_id: None for calendar_id in calendar_ids}
+        
+        if response.status_code != 200:
+            logging.warning(f"Google Calendar freebusy error: {response.status_code}")
+            return {calendar_id: None for calendar_id in calendar_ids}
         
-        return available_slots
+        calendars = response.json().get('calendars', {})
+        fetched = {}
+        for calendar_id in calendar_ids:
+            calendar = calendars.get(calendar_id, {})
+            # Per-calendar failures (e.g. notFound) come back inside a 200 response
+            fetched[calendar_id] = None if calendar.get('errors') else calendar.get('busy', [])
+        return fetched
+    
+    def _days_between(self, time_min: str, time_max: str) -> List[str]:
+        first = parse_timestamp(time_min) // SECONDS_PER_DAY
+        last = max(first, (parse_timestamp(time_max) - 1) // SECONDS_PER_DAY)
+        return [
+            datetime.utcfromtimestamp(day * SECONDS_PER_DAY).strftime('%Y-%m-%d')
+            for day in range(first, last + 1)
+        ]
+    
+    async def _cache_busy(self, calendar_id: str, days: List[str], busy_times: List[Dict]):
+        intervals = [(parse_timestamp(busy['start']), parse_timestamp(busy['end']), busy) for busy in busy_times]
+        for day in days:
+            day_start = parse_timestamp(f"{day}T00:00:00Z")
+            day_end = day_start + SECONDS_PER_DAY
+            await self.busy_cache.set(
+                f"{calendar_id}|{day}",
+                [busy for start, end, busy in intervals if start < day_end and end > day_start],
+                tags=[f"busy:{calendar_id}:{day}"]
+            )
+    
+    async def invalidate_calendar(self, calendar_id: str, time_ranges: Iterable[Tuple[Optional[str], Optional[str]]]):
+        """Forget cached schedules for a calendar and its busy time on the days the ranges touch"""
+        tags = [f"schedule:{calendar_id}"]
+        for start, end in time_ranges:
+            if start and end:
+                tags.extend(f"busy:{calendar_id}:{day}" for day in self._days_between(start, end))
+        await self.schedule_cache.invalidate_tags(tags)
+        await self.busy_cache.invalidate_tags(tags)
+    
+    def _calculate_available_slots(self, busy_times: List[Dict], date: str, config: AvailabilityConfig = None) -> List[Dict]:
+        """Calculate available slots based on busy times"""
+        return day_slots(config or AvailabilityConfig(), date, BusyIndex(busy_times))
     
     def _get_mock_schedule(self) -> List[Dict]:
         """Get mock schedule data"""
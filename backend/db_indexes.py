@@ -0,0 +1,112 @@
+"""
+MongoDB index provisioning for LiftLink collections
+"""
+import logging
+from typing import Dict, List
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import ConnectionFailure, PyMongoError
+from job_queue import job_index_specs
+from idempotency import idempotency_index_specs
+from ttl_cache import cache_index_specs
+from document_store import document_blob_index_specs, document_index_specs
+
+# Indexes every hot query path depends on, keyed by collection. Specs marked "required" back a
+# correctness guarantee (deduplication, replay protection), not just speed: see ensure_indexes
+INDEX_SPECS: Dict[str, List[Dict]] = {
+    "users": [
+        {"name": "email_unique", "keys": [("email", ASCENDING)], "unique": True},
+        {"name": "id_unique", "keys": [("id", ASCENDING)], "unique": True},
+    ],
+    "sessions": [
+        {"name": "id_unique", "keys": [("id", ASCENDING)], "unique": True},
+        {"name": "user_created_at_id", "keys": [("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+        {"name": "user_source_created_at", "keys": [("user_id", ASCENDING), ("source", ASCENDING), ("created_at", ASCENDING)]},
+        # Only imported sessions carry a session_key
+        {"name": "session_key_unique", "keys": [("session_key", ASCENDING)], "unique": True,
+         "partialFilterExpression": {"session_key": {"$exists": True}}, "required": True},
+    ],
+    "tree_progress": [
+        {"name": "user_id_unique", "keys": [("user_id", ASCENDING)], "unique": True},
+    ],
+    "sync_jobs": job_index_specs(),
+    "stripe_events": job_index_specs(),
+    "verification_jobs": job_index_specs(),
+    "idempotency_keys": idempotency_index_specs(),
+    "cache_entries": cache_index_specs(),
+    "verification_documents": document_index_specs(),
+    "document_blobs": document_blob_index_specs(),
+    "trainer_availability": [
+        {"name": "trainer_id_unique", "keys": [("trainer_id", ASCENDING)], "unique": True},
+    ],
+    "payments": [
+        {"name": "id_unique", "keys": [("id", ASCENDING)], "unique": True},
+        {"name": "trainer_created_at", "keys": [("trainer_id", ASCENDING), ("created_at", DESCENDING)]},
+    ],
+    "trainer_earnings": [
+        {"name": "trainer_id_unique", "keys": [("trainer_id", ASCENDING)], "unique": True},
+    ],
+}
+
+
+class IndexProvisioningError(Exception):
+    """A required index could not be created, so the server must not start"""
+
+
+def _normalize_keys(keys) -> List[tuple]:
+    # The server may hand directions back as doubles (1.0) depending on who created the index
+    return [(field, int(direction) if isinstance(direction, (int, float)) else direction) for field, direction in keys]
+
+
+def _index_options(spec: Dict) -> Dict:
+    return {key: value for key, value in spec.items() if key not in ("keys", "required")}
+
+
+async def ensure_indexes(db) -> Dict[str, List[str]]:
+    """Create any missing indexes; safe to run on every startup.
+
+    Raises IndexProvisioningError, after trying every index, if a required one could not be created.
+    Connection errors are raised straight away, so an unreachable server fails startup after one
+    server-selection timeout instead of one per index.
+    """
+    created = {}
+    failed_required = []
+    for collection_name, specs in INDEX_SPECS.items():
+        collection = db[collection_name]
+        for spec in specs:
+            try:
+                # create_index is a no-op when an identical index already exists
+                await collection.create_index(spec["keys"], **_index_options(spec))
+                created.setdefault(collection_name, []).append(spec["name"])
+            except ConnectionFailure:
+                raise
+            except PyMongoError as e:
+                # Typically existing duplicates blocking a unique index - keep serving and surface it in the report
+                logging.error(f"Index {collection_name}.{spec['name']} could not be created: {e}")
+                if spec.get("required"):
+                    failed_required.append(f"{collection_name}.{spec['name']}")
+    if failed_required:
+        raise IndexProvisioningError(f"Required indexes could not be created: {', '.join(failed_required)}")
+    return created
+
+
+async def index_report(db) -> Dict[str, Dict]:
+    """Compare the indexes present in MongoDB with INDEX_SPECS"""
+    report = {}
+    for collection_name, specs in INDEX_SPECS.items():
+        existing = await db[collection_name].index_information()
+        existing_keys = {name: _normalize_keys(info["key"]) for name, info in existing.items()}
+
+        present, missing = [], []
+        for spec in specs:
+            if _normalize_keys(spec["keys"]) in existing_keys.values():
+                present.append(spec["name"])
+            else:
+                missing.append(spec["name"])
+
+        expected = [_normalize_keys(spec["keys"]) for spec in specs]
+        report[collection_name] = {
+            "existing": present,
+            "missing": missing,
+            "unmanaged": [name for name, keys in existing_keys.items() if name != "_id_" and keys not in expected]
+        }
+    return report
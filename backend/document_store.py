@@ -0,0 +1,445 @@
+"""
+Verification document storage: metadata in MongoDB, image bytes on local disk or S3
+"""
+import os
+import uuid
+import asyncio
+import hashlib
+from datetime import datetime
+from pymongo.errors import DuplicateKeyError
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+# local (default) or s3
+DOCUMENT_STORE_BACKEND = os.environ.get('DOCUMENT_STORE_BACKEND', 'local')
+DOCUMENT_STORE_PATH = os.environ.get(
+    'DOCUMENT_STORE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'document_uploads')
+)
+DOCUMENT_STORE_BUCKET = os.environ.get('DOCUMENT_STORE_BUCKET')
+DOCUMENT_STORE_PREFIX = os.environ.get('DOCUMENT_STORE_PREFIX', 'verification/')
+# Set for S3-compatible stores (MinIO, R2, ...)
+DOCUMENT_STORE_ENDPOINT_URL = os.environ.get('DOCUMENT_STORE_ENDPOINT_URL')
+# Originals are kept once normalized copies exist, but rarely read again: they go to cold storage
+DOCUMENT_COLD_STORE_PATH = os.environ.get('DOCUMENT_COLD_STORE_PATH', os.path.join(DOCUMENT_STORE_PATH, 'cold'))
+DOCUMENT_COLD_STORE_PREFIX = os.environ.get('DOCUMENT_COLD_STORE_PREFIX', 'verification-originals/')
+DOCUMENT_COLD_STORAGE_CLASS = os.environ.get('DOCUMENT_COLD_STORAGE_CLASS', 'GLACIER_IR')
+
+# Largest accepted document, and the piece size uploads are streamed in
+MAX_DOCUMENT_BYTES = int(os.environ.get('MAX_DOCUMENT_BYTES', str(15 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 256 * 1024
+# S3 multipart parts must be at least 5 MiB (except the last)
+S3_PART_BYTES = 8 * 1024 * 1024
+
+DOCUMENT_PENDING = "pending"
+# Verdicts a resubmission of the same image can reuse
+REUSABLE_STATUSES = ["approved", "rejected"]
+
+# What read_image can return for a document
+RENDITION_ORIGINAL = "original"
+RENDITION_REVIEW = "review"
+RENDITION_THUMBNAIL = "thumbnail"
+
+
+class DocumentTooLargeError(Exception):
+    """The document is bigger than MAX_DOCUMENT_BYTES"""
+
+
+async def single_chunk(data: bytes) -> AsyncIterator[bytes]:
+    yield data
+
+
+def document_index_specs() -> List[Dict]:
+    """Indexes the document metadata collection needs (see db_indexes.INDEX_SPECS)"""
+    return [
+        {"name": "id_unique", "keys": [("id", 1)], "unique": True},
+        {"name": "user_type_uploaded_at", "keys": [("user_id", 1), ("type", 1), ("uploaded_at", -1)]},
+        # Earlier verdicts on the same image, for resubmissions
+        {"name": "user_sha256_processed_at", "keys": [("user_id", 1), ("sha256", 1), ("processed_at", -1)]},
+    ]
+
+
+def document_blob_index_specs() -> List[Dict]:
+    """Indexes the content-addressed blob reference collection needs"""
+    return [
+        {"name": "sha256_unique", "keys": [("sha256", 1)], "unique": True, "required": True},
+    ]
+
+
+def content_key(sha256: str) -> str:
+    """Blob key for content with the given hash"""
+    return f"sha256/{sha256[:2]}/{sha256}"
+
+
+class LocalBlobStore:
+    """Blobs as files under a root directory"""
+
+    def __init__(self, root: str = DOCUMENT_STORE_PATH):
+        self.root = os.path.abspath(root)
+
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid blob key: {key}")
+        return path
+
+    def _write(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so readers never see a partial file
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    async def put_stream(self, key: str, chunks: AsyncIterator[bytes], content_type: str = "application/octet-stream"):
+        """Write chunks as they arrive; nothing is left behind if the stream fails"""
+        path = self._path(key)
+        await asyncio.to_thread(os.makedirs, os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        f = await asyncio.to_thread(open, temp_path, "wb")
+        try:
+            async for chunk in chunks:
+                await asyncio.to_thread(f.write, chunk)
+            await asyncio.to_thread(f.close)
+            await asyncio.to_thread(os.replace, temp_path, path)
+        except BaseException:
+            f.close()
+            await asyncio.to_thread(self._delete_path, temp_path)
+            raise
+
+    def _delete_path(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _read(self, key: str) -> bytes:
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def _delete(self, key: str):
+        self._delete_path(self._path(key))
+
+    def _move(self, source: str, destination: str):
+        path = self._path(destination)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self._path(source), path)
+
+    async def put(self, key: str, data: bytes, content_type: str = "application/octet-stream"):
+        await asyncio.to_thread(self._write, key, data)
+
+    async def get(self, key: str) -> bytes:
+        return await asyncio.to_thread(self._read, key)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._delete, key)
+
+    async def move(self, source: str, destination: str):
+        await asyncio.to_thread(self._move, source, destination)
+
+
+class S3BlobStore:
+    """Blobs as objects in an S3 (or S3-compatible) bucket"""
+
+    def __init__(self, bucket: str = DOCUMENT_STORE_BUCKET, prefix: str = DOCUMENT_STORE_PREFIX,
+                 endpoint_url: Optional[str] = DOCUMENT_STORE_ENDPOINT_URL, storage_class: Optional[str] = None):
+        if not bucket:
+            raise ValueError("DOCUMENT_STORE_BUCKET is required for the s3 document store")
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+        self._object_args = {"StorageClass": storage_class} if storage_class else {}
+
+    async def put(self, key: str, data: bytes, content_type: str = "application/octet-stream"):
+        # boto3 is blocking, so calls run on the default thread pool
+        await asyncio.to_thread(
+            self.client.put_object, Bucket=self.bucket, Key=self.prefix + key, Body=data, ContentType=content_type,
+            **self._object_args
+        )
+
+    async def put_stream(self, key: str, chunks: AsyncIterator[bytes], content_type: str = "application/octet-stream"):
+        """Small documents go up in one put; larger ones as a multipart upload holding one part in memory"""
+        buffer = bytearray()
+        upload_id = None
+        parts = []
+        try:
+            async for chunk in chunks:
+                buffer.extend(chunk)
+                if len(buffer) >= S3_PART_BYTES:
+                    if upload_id is None:
+                        upload = await asyncio.to_thread(
+                            self.client.create_multipart_upload,
+                            Bucket=self.bucket, Key=self.prefix + key, ContentType=content_type, **self._object_args
+                        )
+                        upload_id = upload["UploadId"]
+                    parts.append(await self._upload_part(key, upload_id, len(parts) + 1, bytes(buffer)))
+                    buffer.clear()
+
+            if upload_id is None:
+                await self.put(key, bytes(buffer), content_type)
+                return
+            if buffer:
+                parts.append(await self._upload_part(key, upload_id, len(parts) + 1, bytes(buffer)))
+            await asyncio.to_thread(
+                self.client.complete_multipart_upload,
+                Bucket=self.bucket, Key=self.prefix + key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+            )
+        except BaseException:
+            if upload_id is not None:
+                await asyncio.to_thread(
+                    self.client.abort_multipart_upload, Bucket=self.bucket, Key=self.prefix + key, UploadId=upload_id
+                )
+            raise
+
+    async def _upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> Dict:
+        response = await asyncio.to_thread(
+            self.client.upload_part,
+            Bucket=self.bucket, Key=self.prefix + key, UploadId=upload_id, PartNumber=part_number, Body=data
+        )
+        return {"ETag": response["ETag"], "PartNumber": part_number}
+
+    async def get(self, key: str) -> bytes:
+        response = await asyncio.to_thread(self.client.get_object, Bucket=self.bucket, Key=self.prefix + key)
+        return await asyncio.to_thread(response["Body"].read)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=self.prefix + key)
+
+    async def move(self, source: str, destination: str):
+        # Documents are far below the 5 GB single-request copy limit
+        await asyncio.to_thread(
+            self.client.copy_object,
+            Bucket=self.bucket, Key=self.prefix + destination,
+            CopySource={"Bucket": self.bucket, "Key": self.prefix + source}, **self._object_args
+        )
+        await self.delete(source)
+
+
+def create_blob_store():
+    """Blob backend selected by DOCUMENT_STORE_BACKEND"""
+    if DOCUMENT_STORE_BACKEND == "s3":
+        return S3BlobStore()
+    if DOCUMENT_STORE_BACKEND == "local":
+        return LocalBlobStore()
+    raise ValueError(f"Unknown DOCUMENT_STORE_BACKEND: {DOCUMENT_STORE_BACKEND}")
+
+
+def create_cold_blob_store():
+    """Blob backend for originals: a cheaper S3 storage class, or a separate directory locally"""
+    if DOCUMENT_STORE_BACKEND == "s3":
+        return S3BlobStore(prefix=DOCUMENT_COLD_STORE_PREFIX, storage_class=DOCUMENT_COLD_STORAGE_CLASS)
+    if DOCUMENT_STORE_BACKEND == "local":
+        return LocalBlobStore(DOCUMENT_COLD_STORE_PATH)
+    raise ValueError(f"Unknown DOCUMENT_STORE_BACKEND: {DOCUMENT_STORE_BACKEND}")
+
+
+class DocumentStore:
+    """Verification documents: one metadata document per upload, the image itself in a blob store.
+
+    Blobs are content-addressed by the SHA-256 of their bytes, so re-uploading the same image
+    stores it once. A blob reference record (in blob_refs) lists the documents using a blob and
+    tracks where its original and normalized copies live; the blob is removed with its last reference.
+    """
+
+    def __init__(self, collection, blob_refs, blobs=None, cold_blobs=None):
+        self.collection = collection
+        self.blob_refs = blob_refs
+        self.blobs = blobs or create_blob_store()
+        self.cold_blobs = cold_blobs or create_cold_blob_store()
+
+    async def save(self, doc_type: str, user_id: str, user_email: str, data: bytes,
+                   content_type: str = "application/octet-stream", doc_id: str = None, **fields) -> Dict:
+        """Store an in-memory image and its pending metadata record"""
+        return await self.save_stream(doc_type, user_id, user_email, single_chunk(data), content_type, doc_id, **fields)
+
+    async def save_stream(self, doc_type: str, user_id: str, user_email: str, chunks: AsyncIterator[bytes],
+                          content_type: str = "application/octet-stream", doc_id: str = None,
+                          max_bytes: int = MAX_DOCUMENT_BYTES, **fields) -> Dict:
+        """Stream an image to the blob store, hashing and size-checking it on the way, then record its metadata"""
+        doc_id = doc_id or f"{doc_type}_{user_id}_{uuid.uuid4().hex[:8]}"
+        # The content key is only known once the whole stream is hashed
+        staging_key = f"uploads/{doc_id}"
+        digest = hashlib.sha256()
+        size = 0
+
+        async def measured():
+            nonlocal size
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise DocumentTooLargeError(f"Documents are limited to {max_bytes // (1024 * 1024)} MB")
+                digest.update(chunk)
+                yield chunk
+
+        await self.blobs.put_stream(staging_key, measured(), content_type)
+        sha256 = digest.hexdigest()
+        deduplicated = await self._add_reference(sha256, staging_key, doc_id, content_type, size)
+
+        document = {
+            "id": doc_id,
+            "type": doc_type,
+            "user_id": user_id,
+            "user_email": user_email,
+            "blob_key": content_key(sha256),
+            "content_type": content_type,
+            "size_bytes": size,
+            "sha256": sha256,
+            "deduplicated": deduplicated,
+            "status": DOCUMENT_PENDING,
+            "uploaded_at": datetime.now().isoformat(),
+            **fields
+        }
+        await self.collection.insert_one(dict(document))
+        return document
+
+    async def _add_reference(self, sha256: str, staging_key: str, doc_id: str, content_type: str, size: int) -> bool:
+        """Point doc_id at the blob for sha256, keeping the staged upload only if the blob is new"""
+        # Take the reference before touching any blob: once ref_count counts this document,
+        # a concurrent delete() of the last other reference can no longer release the blob
+        for _ in range(2):
+            try:
+                result = await self.blob_refs.update_one(
+                    {"sha256": sha256},
+                    {
+                        "$setOnInsert": {
+                            "sha256": sha256,
+                            "blob_key": content_key(sha256),
+                            "content_type": content_type,
+                            "size_bytes": size,
+                            "original_storage": "hot",
+                            "created_at": datetime.now().isoformat()
+                        },
+                        "$addToSet": {"doc_ids": doc_id},
+                        "$inc": {"ref_count": 1}
+                    },
+                    upsert=True
+                )
+                break
+            except DuplicateKeyError:
+                # An identical upload inserted the record at the same moment; the retry updates it
+                continue
+        else:
+            await self.blobs.delete(staging_key)
+            raise RuntimeError(f"Could not reference blob {sha256} for {doc_id}")
+
+        if result.upserted_id is None:
+            await self.blobs.delete(staging_key)
+            return True
+
+        # This upload created the record, so its staged copy becomes the blob
+        try:
+            await self.blobs.move(staging_key, content_key(sha256))
+        except BaseException:
+            await self._release_reference(sha256, doc_id)
+            raise
+        return False
+
+    async def delete(self, doc_id: str) -> bool:
+        """Remove a document, and its blob once no other document references it"""
+        document = await self.collection.find_one_and_delete({"id": doc_id}, {"_id": 0, "sha256": 1})
+        if document is None:
+            return False
+
+        await self._release_reference(document["sha256"], doc_id)
+        return True
+
+    async def _release_reference(self, sha256: str, doc_id: str):
+        """Drop doc_id's reference to a blob, deleting the blob with its last reference"""
+        blob = await self.blob_refs.find_one_and_update(
+            {"sha256": sha256, "doc_ids": doc_id},
+            {"$pull": {"doc_ids": doc_id}, "$inc": {"ref_count": -1}},
+            projection={"_id": 0, "ref_count": 1}
+        )
+        if blob is not None and blob["ref_count"] <= 1:
+            released = await self.blob_refs.find_one_and_delete(
+                {"sha256": sha256, "ref_count": {"$lte": 0}}, {"_id": 0}
+            )
+            if released is not None:
+                await self._delete_blobs(released)
+
+    async def _delete_blobs(self, blob: Dict):
+        original_blobs = self.cold_blobs if blob.get("original_storage") == "cold" else self.blobs
+        await original_blobs.delete(blob["blob_key"])
+        for key in (blob.get("review_key"), blob.get("thumbnail_key")):
+            if key:
+                await self.blobs.delete(key)
+
+    async def record_result(self, doc_id: str, result: Dict):
+        """Attach a verification outcome to a document"""
+        await self.collection.update_one(
+            {"id": doc_id},
+            {"$set": {**result, "processed_at": datetime.now().isoformat()}}
+        )
+
+    async def get(self, doc_id: str) -> Optional[Dict]:
+        return await self.collection.find_one({"id": doc_id}, {"_id": 0})
+
+    async def get_blob(self, sha256: str) -> Optional[Dict]:
+        return await self.blob_refs.find_one({"sha256": sha256}, {"_id": 0, "doc_ids": 0})
+
+    async def latest(self, user_id: str, doc_type: str) -> Optional[Dict]:
+        """Most recent document of a type for a user (served by the user_type_uploaded_at index)"""
+        return await self.collection.find_one(
+            {"user_id": user_id, "type": doc_type}, {"_id": 0}, sort=[("uploaded_at", -1)]
+        )
+
+    async def previous_result(self, document: Dict) -> Optional[Dict]:
+        """The latest approved or rejected verdict on an earlier upload of the same image by the same user"""
+        query = {
+            "user_id": document["user_id"],
+            "sha256": document["sha256"],
+            "type": document["type"],
+            "id": {"$ne": document["id"]},
+            "status": {"$in": REUSABLE_STATUSES}
+        }
+        if "cert_type" in document:
+            query["cert_type"] = document["cert_type"]
+        return await self.collection.find_one(query, {"_id": 0}, sort=[("processed_at", -1)])
+
+    async def store_renditions(self, blob: Dict, original: bytes, normalized: Dict):
+        """Keep the normalized review copy and thumbnail hot and move the original to cold storage"""
+        blob_key = blob["blob_key"]
+        review_key = f"{blob_key}.review"
+        thumbnail_key = f"{blob_key}.thumbnail"
+        await self.blobs.put(review_key, normalized["review"], normalized["content_type"])
+        await self.blobs.put(thumbnail_key, normalized["thumbnail"], normalized["content_type"])
+        await self.cold_blobs.put(blob_key, original, blob["content_type"])
+
+        await self.blob_refs.update_one(
+            {"sha256": blob["sha256"]},
+            {"$set": {
+                "original_storage": "cold",
+                "review_key": review_key,
+                "review_size_bytes": len(normalized["review"]),
+                "thumbnail_key": thumbnail_key,
+                "thumbnail_size_bytes": len(normalized["thumbnail"]),
+                "rendition_content_type": normalized["content_type"],
+                "image": {
+                    "width": normalized["width"],
+                    "height": normalized["height"],
+                    "original_width": normalized["original_width"],
+                    "original_height": normalized["original_height"]
+                }
+            }}
+        )
+        # Only drop the hot original once the reference record points at the cold copy
+        await self.blobs.delete(blob_key)
+
+    async def read_image(self, doc_id: str, rendition: str = RENDITION_REVIEW) -> Optional[Tuple[bytes, str]]:
+        """Bytes and content type of a document image; without normalized copies every rendition is the original"""
+        document = await self.collection.find_one({"id": doc_id}, {"_id": 0, "sha256": 1})
+        if document is None:
+            return None
+        blob = await self.get_blob(document["sha256"])
+        if blob is None:
+            return None
+        return await self.read_rendition(blob, rendition)
+
+    async def read_rendition(self, blob: Dict, rendition: str = RENDITION_REVIEW) -> Tuple[bytes, str]:
+        if rendition != RENDITION_ORIGINAL and blob.get("review_key"):
+            key = blob["review_key"] if rendition == RENDITION_REVIEW else blob["thumbnail_key"]
+            return await self.blobs.get(key), blob["rendition_content_type"]
+
+        blobs = self.cold_blobs if blob.get("original_storage") == "cold" else self.blobs
+        return await blobs.get(blob["blob_key"]), blob["content_type"]
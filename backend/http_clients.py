@@ -0,0 +1,68 @@
+"""
+Shared, pooled HTTP clients for LiftLink's upstream APIs
+"""
+import os
+import importlib.util
+from typing import Dict, Optional, Union
+import httpx
+
+# Defaults, overridable per upstream when registering
+HTTP_MAX_CONNECTIONS = int(os.environ.get('HTTP_MAX_CONNECTIONS', '100'))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('HTTP_MAX_KEEPALIVE_CONNECTIONS', '20'))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.environ.get('HTTP_KEEPALIVE_EXPIRY_SECONDS', '30'))
+HTTP_TIMEOUT_SECONDS = float(os.environ.get('HTTP_TIMEOUT_SECONDS', '10'))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.environ.get('HTTP_CONNECT_TIMEOUT_SECONDS', '5'))
+
+
+def http2_available() -> bool:
+    """httpx only speaks HTTP/2 when the optional h2 package is installed"""
+    return importlib.util.find_spec("h2") is not None
+
+
+class HttpClientRegistry:
+    """One keep-alive httpx.AsyncClient per upstream, created on first use and closed with the app"""
+
+    def __init__(self):
+        self._configs: Dict[str, Dict] = {}
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def register(self, name: str, max_connections: Optional[int] = None,
+                 max_keepalive_connections: Optional[int] = None,
+                 timeout_seconds: Optional[float] = None, verify: Union[bool, str] = True):
+        """Configure pool limits, timeouts and TLS verification for an upstream before its client is first used"""
+        self._configs[name] = {
+            "max_connections": max_connections or HTTP_MAX_CONNECTIONS,
+            "max_keepalive_connections": max_keepalive_connections or HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            "timeout_seconds": timeout_seconds or HTTP_TIMEOUT_SECONDS,
+            "verify": verify
+        }
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """Shared client for an upstream; never close it yourself"""
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            if name not in self._configs:
+                self.register(name)
+            config = self._configs[name]
+            client = httpx.AsyncClient(
+                http2=http2_available(),
+                limits=httpx.Limits(
+                    max_connections=config["max_connections"],
+                    max_keepalive_connections=config["max_keepalive_connections"],
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS
+                ),
+                timeout=httpx.Timeout(config["timeout_seconds"], connect=HTTP_CONNECT_TIMEOUT_SECONDS),
+                verify=config["verify"]
+            )
+            self._clients[name] = client
+        return client
+
+    async def aclose(self):
+        """Close every pool; called on app shutdown"""
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+
+# Process-wide registry shared by the API and its services
+http_clients = HttpClientRegistry()
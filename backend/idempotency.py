@@ -0,0 +1,104 @@
+"""
+Idempotency-Key handling for LiftLink's payment endpoints
+"""
+import os
+import json
+import hashlib
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+from pymongo.errors import DuplicateKeyError
+
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+# How long a request may hold a key before a retry is allowed to take it over
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '60'))
+
+KEY_IN_PROGRESS = "in_progress"
+KEY_COMPLETED = "completed"
+
+
+def idempotency_index_specs() -> List[Dict]:
+    """Indexes the idempotency key collection needs (see db_indexes.INDEX_SPECS)"""
+    return [
+        # Replay protection relies on this index rejecting a second claim on a key
+        {"name": "key_unique", "keys": [("key", 1)], "unique": True, "required": True},
+        {"name": "expires_at_ttl", "keys": [("expires_at", 1)], "expireAfterSeconds": 0},
+    ]
+
+
+def request_fingerprint(request_body) -> str:
+    return hashlib.sha256(json.dumps(request_body, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyConflictError(Exception):
+    """The key is held by a request still in flight, or was used for a different request"""
+
+
+class IdempotencyStore:
+    """Stores the response for each (scope, Idempotency-Key) so client retries replay it instead of re-running"""
+
+    def __init__(self, collection, ttl_hours: int = IDEMPOTENCY_TTL_HOURS,
+                 lock_seconds: int = IDEMPOTENCY_LOCK_SECONDS):
+        self.collection = collection
+        self.ttl_hours = ttl_hours
+        self.lock_seconds = lock_seconds
+
+    async def run(self, scope: str, idempotency_key: Optional[str], request_body,
+                  produce: Callable[[Optional[str]], Awaitable[Dict]]) -> Dict:
+        """Return the stored response for a replayed key, otherwise produce(key) and store its result.
+
+        produce receives the scoped key to forward to Stripe, or None when the client sent no key.
+        """
+        if not idempotency_key:
+            return await produce(None)
+
+        key = f"{scope}:{idempotency_key}"
+        stored = await self._claim(key, request_fingerprint(request_body))
+        if stored is not None:
+            return stored
+
+        try:
+            response = await produce(key)
+        except Exception:
+            # Nothing was stored, so the client may retry with the same key
+            await self.collection.delete_one({"key": key, "status": KEY_IN_PROGRESS})
+            raise
+
+        await self.collection.update_one(
+            {"key": key},
+            {"$set": {"status": KEY_COMPLETED, "response": response, "completed_at": datetime.now().isoformat()},
+             "$unset": {"locked_until": ""}}
+        )
+        return response
+
+    async def _claim(self, key: str, fingerprint: str) -> Optional[Dict]:
+        now = datetime.now(timezone.utc)
+        try:
+            await self.collection.insert_one({
+                "key": key,
+                "request_hash": fingerprint,
+                "status": KEY_IN_PROGRESS,
+                "locked_until": now + timedelta(seconds=self.lock_seconds),
+                "created_at": datetime.now().isoformat(),
+                "expires_at": now + timedelta(hours=self.ttl_hours)
+            })
+            return None
+        except DuplicateKeyError:
+            pass
+
+        existing = await self.collection.find_one({"key": key}, {"_id": 0})
+        if existing is None:
+            # Expired between our insert and read
+            return await self._claim(key, fingerprint)
+        if existing["request_hash"] != fingerprint:
+            raise IdempotencyConflictError("Idempotency-Key was already used for a different request")
+        if existing["status"] == KEY_COMPLETED:
+            return existing["response"]
+
+        # Take over a key whose request died without finishing
+        taken = await self.collection.update_one(
+            {"key": key, "status": KEY_IN_PROGRESS, "locked_until": {"$lt": now}},
+            {"$set": {"locked_until": now + timedelta(seconds=self.lock_seconds)}}
+        )
+        if taken.modified_count:
+            return None
+        raise IdempotencyConflictError("A request with this Idempotency-Key is still in progress")
@@ -0,0 +1,71 @@
+"""
+Normalization for verification images: one decode, EXIF stripped, review-sized copy and thumbnail
+"""
+import io
+import os
+from typing import Dict, Optional
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Longest side of the copy reviewers and the verification vendor see
+IMAGE_REVIEW_MAX_DIMENSION = int(os.environ.get('IMAGE_REVIEW_MAX_DIMENSION', '2048'))
+IMAGE_THUMBNAIL_DIMENSION = int(os.environ.get('IMAGE_THUMBNAIL_DIMENSION', '320'))
+# webp or jpeg
+IMAGE_REVIEW_FORMAT = os.environ.get('IMAGE_REVIEW_FORMAT', 'webp').lower()
+IMAGE_REVIEW_QUALITY = int(os.environ.get('IMAGE_REVIEW_QUALITY', '80'))
+IMAGE_THUMBNAIL_QUALITY = int(os.environ.get('IMAGE_THUMBNAIL_QUALITY', '70'))
+
+CONTENT_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+# Refuse decompression bombs well before they exhaust memory (a 12 MP photo is ~12M pixels)
+Image.MAX_IMAGE_PIXELS = 80_000_000
+
+
+def _encode(image: Image.Image, image_format: str, quality: int) -> bytes:
+    # Saving without exif=... drops EXIF (GPS, device, timestamps) from the output
+    output = io.BytesIO()
+    if image_format == "jpeg":
+        image.convert("RGB").save(output, "JPEG", quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(output, "WEBP", quality=quality, method=4)
+    return output.getvalue()
+
+
+def normalize_image(data: bytes, max_dimension: int = IMAGE_REVIEW_MAX_DIMENSION,
+                    thumbnail_dimension: int = IMAGE_THUMBNAIL_DIMENSION,
+                    image_format: str = IMAGE_REVIEW_FORMAT, quality: int = IMAGE_REVIEW_QUALITY,
+                    thumbnail_quality: int = IMAGE_THUMBNAIL_QUALITY) -> Optional[Dict]:
+    """Review copy and thumbnail of an image, or None when the bytes are not an image Pillow can read.
+
+    CPU-bound: run it in a process pool. The image is decoded once; for JPEGs the decoder is
+    asked for a reduced scale up front, so a 12 MP photo is never fully decoded just to shrink it.
+    """
+    if image_format not in CONTENT_TYPES:
+        raise ValueError(f"Unsupported review format: {image_format}")
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        original_size = image.size
+        image.draft("RGB", (max_dimension, max_dimension))
+        # Apply the EXIF orientation to the pixels before the EXIF is dropped
+        image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        return None
+
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() or image.mode == "P" else "RGB")
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    review = _encode(image, image_format, quality)
+
+    thumbnail = image.copy()
+    thumbnail.thumbnail((thumbnail_dimension, thumbnail_dimension), Image.LANCZOS)
+
+    return {
+        "review": review,
+        "thumbnail": _encode(thumbnail, image_format, thumbnail_quality),
+        "content_type": CONTENT_TYPES[image_format],
+        "width": image.width,
+        "height": image.height,
+        "original_width": original_size[0],
+        "original_height": original_size[1]
+    }
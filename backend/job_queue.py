@@ -0,0 +1,199 @@
+"""
+Durable background job queue for LiftLink, backed by a MongoDB collection
+"""
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+
+def job_index_specs() -> List[Dict]:
+    """Indexes a JobQueue collection needs (see db_indexes.INDEX_SPECS)"""
+    return [
+        {"name": "id_unique", "keys": [("id", 1)], "unique": True},
+        {"name": "status_created_at", "keys": [("status", 1), ("created_at", 1)]},
+        # At most one queued job per coalesce key
+        {"name": "queued_coalesce_key_unique", "keys": [("coalesce_key", 1)], "unique": True,
+         "partialFilterExpression": {"status": JOB_QUEUED}, "required": True},
+        # Finished jobs are removed once they expire
+        {"name": "expires_at_ttl", "keys": [("expires_at", 1)], "expireAfterSeconds": 0},
+    ]
+
+
+class JobQueue:
+    """Runs handler(payload, report_progress) for queued jobs on a pool of asyncio workers.
+
+    Jobs live in MongoDB, so they survive restarts: a claimed job holds a lease, and a job whose
+    worker died is picked up again once the lease expires.
+    """
+
+    def __init__(self, collection, handler: Callable[[Dict, Callable], Awaitable[Dict]],
+                 workers: int = 2, lease_seconds: int = 300, max_attempts: int = 3,
+                 poll_interval: float = 5.0, retention_days: int = 7):
+        self.collection = collection
+        self.handler = handler
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.retention_days = retention_days
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._next_sweep = 0.0
+
+    async def enqueue(self, coalesce_key: str, payload: Dict) -> Dict:
+        """Queue a job, or return the job already waiting under the same coalesce key"""
+        job_id = str(uuid.uuid4())
+        now = datetime.now().isoformat()
+
+        for _ in range(2):
+            try:
+                job = await self.collection.find_one_and_update(
+                    {"coalesce_key": coalesce_key, "status": JOB_QUEUED},
+                    {
+                        "$setOnInsert": {
+                            "id": job_id,
+                            "coalesce_key": coalesce_key,
+                            "payload": payload,
+                            "status": JOB_QUEUED,
+                            "attempts": 0,
+                            "progress": {},
+                            "created_at": now
+                        },
+                        "$set": {"updated_at": now}
+                    },
+                    projection={"_id": 0},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                break
+            except DuplicateKeyError:
+                # Another request queued the same key between our find and insert; the retry matches it
+                continue
+        else:
+            # The queued job we collided with was claimed before the retry could match it, twice
+            raise RuntimeError(f"Could not enqueue job for {coalesce_key}: queued job kept changing")
+
+        self._wakeup.set()
+        job["coalesced"] = job["id"] != job_id
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        return await self.collection.find_one({"id": job_id}, {"_id": 0})
+
+    async def start(self):
+        """Start the worker pool"""
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Cancel the workers; jobs they were running are re-claimed after their lease expires"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            if time.monotonic() >= self._next_sweep:
+                self._next_sweep = time.monotonic() + self.poll_interval
+                try:
+                    await self._fail_abandoned()
+                except Exception as e:
+                    logging.error(f"Abandoned job sweep failed: {e}")
+
+            try:
+                job = await self._claim()
+            except Exception as e:
+                logging.error(f"Job claim failed: {e}")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            await self._run(job)
+
+    async def _claim(self) -> Optional[Dict]:
+        # Only id and payload are needed from the pre-claim document
+        now = datetime.now(timezone.utc)
+        return await self.collection.find_one_and_update(
+            {"$or": [
+                {"status": JOB_QUEUED},
+                {"status": JOB_RUNNING, "lease_expires_at": {"$lt": now}, "attempts": {"$lt": self.max_attempts}}
+            ]},
+            {
+                "$set": {
+                    "status": JOB_RUNNING,
+                    "started_at": datetime.now().isoformat(),
+                    "lease_expires_at": now + timedelta(seconds=self.lease_seconds)
+                },
+                "$inc": {"attempts": 1}
+            },
+            projection={"_id": 0, "id": 1, "payload": 1},
+            sort=[("created_at", 1)]
+        )
+
+    async def _fail_abandoned(self) -> int:
+        """Fail running jobs whose lease expired on their last attempt; _claim never picks them up again"""
+        now = datetime.now(timezone.utc)
+        result = await self.collection.update_many(
+            {"status": JOB_RUNNING, "lease_expires_at": {"$lt": now}, "attempts": {"$gte": self.max_attempts}},
+            {
+                "$set": {
+                    "status": JOB_FAILED,
+                    "error": f"Worker lease expired on attempt {self.max_attempts} of {self.max_attempts}",
+                    "finished_at": datetime.now().isoformat(),
+                    "updated_at": datetime.now().isoformat(),
+                    "expires_at": now + timedelta(days=self.retention_days)
+                },
+                "$unset": {"lease_expires_at": ""}
+            }
+        )
+        if result.modified_count:
+            logging.warning(f"Failed {result.modified_count} jobs abandoned after {self.max_attempts} attempts")
+        return result.modified_count
+
+    async def _run(self, job: Dict):
+        async def report_progress(progress: Dict):
+            await self.collection.update_one(
+                {"id": job["id"]},
+                {"$set": {"progress": progress, "updated_at": datetime.now().isoformat()}}
+            )
+
+        try:
+            result = await asyncio.wait_for(
+                self.handler(job["payload"], report_progress),
+                timeout=self.lease_seconds
+            )
+            update = {"status": JOB_SUCCEEDED, "result": result}
+        except Exception as e:
+            logging.error(f"Job {job['id']} failed: {e}")
+            update = {"status": JOB_FAILED, "error": str(e) or type(e).__name__}
+
+        await self.collection.update_one(
+            {"id": job["id"]},
+            {
+                "$set": {
+                    **update,
+                    "finished_at": datetime.now().isoformat(),
+                    "updated_at": datetime.now().isoformat(),
+                    "expires_at": datetime.now(timezone.utc) + timedelta(days=self.retention_days)
+                },
+                "$unset": {"lease_expires_at": ""}
+            }
+        )
@@ -0,0 +1,207 @@
+"""
+Local payments ledger and per-trainer running earnings totals for LiftLink
+"""
+import os
+import asyncio
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+PAYMENT_PENDING = "pending"
+PAYMENT_SUCCEEDED = "succeeded"
+PAYMENT_FAILED = "failed"
+
+# Payments kept inline on the earnings document for the dashboard
+RECENT_PAYMENTS_LIMIT = 5
+
+# PaymentIntents fetched per Stripe list call during a backfill (Stripe's maximum)
+STRIPE_PAGE_SIZE = 100
+
+
+class PaymentLedger:
+    def __init__(self, db):
+        self.payments = db.payments
+        self.earnings = db.trainer_earnings
+
+    async def record_payment_intent(self, payment: Dict, session_type: str = "Personal Training",
+                                    created_at: Optional[datetime] = None):
+        """Add a newly created PaymentIntent to the ledger as pending"""
+        entry = {
+            "id": payment["id"],
+            "trainer_id": payment["trainer_id"],
+            "client_id": payment.get("client_id"),
+            "session_id": payment.get("session_id"),
+            "session_type": session_type,
+            "amount": payment["amount"],
+            "currency": payment.get("currency", "usd"),
+            "status": PAYMENT_PENDING,
+            "created_at": (created_at or datetime.now()).isoformat()
+        }
+
+        # Upsert on the PaymentIntent id so a replayed call cannot count it twice
+        result = await self.payments.update_one({"id": entry["id"]}, {"$setOnInsert": entry}, upsert=True)
+        if result.upserted_id is None:
+            return
+
+        await self.earnings.update_one(
+            {"trainer_id": entry["trainer_id"]},
+            {
+                "$inc": {"pending_cents": entry["amount"]},
+                "$set": {"updated_at": datetime.now().isoformat()}
+            },
+            upsert=True
+        )
+
+    async def mark_succeeded(self, payment_intent_id: str, paid_at: Optional[datetime] = None) -> Optional[Dict]:
+        """Move a pending payment into the trainer's earned totals; None if it was not pending"""
+        entry = await self._settle(payment_intent_id, PAYMENT_SUCCEEDED)
+        if entry is None:
+            return None
+
+        # A backfilled payment is filed under the month it was actually made
+        paid_at = paid_at or datetime.now()
+        await self.earnings.update_one(
+            {"trainer_id": entry["trainer_id"]},
+            {
+                "$inc": {
+                    "pending_cents": -entry["amount"],
+                    "total_cents": entry["amount"],
+                    f"monthly_cents.{paid_at.strftime('%Y-%m')}": entry["amount"],
+                    "completed_sessions": 1
+                },
+                "$push": {"recent_payments": {
+                    "$each": [{
+                        "id": entry["id"],
+                        "amount": entry["amount"] / 100,
+                        "date": paid_at.isoformat(),
+                        "client_name": entry.get("client_id") or "Unknown",
+                        "session_type": entry.get("session_type", "Personal Training"),
+                        "stripe_charge": True
+                    }],
+                    # Newest first, even when a backfill adds older payments after newer ones
+                    "$sort": {"date": -1},
+                    "$slice": RECENT_PAYMENTS_LIMIT
+                }},
+                "$set": {"updated_at": datetime.now().isoformat()}
+            },
+            upsert=True
+        )
+        return entry
+
+    async def mark_failed(self, payment_intent_id: str) -> Optional[Dict]:
+        """Drop a pending payment from the trainer's pending total"""
+        entry = await self._settle(payment_intent_id, PAYMENT_FAILED)
+        if entry is None:
+            return None
+
+        await self.earnings.update_one(
+            {"trainer_id": entry["trainer_id"]},
+            {
+                "$inc": {"pending_cents": -entry["amount"]},
+                "$set": {"updated_at": datetime.now().isoformat()}
+            }
+        )
+        return entry
+
+    async def backfill(self, payment_intents: Iterable[Dict]) -> Dict:
+        """Load PaymentIntents made before the ledger existed into the payments and earnings totals.
+
+        Only intents with a trainer_id in their metadata belong to a trainer. Every step is
+        idempotent, so intents already in the ledger, or a second run, change nothing.
+        """
+        counts = {"recorded": 0, "succeeded": 0, "failed": 0, "skipped": 0}
+        for intent in payment_intents:
+            metadata = intent.get("metadata") or {}
+            if not metadata.get("trainer_id"):
+                counts["skipped"] += 1
+                continue
+
+            created_at = datetime.fromtimestamp(intent["created"])
+            await self.record_payment_intent(
+                {
+                    "id": intent["id"],
+                    "trainer_id": metadata["trainer_id"],
+                    "client_id": metadata.get("client_id"),
+                    "session_id": metadata.get("session_id"),
+                    # What was actually captured, as the payment webhooks record it
+                    "amount": intent.get("amount_received") or intent["amount"],
+                    "currency": intent.get("currency", "usd")
+                },
+                metadata.get("session_type", "Personal Training"),
+                created_at=created_at
+            )
+            counts["recorded"] += 1
+
+            if intent["status"] == "succeeded":
+                counts["succeeded"] += int(await self.mark_succeeded(intent["id"], paid_at=created_at) is not None)
+            elif intent["status"] == "canceled":
+                counts["failed"] += int(await self.mark_failed(intent["id"]) is not None)
+            # Anything else is still open and stays pending until its webhook arrives
+        return counts
+
+    async def get_payment(self, payment_intent_id: str) -> Optional[Dict]:
+        return await self.payments.find_one({"id": payment_intent_id}, {"_id": 0})
+
+    async def _settle(self, payment_intent_id: str, status: str) -> Optional[Dict]:
+        # Only the pending -> settled transition touches the totals, so repeats are no-ops
+        return await self.payments.find_one_and_update(
+            {"id": payment_intent_id, "status": PAYMENT_PENDING},
+            {"$set": {"status": status, "settled_at": datetime.now().isoformat()}},
+            projection={"_id": 0}
+        )
+
+    async def get_trainer_earnings(self, trainer_id: str) -> Dict:
+        """Earnings summary for a trainer from a single indexed read"""
+        month = datetime.now().strftime('%Y-%m')
+        summary = await self.earnings.find_one(
+            {"trainer_id": trainer_id},
+            {
+                "_id": 0,
+                "total_cents": 1,
+                "pending_cents": 1,
+                "completed_sessions": 1,
+                "recent_payments": 1,
+                f"monthly_cents.{month}": 1
+            }
+        ) or {}
+
+        total_cents = summary.get("total_cents", 0)
+        completed_sessions = summary.get("completed_sessions", 0)
+
+        return {
+            "total_earnings": total_cents / 100,
+            "this_month": summary.get("monthly_cents", {}).get(month, 0) / 100,
+            "pending_payments": summary.get("pending_cents", 0) / 100,
+            "completed_sessions": completed_sessions,
+            "avg_session_rate": round(total_cents / completed_sessions / 100, 2) if completed_sessions else 0.0,
+            "stripe_earnings": total_cents / 100,
+            "recent_payments": summary.get("recent_payments", [])
+        }
+
+
+def _list_payment_intents() -> list:
+    """Every PaymentIntent on the Stripe account"""
+    import stripe
+
+    return [intent.to_dict() for intent in stripe.PaymentIntent.list(limit=STRIPE_PAGE_SIZE).auto_paging_iter()]
+
+
+async def _run_backfill():
+    import stripe
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    stripe.api_key = os.environ['STRIPE_SECRET_KEY']
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    ledger = PaymentLedger(client.test_database)
+
+    # The Stripe SDK blocks, so page through it off the event loop
+    payment_intents = await asyncio.to_thread(_list_payment_intents)
+    counts = await ledger.backfill(payment_intents)
+    print(f"💳 Backfilled {counts['recorded']} trainer payments from {len(payment_intents)} PaymentIntents: "
+          f"{counts['succeeded']} succeeded, {counts['failed']} canceled, {counts['skipped']} without a trainer")
+
+
+if __name__ == "__main__":
+    # Usage: python payment_ledger.py
+    asyncio.run(_run_backfill())
@@ -1,8 +1,11 @@
 """
-Stripe payment integration for LiftLink trainer earnings and session payments
+Stripe payment integration for LiftLink session payments and trainer payouts
 """
 import os
+import asyncio
+import functools
 import stripe
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Optional
 import logging
 from datetime import datetime
@@ -10,6 +13,17 @@ from datetime import datetime
 # Set Stripe API key
 stripe.api_key = os.environ.get('STRIPE_SECRET_KEY')
 
+# Blocking Stripe calls run on a bounded thread pool; these cap how many run at once and for how long
+STRIPE_MAX_CONCURRENCY = int(os.environ.get('STRIPE_MAX_CONCURRENCY', '8'))
+STRIPE_TIMEOUT_SECONDS = float(os.environ.get('STRIPE_TIMEOUT_SECONDS', '20'))
+
+# Make the SDK give up on its own, so a timed-out call does not pin a pool thread for the 80s default
+_RequestsClient = getattr(stripe, 'RequestsClient', None) or stripe.http_client.RequestsClient
+stripe.default_http_client = _RequestsClient(timeout=STRIPE_TIMEOUT_SECONDS)
+
+class PaymentTimeoutError(Exception):
+    """A Stripe call did not finish within STRIPE_TIMEOUT_SECONDS"""
+
 class PaymentService:
     def __init__(self):
         self.stripe_key = os.environ.get('STRIPE_SECRET_KEY')
@@ -19,7 +33,8 @@ class PaymentService:
             stripe.api_key = self.stripe_key
             print(f"🔑 Stripe API key configured: {self.stripe_key[:12]}...")
         
-    def create_payment_intent(self, amount: int, trainer_id: str, client_id: str, session_id: str) -> Optional[Dict]:
+    def create_payment_intent(self, amount: int, trainer_id: str, client_id: str, session_id: str,
+                              idempotency_key: str = None) -> Optional[Dict]:
         """Create a real Stripe payment intent for session payment"""
         try:
             if not self.stripe_key:
@@ -37,7 +52,8 @@ class PaymentService:
                     'purpose': 'session_payment'
                 },
                 description=f'LiftLink Training Session - Trainer {trainer_id}',
-                automatic_payment_methods={'enabled': True}
+                automatic_payment_methods={'enabled': True},
+                idempotency_key=idempotency_key
             )
             
             print(f"💳 STRIPE PAYMENT INTENT CREATED: ${amount/100:.2f} for trainer {trainer_id}")
@@ -85,115 +101,6 @@ class PaymentService:
             logging.error(f"Payment confirmation failed: {e}")
             return False
     
-    def get_trainer_earnings(self, trainer_id: str, start_date: str = None, end_date: str = None) -> Dict:
-        """Get trainer earnings from Stripe data and mock recent data"""
-        try:
-            if not self.stripe_key:
-                print("❌ STRIPE ERROR: No API key configured, returning mock data")
-                return self._get_mock_earnings()
-                
-            # In a real implementation, you would query Stripe for actual payment data
-            # For now, we'll get some basic account info and combine with mock data
-            
-            # Get recent charges for this trainer (if any)
-            charges = stripe.Charge.list(
-                limit=10,
-                expand=['data.payment_intent']
-            )
-            
-            # Filter charges for this trainer (from metadata)
-            trainer_charges = []
-            total_stripe_earnings = 0
-            
-            for charge in charges.data:
-                if (charge.payment_intent and 
-                    charge.payment_intent.metadata and 
-                    charge.payment_intent.metadata.get('trainer_id') == trainer_id):
-                    trainer_charges.append(charge)
-                    if charge.status == 'succeeded':
-                        total_stripe_earnings += charge.amount
-            
-            # Combine with mock data for demo purposes
-            mock_earnings = {
-                "total_earnings": (total_stripe_earnings / 100) + 1800.00,  # Add Stripe earnings to mock base
-                "this_month": (total_stripe_earnings / 100) + 450.00,
-                "pending_payments": 75.00,
-                "completed_sessions": len(trainer_charges) + 18,
-                "avg_session_rate": 75.00,
-                "stripe_earnings": total_stripe_earnings / 100,
-                "recent_payments": []
-            }
-            
-            # Add Stripe payments to recent payments
-            for charge in trainer_charges[:5]:  # Last 5 payments
-                if charge.status == 'succeeded':
-                    mock_earnings["recent_payments"].append({
-                        "id": charge.id,
-                        "amount": charge.amount / 100,
-                        "date": charge.created,
-                        "client_name": charge.payment_intent.metadata.get('client_id', 'Unknown'),
-                        "session_type": "Personal Training",
-                        "stripe_charge": True
-                    })
-            
-            # Add some mock payments to fill the list
-            if len(mock_earnings["recent_payments"]) < 3:
-                mock_payments = [
-                    {
-                        "id": "pi_mock_001",
-                        "amount": 75.00,
-                        "date": "2025-01-10",
-                        "client_name": "John Doe",
-                        "session_type": "Personal Training",
-                        "stripe_charge": False
-                    },
-                    {
-                        "id": "pi_mock_002", 
-                        "amount": 100.00,
-                        "date": "2025-01-09",
-                        "client_name": "Jane Smith",
-                        "session_type": "Nutrition Consultation",
-                        "stripe_charge": False
-                    }
-                ]
-                mock_earnings["recent_payments"].extend(mock_payments)
-            
-            return mock_earnings
-            
-        except stripe.error.StripeError as e:
-            logging.error(f"Stripe earnings query failed: {e}")
-            print(f"❌ STRIPE ERROR: {e}")
-            return self._get_mock_earnings()
-    
-    def _get_mock_earnings(self):
-        """Return mock earnings data when Stripe is not available"""
-        return {
-            "total_earnings": 1800.00,
-            "this_month": 450.00,
-            "pending_payments": 75.00,
-            "completed_sessions": 18,
-            "avg_session_rate": 75.00,
-            "stripe_earnings": 0.00,
-            "recent_payments": [
-                {
-                    "id": "pi_mock_001",
-                    "amount": 75.00,
-                    "date": "2025-01-10",
-                    "client_name": "John Doe",
-                    "session_type": "Personal Training",
-                    "stripe_charge": False
-                },
-                {
-                    "id": "pi_mock_002", 
-                    "amount": 100.00,
-                    "date": "2025-01-09",
-                    "client_name": "Jane Smith",
-                    "session_type": "Nutrition Consultation",
-                    "stripe_charge": False
-                }
-            ]
-        }
-    
     def process_trainer_payout(self, trainer_id: str, amount: int) -> bool:
         """Process payout to trainer using Stripe Express/Connect (simulated)"""
         try:
@@ -227,7 +134,8 @@ class PaymentService:
             print(f"❌ PAYOUT FAILED: {e}")
             return False
     
-    def create_session_checkout(self, amount: int, trainer_id: str, client_email: str, session_details: Dict) -> Optional[Dict]:
+    def create_session_checkout(self, amount: int, trainer_id: str, client_email: str, session_details: Dict,
+                                idempotency_key: str = None) -> Optional[Dict]:
         """Create a Stripe Checkout session for trainee to pay for session"""
         try:
             if not self.stripe_key:
@@ -255,7 +163,8 @@ class PaymentService:
                     'trainer_id': trainer_id,
                     'session_type': session_details.get('session_type', 'personal_training'),
                     'session_duration': str(session_details.get('duration', 60))
-                }
+                },
+                idempotency_key=idempotency_key
             )
             
             print(f"🛒 STRIPE CHECKOUT CREATED: ${amount/100:.2f}")
@@ -273,4 +182,49 @@ class PaymentService:
         except stripe.error.StripeError as e:
             logging.error(f"Stripe checkout creation failed: {e}")
             print(f"❌ STRIPE CHECKOUT ERROR: {e}")
-            return None
\ No newline at end of file
+            return None
+
+
+class AsyncPaymentService:
+    """Async facade over PaymentService that keeps blocking Stripe calls off the event loop"""
+    
+    def __init__(self, payment_service: PaymentService = None,
+                 max_concurrency: int = STRIPE_MAX_CONCURRENCY,
+                 timeout_seconds: float = STRIPE_TIMEOUT_SECONDS):
+        self.payment_service = payment_service or PaymentService()
+        self.timeout_seconds = timeout_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="stripe")
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+    
+    async def _run(self, func, *args, **kwargs):
+        # Callers beyond the concurrency limit wait here without holding a thread
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            try:
+                return await asyncio.wait_for(
+                    loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs)),
+                    timeout=self.timeout_seconds
+                )
+            except asyncio.TimeoutError:
+                logging.error(f"Stripe call {func.__name__} timed out after {self.timeout_seconds}s")
+                raise PaymentTimeoutError(f"Payment provider did not respond within {self.timeout_seconds:g}s")
+    
+    async def create_payment_intent(self, amount: int, trainer_id: str, client_id: str, session_id: str,
+                                    idempotency_key: str = None) -> Optional[Dict]:
+        return await self._run(self.payment_service.create_payment_intent, amount, trainer_id, client_id, session_id,
+                               idempotency_key=idempotency_key)
+    
+    async def confirm_payment(self, payment_intent_id: str) -> bool:
+        return await self._run(self.payment_service.confirm_payment, payment_intent_id)
+    
+    async def process_trainer_payout(self, trainer_id: str, amount: int) -> bool:
+        return await self._run(self.payment_service.process_trainer_payout, trainer_id, amount)
+    
+    async def create_session_checkout(self, amount: int, trainer_id: str, client_email: str, session_details: Dict,
+                                      idempotency_key: str = None) -> Optional[Dict]:
+        return await self._run(self.payment_service.create_session_checkout, amount, trainer_id, client_email,
+                               session_details, idempotency_key=idempotency_key)
+    
+    def shutdown(self):
+        """Stop accepting work; in-flight Stripe calls finish on their own"""
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,255 @@
+"""
+Per-user tree progress aggregates for LiftLink
+"""
+import os
+import sys
+import asyncio
+import logging
+from datetime import datetime, date, timedelta
+from typing import Dict, List, Optional
+from pymongo.errors import DuplicateKeyError
+
+# Sessions fetched per round trip while streaming a user's history
+SESSION_BATCH_SIZE = 1000
+# A rebuild that keeps losing to concurrent writes gives up after this many passes
+REBUILD_ATTEMPTS = 3
+
+# The fields a rebuild recomputes; anything else on the progress document is left alone
+REBUILT_FIELDS = ("total_sessions", "completed_sessions", "current_streak", "longest_streak", "last_active_day")
+
+
+def session_day(created_at) -> date:
+    """Calendar day a session counts towards"""
+    if isinstance(created_at, datetime):
+        return created_at.date()
+    return datetime.fromisoformat(created_at.replace('Z', '+00:00')).date()
+
+
+def advance_streak(state: Dict, day: date) -> Optional[Dict]:
+    """Apply one active day to a streak state, or None if the day is older than the last one seen"""
+    last_active_day = state.get("last_active_day")
+    current_streak = 1
+
+    if last_active_day is not None:
+        last_day = date.fromisoformat(last_active_day)
+        if day < last_day:
+            return None
+        if day == last_day:
+            return state
+        if day - last_day == timedelta(days=1):
+            current_streak = state.get("current_streak", 0) + 1
+
+    return {
+        "current_streak": current_streak,
+        "longest_streak": max(state.get("longest_streak", 0), current_streak),
+        "last_active_day": day.isoformat()
+    }
+
+
+def current_streak(progress: Dict, today: date = None) -> int:
+    """Stored streak, or 0 once the user has missed a full day since their last session"""
+    last_active_day = progress.get("last_active_day")
+    if not last_active_day:
+        return 0
+
+    today = today or datetime.now().date()
+    if today - date.fromisoformat(last_active_day) > timedelta(days=1):
+        return 0
+    return progress.get("current_streak", 0)
+
+
+def _empty_progress(user_id: str) -> Dict:
+    return {
+        "user_id": user_id,
+        "total_sessions": 0,
+        "completed_sessions": 0,
+        "current_streak": 0,
+        "longest_streak": 0,
+        "last_active_day": None
+    }
+
+
+class ProgressService:
+    def __init__(self, db):
+        self.db = db
+        self.collection = db.tree_progress
+
+    async def record_sessions(self, user_id: str, created_at: List):
+        """Add newly written sessions (given by their created_at values) to the user's progress document"""
+        if not created_at:
+            return
+
+        await self.collection.update_one(
+            {"user_id": user_id},
+            {
+                "$inc": {"total_sessions": len(created_at), "version": 1},
+                "$set": {"updated_at": datetime.now().isoformat()},
+                # No streak fields on insert: a document without last_active_day is what makes
+                # _advance_streak rebuild from db.sessions, which a user with older sessions needs
+                "$setOnInsert": {"completed_sessions": 0}
+            },
+            upsert=True
+        )
+
+        await self._advance_streak(user_id, sorted({session_day(value) for value in created_at}))
+
+    async def _advance_streak(self, user_id: str, days: List[date]):
+        """Move the stored streak forward in O(1), falling back to a rebuild for backdated sessions"""
+        progress = await self.collection.find_one(
+            {"user_id": user_id},
+            {"_id": 0, "current_streak": 1, "longest_streak": 1, "last_active_day": 1}
+        )
+        if progress is None or "last_active_day" not in progress:
+            # New document, or one that predates streak tracking: count the user's whole history
+            await self.rebuild(user_id)
+            return
+
+        state = progress
+        for day in days:
+            state = advance_streak(state, day)
+            if state is None:
+                await self.rebuild(user_id)
+                return
+
+        if state is progress:
+            return
+
+        # Conditional on the day we read so a concurrent writer forces a rebuild instead of a lost update
+        result = await self.collection.update_one(
+            {"user_id": user_id, "last_active_day": progress["last_active_day"]},
+            {"$set": state, "$inc": {"version": 1}}
+        )
+        if result.matched_count == 0:
+            await self.rebuild(user_id)
+
+    async def record_completion(self, user_id: str):
+        """Count a session that was just checked in as completed"""
+        await self.collection.update_one(
+            {"user_id": user_id},
+            {
+                "$inc": {"completed_sessions": 1, "version": 1},
+                "$set": {"updated_at": datetime.now().isoformat()},
+                "$setOnInsert": {"total_sessions": 0}
+            },
+            upsert=True
+        )
+
+    async def get_progress(self, user_id: str) -> Dict:
+        """Read the stored aggregate, building it once for users that predate it"""
+        progress = await self.collection.find_one({"user_id": user_id}, {"_id": 0})
+        if progress is None or "last_active_day" not in progress:
+            progress = await self.rebuild(user_id)
+        return progress
+
+    async def rebuild(self, user_id: str) -> Dict:
+        """Recompute one user's progress document in a single streaming pass over their sessions"""
+        for _ in range(REBUILD_ATTEMPTS):
+            version = await self._version(user_id)
+            progress = _empty_progress(user_id)
+
+            cursor = self.db.sessions.find(
+                {"user_id": user_id},
+                {"_id": 0, "created_at": 1, "status": 1}
+            ).sort("created_at", 1).batch_size(SESSION_BATCH_SIZE)
+
+            async for session in cursor:
+                self._apply_session(progress, session)
+
+            if await self._save(progress, version):
+                return progress
+
+        # Still racing incremental writers: their updates are in the stored document, so serve that
+        logging.warning(f"Tree progress rebuild for {user_id} kept conflicting with concurrent writes")
+        return await self.collection.find_one({"user_id": user_id}, {"_id": 0}) or progress
+
+    async def rebuild_all(self) -> int:
+        """Recompute every user's progress document in a single pass over db.sessions"""
+        # Exactly the reverse of the user_created_at_id index, so MongoDB walks it backwards
+        # (users in descending order, each user's sessions oldest first) instead of sorting in memory
+        cursor = self.db.sessions.find(
+            {},
+            {"_id": 0, "user_id": 1, "created_at": 1, "status": 1}
+        ).sort([("user_id", -1), ("created_at", 1)]).batch_size(SESSION_BATCH_SIZE)
+
+        rebuilt = 0
+        progress = None
+        version = None
+        async for session in cursor:
+            if progress is None or session["user_id"] != progress["user_id"]:
+                if progress is not None:
+                    await self._save_or_rebuild(progress, version)
+                    rebuilt += 1
+                progress = _empty_progress(session["user_id"])
+                version = await self._version(session["user_id"])
+            self._apply_session(progress, session)
+
+        if progress is not None:
+            await self._save_or_rebuild(progress, version)
+            rebuilt += 1
+
+        logging.info(f"Rebuilt tree progress for {rebuilt} users")
+        return rebuilt
+
+    async def _save_or_rebuild(self, progress: Dict, version: Optional[int]):
+        if not await self._save(progress, version):
+            # The user wrote sessions while the pass was reading theirs; redo just that user
+            await self.rebuild(progress["user_id"])
+
+    def _apply_session(self, progress: Dict, session: Dict):
+        progress["total_sessions"] += 1
+        if session.get("status") == "completed":
+            progress["completed_sessions"] += 1
+
+        created_at = session.get("created_at")
+        if created_at:
+            # Sessions arrive sorted by created_at, so the streak never sees an older day
+            progress.update(advance_streak(progress, session_day(created_at)))
+
+    async def _version(self, user_id: str) -> Optional[int]:
+        """Write counter of the stored document (None when there is none), read before a rebuild scans"""
+        stored = await self.collection.find_one({"user_id": user_id}, {"_id": 0, "version": 1})
+        if stored is None:
+            return None
+        return stored.get("version", 0)
+
+    async def _save(self, progress: Dict, version: Optional[int]) -> bool:
+        """Write the recomputed fields unless an incremental update landed since version was read"""
+        progress["updated_at"] = datetime.now().isoformat()
+        fields = {field: progress[field] for field in REBUILT_FIELDS}
+        fields["updated_at"] = progress["updated_at"]
+
+        if version is None:
+            try:
+                await self.collection.insert_one({"user_id": progress["user_id"], **fields, "version": 0})
+                return True
+            except DuplicateKeyError:
+                return False
+
+        # Documents written before versioning have no counter, which reads as 0
+        version_filter = {"$in": [0, None]} if version == 0 else version
+        result = await self.collection.update_one(
+            {"user_id": progress["user_id"], "version": version_filter},
+            {"$set": fields, "$inc": {"version": 1}}
+        )
+        return result.matched_count == 1
+
+
+async def _run_rebuild(user_id: str = None):
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    service = ProgressService(client.test_database)
+
+    if user_id:
+        progress = await service.rebuild(user_id)
+        print(f"🌳 Rebuilt tree progress for user {user_id}: {progress['total_sessions']} sessions")
+    else:
+        rebuilt = await service.rebuild_all()
+        print(f"🌳 Rebuilt tree progress for {rebuilt} users")
+
+
+if __name__ == "__main__":
+    # Usage: python progress_service.py [user_id]
+    asyncio.run(_run_rebuild(sys.argv[1] if len(sys.argv) > 1 else None))
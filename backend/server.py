@@ -1,21 +1,51 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorClient
-from pydantic import BaseModel, EmailStr, Field, validator
+from pydantic import BaseModel, EmailStr, Field, ValidationError, validator
+from pymongo.errors import BulkWriteError, ConnectionFailure
 from typing import List, Optional
 from enum import Enum
 import uuid
 import os
 from datetime import datetime, timedelta
-import httpx
 from urllib.parse import urlencode
 import re
+import io
+import csv
+import json
+import base64
+import binascii
 import logging
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Import services (after load_dotenv so they see the configured keys)
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from payment_service import PaymentService, AsyncPaymentService
+from calendar_service import CalendarService
+from availability_engine import AvailabilityConfig, BusyIndex, day_slots, find_available_trainers, search_window
+from verification_service import VerificationService
+from document_store import (
+    DocumentStore, DocumentTooLargeError, MAX_DOCUMENT_BYTES, UPLOAD_CHUNK_BYTES, single_chunk,
+    RENDITION_ORIGINAL, RENDITION_REVIEW, RENDITION_THUMBNAIL
+)
+from progress_service import ProgressService, current_streak
+from db_indexes import IndexProvisioningError, ensure_indexes, index_report
+from session_writer import SessionBatchWriter, make_session_key
+from job_queue import JobQueue
+from http_clients import http_clients
+from ttl_cache import cache_stats
+from single_flight import SingleFlight, single_flight_stats
+from user_cache import UserCache, current_endpoint
+from payment_ledger import PaymentLedger, PAYMENT_SUCCEEDED
+from idempotency import IdempotencyStore, IdempotencyConflictError
+from stripe_webhooks import PaymentEventProcessor, WebhookSignatureError, verify_event
+
 app = FastAPI()
 
 # CORS middleware
@@ -42,6 +72,18 @@ GOOGLE_FIT_CLIENT_SECRET = os.environ.get('GOOGLE_FIT_CLIENT_SECRET', 'your_goog
 GOOGLE_FIT_API_KEY = os.environ.get('GOOGLE_FIT_API_KEY', 'your_google_fit_api_key_here')
 GOOGLE_CLIENT_ID_IOS = os.environ.get('GOOGLE_CLIENT_ID_IOS', 'your_ios_client_id_here')
 
+# Google Fit sync window: first/full syncs look back 7 days, incremental syncs never more than 30
+GOOGLE_FIT_DEFAULT_LOOKBACK_DAYS = 7
+GOOGLE_FIT_MAX_LOOKBACK_DAYS = 30
+GOOGLE_FIT_BUCKET_MILLIS = 86400000
+
+# Background workers processing queued fitness syncs
+SYNC_WORKERS = int(os.environ.get('SYNC_WORKERS', '4'))
+# Concurrent verification jobs (CPU-bound work goes to the verification process pool)
+VERIFICATION_WORKERS = int(os.environ.get('VERIFICATION_WORKERS', '2'))
+# Share cached Calendar answers between workers through MongoDB
+CACHE_SHARED_TIER = os.environ.get('CACHE_SHARED_TIER', 'false').lower() in ('1', 'true', 'yes')
+
 # Enums
 class UserRole(str, Enum):
     FITNESS_ENTHUSIAST = "fitness_enthusiast"
@@ -128,9 +170,39 @@ class SessionResponse(BaseModel):
     created_at: str
     scheduled_time: Optional[str]
 
+class BulkSessionRequest(BaseModel):
+    sessions: List[dict]
+
+class BulkSessionResult(BaseModel):
+    index: int
+    success: bool
+    id: Optional[str] = None
+    error: Optional[str] = None
+
+class BulkSessionResponse(BaseModel):
+    inserted: int
+    failed: int
+    results: List[BulkSessionResult]
+
+class AvailabilitySearchRequest(BaseModel):
+    trainer_ids: List[str]
+    start: str
+    end: str
+    limit_per_trainer: Optional[int] = None
+
+class AvailableSlotsRequest(BaseModel):
+    trainer_ids: List[str]
+    start_date: str
+    end_date: str  # inclusive
+
+class SessionPage(BaseModel):
+    sessions: List[dict]
+    next_cursor: Optional[str] = None
+
 class TreeProgress(BaseModel):
     total_sessions: int
     consistency_streak: int
+    longest_streak: int = 0
     current_level: str
     lift_coins: int
     progress_percentage: float
@@ -145,15 +217,67 @@ class FitnessData(BaseModel):
     avg_duration: int
     recent_workouts: List[dict]
 
+# Fields returned for a session unless the caller asks for fewer
+SESSION_FIELDS = list(SessionResponse.model_fields.keys())
+
+# Sessions fetched from MongoDB (and flushed to the client) per chunk of an export
+EXPORT_BATCH_SIZE = 500
+
+# Bulk ingestion limits: sessions per request and documents per insert_many
+BULK_SESSION_LIMIT = 5000
+BULK_INSERT_BATCH_SIZE = 1000
+AVAILABILITY_SEARCH_MAX_TRAINERS = 1000
+
 # Utility functions
 def generate_id():
     return str(uuid.uuid4())
 
-async def get_user_by_email(email: str):
-    return await db.users.find_one({"email": email})
+def build_session_doc(session: Session) -> dict:
+    return {
+        "id": generate_id(),
+        "user_id": session.user_id,
+        "trainer_id": session.trainer_id,
+        "session_type": session.session_type,
+        "duration_minutes": session.duration_minutes,
+        "source": session.source.value,
+        "calories": session.calories,
+        "heart_rate_avg": session.heart_rate_avg,
+        "scheduled_time": session.scheduled_time,
+        "created_at": datetime.now().isoformat()
+    }
 
-async def get_user_by_id(user_id: str):
-    return await db.users.find_one({"id": user_id})
+def encode_session_cursor(session: dict) -> str:
+    """Opaque keyset cursor pointing just after the given session"""
+    raw = json.dumps([session["created_at"], session["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_session_cursor(cursor: str) -> tuple:
+    try:
+        created_at, session_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, session_id
+
+def session_projection(fields: Optional[str]) -> List[str]:
+    """Fields to fetch from MongoDB; id and created_at are always needed for the cursor"""
+    if not fields:
+        return SESSION_FIELDS
+    
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in SESSION_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown session fields: {', '.join(unknown)}")
+    
+    return [field for field in SESSION_FIELDS if field in requested or field in ("id", "created_at")]
+
+# Every user read and write goes through the cache so writes invalidate it
+user_cache = UserCache(db.users)
+
+async def get_user_by_email(email: str, fields: Optional[List[str]] = None):
+    return await user_cache.get_by_email(email, fields)
+
+async def get_user_by_id(user_id: str, fields: Optional[List[str]] = None, fresh: bool = False):
+    return await user_cache.get_by_id(user_id, fields, fresh)
 
 def calculate_tree_level(total_sessions: int, consistency_streak: int) -> TreeLevel:
     score = total_sessions + (consistency_streak * 2)
@@ -322,15 +446,15 @@ async def update_user(user_id: str, user_update: User):
     if user_update.name:
         update_data["name"] = user_update.name
     
-    result = await db.users.update_one(
+    # The updated document comes back with the write, no second read
+    updated_user = await user_cache.find_one_and_update(
         {"id": user_id},
         {"$set": update_data}
     )
     
-    if result.matched_count == 0:
+    if updated_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     
-    updated_user = await get_user_by_id(user_id)
     return UserResponse(
         id=updated_user["id"],
         email=updated_user["email"],
@@ -345,7 +469,7 @@ async def update_user(user_id: str, user_update: User):
 @api_router.get("/fitness/status/{user_id}", response_model=FitnessConnectionStatus)
 async def get_fitness_connection_status(user_id: str):
     """Get fitness device connection status"""
-    user = await get_user_by_id(user_id)
+    user = await get_user_by_id(user_id, fields=["google_fit_connected", "last_sync"])
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -367,7 +491,7 @@ async def connect_google_fit(request: dict):
             raise HTTPException(status_code=400, detail="User ID is required")
         
         # Update user's Google Fit connection status
-        await db.users.update_one(
+        await user_cache.update_one(
             {"id": user_id},
             {"$set": {
                 "google_fit_connected": True,
@@ -422,7 +546,7 @@ async def google_fit_callback(code: str, user_id: str = None):
         
         # For now, simulate successful connection until Google Cloud Console is configured
         if user_id:
-            await db.users.update_one(
+            await user_cache.update_one(
                 {"id": user_id},
                 {"$set": {
                     "google_fit_connected": True,
@@ -442,81 +566,148 @@ async def google_fit_callback(code: str, user_id: str = None):
         print(f"❌ Google Fit callback error: {e}")
         raise HTTPException(status_code=500, detail="Google Fit connection failed")
 
-@api_router.post("/sync/workouts")
+@api_router.post("/sync/workouts", status_code=202)
 async def sync_fitness_data(request: dict):
-    """Sync fitness data from Google Fit"""
+    """Queue a background fitness data sync; poll /sync/jobs/{job_id} for the result"""
     user_id = request.get("user_id")
     if not user_id:
         raise HTTPException(status_code=400, detail="User ID required")
     
-    user = await get_user_by_id(user_id)
+    user = await get_user_by_id(user_id, fields=[])
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    synced_workouts = 0
-    
-    # Check if user has Google Fit connected
-    if user.get("google_fit_connected"):
-        token_info = user.get("google_fit_token")
-        if token_info:
-            try:
-                # Try to fetch real Google Fit data
-                await sync_google_fit_data(user_id, token_info)
-                synced_workouts += 2  # Assume 2 workouts synced
-            except Exception as e:
-                print(f"Google Fit sync error: {e}")
+    full_resync = bool(request.get("full_resync", False))
+    
+    # Repeated taps while a sync is still queued share that job
+    job = await sync_queue.enqueue(
+        f"{user_id}:{'full' if full_resync else 'delta'}",
+        {"user_id": user_id, "full_resync": full_resync}
+    )
+    
+    return {"job_id": job["id"], "status": job["status"], "coalesced": job["coalesced"]}
+
+@api_router.get("/sync/jobs/{job_id}")
+async def get_sync_job(job_id: str):
+    """Get status, progress and result of a fitness sync job"""
+    job = await sync_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Sync job not found")
+    
+    job.pop("expires_at", None)
+    job.pop("lease_expires_at", None)
+    return job
+
+async def sync_user_workouts(user_id: str, full_resync: bool = False, report_progress=None) -> dict:
+    """Pull new workouts for a user from Google Fit (or mock data) and store them"""
+    # The sync cursor must be current, so skip the cache
+    user = await get_user_by_id(user_id, fresh=True)
+    if not user:
+        raise Exception(f"User {user_id} not found")
+    
+    # Only fetch what changed since the last successful sync unless a full re-sync is requested
+    sync_cursor = None if full_resync else user.get("google_fit_sync_cursor")
+    sync_window = None
+    
+    # All sessions created by this sync go through one batching writer
+    async with SessionBatchWriter(db, progress_service) as writer:
+        # Check if user has Google Fit connected
+        if user.get("google_fit_connected"):
+            token_info = user.get("google_fit_token")
+            if token_info:
+                try:
+                    # Try to fetch real Google Fit data
+                    sync_window = await sync_google_fit_data(user_id, token_info, writer, sync_cursor)
+                except Exception as e:
+                    print(f"Google Fit sync error: {e}")
+                    # Fall back to mock data
+                    await create_mock_workouts(user_id, writer)
+            else:
                 # Fall back to mock data
-                synced_workouts = await create_mock_workouts(user_id)
+                await create_mock_workouts(user_id, writer)
         else:
             # Fall back to mock data
-            synced_workouts = await create_mock_workouts(user_id)
-    else:
-        # Fall back to mock data
-        synced_workouts = await create_mock_workouts(user_id)
+            await create_mock_workouts(user_id, writer)
+    
+    write_stats = writer.stats()
+    if report_progress:
+        await report_progress({"stage": "saving", **write_stats})
     
-    # Update last sync time
-    await db.users.update_one(
+    # Update last sync time, advancing the high-water mark only once every point is stored
+    sync_update = {"last_sync": datetime.now().isoformat()}
+    if sync_window and write_stats["failed"] == 0:
+        sync_update["google_fit_sync_cursor"] = sync_window["end_millis"]
+    await user_cache.update_one(
         {"id": user_id},
-        {"$set": {"last_sync": datetime.now().isoformat()}}
+        {"$set": sync_update}
     )
     
-    return {"synced_workouts": synced_workouts}
+    return {
+        "full_resync": full_resync,
+        "sync_window": sync_window,
+        "synced_workouts": write_stats["inserted"],
+        "duplicate_workouts": write_stats["duplicates"],
+        "failed_workouts": write_stats["failed"],
+        "flushes": write_stats["flushes"],
+        "flush_latency_ms": write_stats["flush_latency_ms"],
+        "max_flush_latency_ms": write_stats["max_flush_latency_ms"]
+    }
+
+def google_fit_sync_window(sync_cursor: Optional[int], end_millis: int) -> tuple:
+    """Start/end millis for the next Google Fit request"""
+    if sync_cursor:
+        start_millis = max(sync_cursor, end_millis - GOOGLE_FIT_MAX_LOOKBACK_DAYS * GOOGLE_FIT_BUCKET_MILLIS)
+    else:
+        start_millis = end_millis - GOOGLE_FIT_DEFAULT_LOOKBACK_DAYS * GOOGLE_FIT_BUCKET_MILLIS
+    
+    # Align to the daily bucket so points keep the same boundaries (and session_key) across syncs
+    start_millis -= start_millis % GOOGLE_FIT_BUCKET_MILLIS
+    return start_millis, end_millis
 
-async def sync_google_fit_data(user_id: str, token_info: dict):
-    """Sync real Google Fit data"""
+async def sync_google_fit_data(user_id: str, token_info: dict, writer: SessionBatchWriter, sync_cursor: Optional[int] = None) -> dict:
+    """Sync real Google Fit data since the given high-water mark"""
     access_token = token_info.get("access_token")
     if not access_token:
         raise Exception("No access token available")
     
     # Get data from Google Fit API
-    end_time = datetime.now()
-    start_time = end_time - timedelta(days=7)
+    start_millis, end_millis = google_fit_sync_window(sync_cursor, int(datetime.now().timestamp() * 1000))
+    
+    # A sync already fetching the same window for this user shares its response
+    data, end_millis = await google_fit_flight.do(
+        ("aggregate", user_id, start_millis),
+        lambda: fetch_google_fit_aggregate(access_token, start_millis, end_millis)
+    )
     
+    # Process and create sessions from Google Fit data
+    await process_google_fit_activities(user_id, data, writer)
+    return {"start_millis": start_millis, "end_millis": end_millis}
+
+async def fetch_google_fit_aggregate(access_token: str, start_millis: int, end_millis: int) -> tuple:
+    """One dataset:aggregate call; returns the response body and the window end it covers"""
     payload = {
         "aggregateBy": [{"dataTypeName": "com.google.activity.segment"}],
-        "startTimeMillis": int(start_time.timestamp() * 1000),
-        "endTimeMillis": int(end_time.timestamp() * 1000),
-        "bucketByTime": {"durationMillis": 86400000}
+        "startTimeMillis": start_millis,
+        "endTimeMillis": end_millis,
+        "bucketByTime": {"durationMillis": GOOGLE_FIT_BUCKET_MILLIS}
     }
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            "https://www.googleapis.com/fitness/v1/users/me/dataset:aggregate",
-            json=payload,
-            headers={"Authorization": f"Bearer {access_token}"}
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            # Process and create sessions from Google Fit data
-            await process_google_fit_activities(user_id, data)
-        else:
-            raise Exception(f"Google Fit API error: {response.status_code}")
+    response = await http_clients.get("google_fit").post(
+        "https://www.googleapis.com/fitness/v1/users/me/dataset:aggregate",
+        json=payload,
+        headers={"Authorization": f"Bearer {access_token}"}
+    )
+    
+    if response.status_code == 200:
+        return response.json(), end_millis
+    else:
+        raise Exception(f"Google Fit API error: {response.status_code}")
 
-async def process_google_fit_activities(user_id: str, data: dict):
+async def process_google_fit_activities(user_id: str, data: dict, writer: SessionBatchWriter):
     """Process Google Fit activities and create sessions"""
     for bucket in data.get("bucket", []):
         for dataset in bucket.get("dataset", []):
+            data_source_id = dataset.get("dataSourceId")
             for point in dataset.get("point", []):
                 # Extract activity data
                 activity_type = "Google Fit Activity"
@@ -532,12 +723,23 @@ async def process_google_fit_activities(user_id: str, data: dict):
                     "duration_minutes": duration,
                     "calories": calories,
                     "source": SessionSource.GOOGLE_FIT.value,
+                    # Same data point on a later sync maps to the same key and is skipped
+                    "session_key": make_session_key(
+                        user_id,
+                        point.get("originDataSourceId") or data_source_id,
+                        point.get("startTimeNanos"),
+                        point.get("endTimeNanos")
+                    ),
                     "created_at": datetime.now().isoformat()
                 }
                 
-                await db.sessions.insert_one(session_doc)
+                await writer.add(session_doc)
+
+async def run_workout_sync_job(payload: dict, report_progress) -> dict:
+    await report_progress({"stage": "fetching"})
+    return await sync_user_workouts(payload["user_id"], payload.get("full_resync", False), report_progress)
 
-async def create_mock_workouts(user_id: str) -> int:
+async def create_mock_workouts(user_id: str, writer: SessionBatchWriter) -> int:
     """Create mock workouts when Google Fit is not available"""
     mock_workouts = [
         {
@@ -568,18 +770,30 @@ async def create_mock_workouts(user_id: str) -> int:
             "duration_minutes": workout["duration"],
             "calories": workout["calories"],
             "source": workout["source"].value,
+            # One mock workout of each type per day, however often the user syncs
+            "session_key": make_session_key(user_id, "mock", workout["activity_type"], workout["date"][:10]),
             "created_at": workout["date"]
         }
         
-        await db.sessions.insert_one(session_doc)
+        await writer.add(session_doc)
         synced_count += 1
     
     return synced_count
 
+sync_queue = JobQueue(db.sync_jobs, run_workout_sync_job, workers=SYNC_WORKERS)
+google_fit_flight = SingleFlight("google_fit")
+
+async def apply_payment_event(event: dict, report_progress) -> dict:
+    """Job handler: apply one verified Stripe event"""
+    return await payment_events.process(event)
+
+# Durable inbox for Stripe webhook events
+payment_event_queue = JobQueue(db.stripe_events, apply_payment_event, workers=1, lease_seconds=60, poll_interval=2.0)
+
 @api_router.get("/fitness/data/{user_id}", response_model=FitnessData)
 async def get_fitness_data(user_id: str):
     """Get fitness data and statistics"""
-    user = await get_user_by_id(user_id)
+    user = await get_user_by_id(user_id, fields=[])
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -621,7 +835,7 @@ async def get_fitness_data(user_id: str):
 @api_router.delete("/google-fit/disconnect/{user_id}")
 async def disconnect_google_fit(user_id: str):
     """Disconnect Google Fit from user account"""
-    result = await db.users.update_one(
+    result = await user_cache.update_one(
         {"id": user_id},
         {"$unset": {"google_fit_token": "", "google_fit_connected": ""}}
     )
@@ -635,31 +849,144 @@ async def disconnect_google_fit(user_id: str):
 @api_router.post("/sessions", response_model=SessionResponse)
 async def create_session(session: Session):
     """Create a new session (primarily used by trainers and fitness sync)"""
-    session_id = generate_id()
-    session_doc = {
-        "id": session_id,
-        "user_id": session.user_id,
-        "trainer_id": session.trainer_id,
-        "session_type": session.session_type,
-        "duration_minutes": session.duration_minutes,
-        "source": session.source.value,
-        "calories": session.calories,
-        "heart_rate_avg": session.heart_rate_avg,
-        "scheduled_time": session.scheduled_time,
-        "created_at": datetime.now().isoformat()
-    }
+    session_doc = build_session_doc(session)
     
     await db.sessions.insert_one(session_doc)
+    await progress_service.record_sessions(session.user_id, [session_doc["created_at"]])
     
     return SessionResponse(**session_doc)
 
-@api_router.get("/users/{user_id}/sessions", response_model=List[SessionResponse])
-async def get_user_sessions(user_id: str):
-    """Get all sessions for a user"""
-    sessions_cursor = db.sessions.find({"user_id": user_id}).sort("created_at", -1)
-    sessions = await sessions_cursor.to_list(length=100)
+@api_router.post("/sessions/bulk", response_model=BulkSessionResponse)
+async def create_sessions_bulk(request: BulkSessionRequest):
+    """Create many sessions at once (wearable back-fills, trainer imports) with per-item results"""
+    if len(request.sessions) > BULK_SESSION_LIMIT:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {BULK_SESSION_LIMIT} sessions can be created per request"
+        )
     
-    return [SessionResponse(**session) for session in sessions]
+    results = [None] * len(request.sessions)
+    pending = []  # (request index, session document)
+    
+    # Validate everything first so bad rows never cost a round trip
+    for index, item in enumerate(request.sessions):
+        try:
+            session = Session.model_validate(item)
+        except ValidationError as e:
+            results[index] = BulkSessionResult(index=index, success=False, error=str(e))
+            continue
+        pending.append((index, build_session_doc(session)))
+    
+    for start in range(0, len(pending), BULK_INSERT_BATCH_SIZE):
+        batch = pending[start:start + BULK_INSERT_BATCH_SIZE]
+        write_errors = {}
+        
+        try:
+            # Unordered so one bad document does not stop the rest of the batch
+            await db.sessions.insert_many([doc for _, doc in batch], ordered=False)
+        except BulkWriteError as e:
+            write_errors = {error["index"]: error.get("errmsg", "Write failed") for error in e.details.get("writeErrors", [])}
+        
+        for position, (index, doc) in enumerate(batch):
+            if position in write_errors:
+                results[index] = BulkSessionResult(index=index, success=False, error=write_errors[position])
+            else:
+                results[index] = BulkSessionResult(index=index, success=True, id=doc["id"])
+    
+    # Roll the inserted sessions into each user's progress document
+    inserted_by_user = {}
+    for index, doc in pending:
+        if results[index].success:
+            inserted_by_user.setdefault(doc["user_id"], []).append(doc["created_at"])
+    for user_id, inserted_at in inserted_by_user.items():
+        await progress_service.record_sessions(user_id, inserted_at)
+    
+    inserted = sum(1 for result in results if result.success)
+    return BulkSessionResponse(inserted=inserted, failed=len(results) - inserted, results=results)
+
+@api_router.get("/users/{user_id}/sessions", response_model=SessionPage)
+async def get_user_sessions(
+    user_id: str,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    """Get a page of a user's sessions, newest first"""
+    query = {"user_id": user_id}
+    
+    # Keyset pagination on (created_at, id) so every page is an index range scan
+    if cursor:
+        created_at, session_id = decode_session_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": session_id}}
+        ]
+    
+    projection = session_projection(fields)
+    sessions_cursor = db.sessions.find(
+        query,
+        {"_id": 0, **{field: 1 for field in projection}}
+    ).sort([("created_at", -1), ("id", -1)]).limit(limit + 1)
+    sessions = await sessions_cursor.to_list(length=limit + 1)
+    
+    next_cursor = None
+    if len(sessions) > limit:
+        sessions = sessions[:limit]
+        next_cursor = encode_session_cursor(sessions[-1])
+    
+    for session in sessions:
+        for field in projection:
+            session.setdefault(field, None)
+    
+    return SessionPage(sessions=sessions, next_cursor=next_cursor)
+
+async def stream_session_export(user_id: str, since: Optional[str], export_format: str):
+    """Yield a user's sessions oldest first, one bounded chunk at a time"""
+    query = {"user_id": user_id}
+    if since:
+        query["created_at"] = {"$gt": since}
+    
+    sessions_cursor = db.sessions.find(
+        query,
+        {"_id": 0, **{field: 1 for field in SESSION_FIELDS}}
+    ).sort([("created_at", 1), ("id", 1)]).batch_size(EXPORT_BATCH_SIZE)
+    
+    buffer = io.StringIO()
+    writer = None
+    if export_format == "csv":
+        writer = csv.DictWriter(buffer, fieldnames=SESSION_FIELDS)
+        writer.writeheader()
+    
+    buffered = 0
+    async for session in sessions_cursor:
+        if writer:
+            writer.writerow(session)
+        else:
+            buffer.write(json.dumps(session) + "\n")
+        buffered += 1
+        
+        if buffered >= EXPORT_BATCH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            buffered = 0
+    
+    if buffer.tell():
+        yield buffer.getvalue()
+
+@api_router.get("/users/{user_id}/sessions/export")
+async def export_user_sessions(
+    user_id: str,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    since: Optional[str] = None
+):
+    """Stream a user's full session history as NDJSON or CSV, optionally only sessions created after `since`"""
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        stream_session_export(user_id, since, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="sessions_{user_id}.{format}"'}
+    )
 
 @api_router.get("/users/{user_id}/upcoming-sessions")
 async def get_upcoming_sessions(user_id: str):
@@ -690,13 +1017,12 @@ async def request_checkin(session_id: str):
 @api_router.get("/users/{user_id}/tree-progress", response_model=TreeProgress)
 async def get_tree_progress(user_id: str):
     """Calculate and return user's tree progression"""
-    sessions_cursor = db.sessions.find({"user_id": user_id})
-    sessions = await sessions_cursor.to_list(length=None)
+    progress = await progress_service.get_progress(user_id)
     
-    total_sessions = len(sessions)
+    total_sessions = progress["total_sessions"]
     
-    # Calculate consistency streak (mock calculation)
-    consistency_streak = min(total_sessions, 7)  # Simple mock
+    # Consecutive active days, reset once a full day is missed
+    consistency_streak = current_streak(progress)
     
     # Calculate tree level and progress
     current_level = calculate_tree_level(total_sessions, consistency_streak)
@@ -709,23 +1035,20 @@ async def get_tree_progress(user_id: str):
     return TreeProgress(
         total_sessions=total_sessions,
         consistency_streak=consistency_streak,
+        longest_streak=progress.get("longest_streak", 0),
         current_level=current_level.value,
         lift_coins=lift_coins,
         progress_percentage=progress_percentage
     )
 
-# Import new services
-import sys
-import os
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-
-from payment_service import PaymentService
-from calendar_service import CalendarService
-from verification_service import VerificationService
-
-payment_service = PaymentService()
-calendar_service = CalendarService()
-verification_service = VerificationService()
+# Services
+payment_service = AsyncPaymentService(PaymentService())
+calendar_service = CalendarService(http_clients, shared_cache=db.cache_entries if CACHE_SHARED_TIER else None)
+verification_service = VerificationService(DocumentStore(db.verification_documents, db.document_blobs))
+progress_service = ProgressService(db)
+payment_ledger = PaymentLedger(db)
+payment_events = PaymentEventProcessor(db, payment_ledger)
+idempotency = IdempotencyStore(db.idempotency_keys)
 
 # Enhanced User Model with verification
 class UserWithVerification(BaseModel):
@@ -754,11 +1077,10 @@ class CertificationRequest(BaseModel):
 class UpdateUserNameRequest(BaseModel):
     name: str
 
-class VerificationResponse(BaseModel):
+class VerificationJobResponse(BaseModel):
+    job_id: str
+    document_id: str
     status: str
-    age_verified: bool = False
-    cert_verified: bool = False
-    rejection_reason: Optional[str] = None
 
 # Trainer-specific models
 class ScheduleEvent(BaseModel):
@@ -788,95 +1110,240 @@ class ReviewData(BaseModel):
     session_type: str
 
 # Document Verification Endpoints
-@api_router.post("/verify-government-id", response_model=VerificationResponse)
+async def apply_id_verification_result(user_id: str, result: dict):
+    """Update user verification status in database after an ID check"""
+    if result["age_verified"]:
+        await user_cache.update_one(
+            {"id": user_id},
+            {"$set": {
+                "age_verified": True,
+                "verification_status": "age_verified",
+                "id_verification_date": datetime.now().isoformat()
+            }}
+        )
+    else:
+        await user_cache.update_one(
+            {"id": user_id},
+            {"$set": {
+                "verification_status": "rejected",
+                "rejection_reason": result.get("rejection_reason"),
+                "id_verification_date": datetime.now().isoformat()
+            }}
+        )
+
+async def apply_cert_verification_result(user_id: str, cert_type: str, result: dict):
+    """Update user verification status in database after a certification check"""
+    if result["cert_verified"]:
+        await user_cache.update_one(
+            {"id": user_id},
+            {"$set": {
+                "cert_verified": True,
+                "certification_type": cert_type,
+                "verification_status": "fully_verified",
+                "cert_verification_date": datetime.now().isoformat(),
+                "cert_expiry_date": result.get("expiry_date")
+            }}
+        )
+    else:
+        await user_cache.update_one(
+            {"id": user_id},
+            {"$set": {
+                "verification_status": "rejected",
+                "rejection_reason": result.get("rejection_reason"),
+                "cert_verification_date": datetime.now().isoformat()
+            }}
+        )
+
+async def run_verification_job(payload: dict, report_progress) -> dict:
+    """Job handler: verify a stored document, then update the user's verification status"""
+    result = await verification_service.verify_document(payload["document_id"])
+    if payload["kind"] == "government_id":
+        await apply_id_verification_result(payload["user_id"], result)
+    else:
+        await apply_cert_verification_result(payload["user_id"], payload["cert_type"], result)
+    return result
+
+# Verification runs in the background; the endpoints only store the document and queue it
+verification_queue = JobQueue(
+    db.verification_jobs, run_verification_job, workers=VERIFICATION_WORKERS, lease_seconds=120, poll_interval=1.0
+)
+
+async def queue_verification(document: dict, cert_type: Optional[str] = None) -> VerificationJobResponse:
+    job = await verification_queue.enqueue(
+        f"verify:{document['id']}",
+        {
+            "document_id": document["id"],
+            "kind": document["type"],
+            "user_id": document["user_id"],
+            "cert_type": cert_type
+        }
+    )
+    return VerificationJobResponse(job_id=job["id"], document_id=document["id"], status=job["status"])
+
+@api_router.post("/verify-government-id", response_model=VerificationJobResponse, status_code=202)
 async def verify_government_id(request: GovernmentIdRequest):
-    """Verify government ID for age verification"""
+    """Queue government ID verification; poll /verification/jobs/{job_id} for the result"""
     try:
-        result = verification_service.process_government_id(
-            request.image_data, 
-            request.user_id, 
+        image_bytes, content_type = await verification_service.decode_upload(request.image_data)
+        document = await verification_service.submit_government_id(
+            single_chunk(image_bytes),
+            content_type,
+            request.user_id,
             request.user_email
         )
+        return await queue_verification(document)
         
-        # Update user verification status in database
-        if result["age_verified"]:
-            await db.users.update_one(
-                {"id": request.user_id},
-                {"$set": {
-                    "age_verified": True,
-                    "verification_status": "age_verified",
-                    "id_verification_date": datetime.now().isoformat()
-                }}
-            )
-        else:
-            await db.users.update_one(
-                {"id": request.user_id},
-                {"$set": {
-                    "verification_status": "rejected",
-                    "rejection_reason": result.get("rejection_reason"),
-                    "id_verification_date": datetime.now().isoformat()
-                }}
-            )
-        
-        return VerificationResponse(
-            status=result["status"],
-            age_verified=result["age_verified"],
-            rejection_reason=result.get("rejection_reason")
-        )
-        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DocumentTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.post("/verify-fitness-certification", response_model=VerificationResponse)
+@api_router.post("/verify-fitness-certification", response_model=VerificationJobResponse, status_code=202)
 async def verify_fitness_certification(request: CertificationRequest):
-    """Verify fitness certification for trainers"""
+    """Queue fitness certification verification; poll /verification/jobs/{job_id} for the result"""
     try:
-        result = verification_service.process_fitness_certification(
-            request.image_data,
+        image_bytes, content_type = await verification_service.decode_upload(request.image_data)
+        document = await verification_service.submit_fitness_certification(
+            single_chunk(image_bytes),
+            content_type,
             request.cert_type,
             request.user_id,
             request.user_email
         )
+        return await queue_verification(document, request.cert_type)
         
-        # Update user verification status in database
-        if result["cert_verified"]:
-            await db.users.update_one(
-                {"id": request.user_id},
-                {"$set": {
-                    "cert_verified": True,
-                    "certification_type": request.cert_type,
-                    "verification_status": "fully_verified",
-                    "cert_verification_date": datetime.now().isoformat(),
-                    "cert_expiry_date": result.get("expiry_date")
-                }}
-            )
-        else:
-            await db.users.update_one(
-                {"id": request.user_id},
-                {"$set": {
-                    "verification_status": "rejected",
-                    "rejection_reason": result.get("rejection_reason"),
-                    "cert_verification_date": datetime.now().isoformat()
-                }}
-            )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DocumentTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/verification/jobs/{job_id}")
+async def get_verification_job(job_id: str):
+    """Get status and result of a verification job"""
+    job = await verification_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Verification job not found")
+    
+    job.pop("expires_at", None)
+    job.pop("lease_expires_at", None)
+    return job
+
+@api_router.get("/verification/documents/{document_id}/image")
+async def get_verification_document_image(
+    document_id: str,
+    rendition: str = Query(RENDITION_REVIEW, pattern=f"^({RENDITION_REVIEW}|{RENDITION_THUMBNAIL}|{RENDITION_ORIGINAL})$")
+):
+    """A verification document for reviewers: the normalized copy by default, a thumbnail, or the original"""
+    try:
+        image = await verification_service.document_store.read_image(document_id, rendition)
+        if image is None:
+            raise HTTPException(status_code=404, detail="Document not found")
         
-        return VerificationResponse(
-            status=result["status"],
-            cert_verified=result["cert_verified"],
-            rejection_reason=result.get("rejection_reason")
-        )
+        data, content_type = image
+        return Response(content=data, media_type=content_type, headers={"Cache-Control": "private, max-age=3600"})
         
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Multipart uploads: the file is spooled to disk by the form parser past 1 MB and streamed
+# to the document store in UPLOAD_CHUNK_BYTES pieces, so memory per upload stays bounded
+UPLOAD_FORM_OVERHEAD_BYTES = 64 * 1024
+UPLOAD_CONTENT_TYPES = ("image/", "application/pdf")
+
+class UploadForm:
+    """The single file and text fields of a verification upload"""
+
+    def __init__(self, form, fields: List[str]):
+        self.upload = form.get("file")
+        if self.upload is None or isinstance(self.upload, str):
+            raise HTTPException(status_code=400, detail="A file field is required")
+        content_type = self.upload.content_type or ""
+        if not content_type.startswith(UPLOAD_CONTENT_TYPES):
+            raise HTTPException(status_code=415, detail=f"Unsupported document type: {content_type or 'unknown'}")
+        self.content_type = content_type
+
+        self.fields = {}
+        for field in fields:
+            value = form.get(field)
+            if not isinstance(value, str) or not value:
+                raise HTTPException(status_code=400, detail=f"{field} is required")
+            self.fields[field] = value
+
+    async def chunks(self):
+        while True:
+            chunk = await self.upload.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+def check_upload_size(request: Request):
+    """Reject oversized uploads from Content-Length before reading the body"""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_DOCUMENT_BYTES + UPLOAD_FORM_OVERHEAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Documents are limited to {MAX_DOCUMENT_BYTES // (1024 * 1024)} MB")
+
+@api_router.post("/verify-government-id/upload", response_model=VerificationJobResponse, status_code=202)
+async def upload_government_id(request: Request):
+    """Queue verification of a government ID sent as multipart/form-data (fields: user_id, user_email, file)"""
+    check_upload_size(request)
+    try:
+        async with request.form(max_files=1, max_fields=10) as form:
+            upload = UploadForm(form, ["user_id", "user_email"])
+            document = await verification_service.submit_government_id(
+                upload.chunks(),
+                upload.content_type,
+                upload.fields["user_id"],
+                upload.fields["user_email"]
+            )
+        return await queue_verification(document)
+
+    except HTTPException:
+        raise
+    except DocumentTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/verify-fitness-certification/upload", response_model=VerificationJobResponse, status_code=202)
+async def upload_fitness_certification(request: Request):
+    """Queue verification of a fitness certification sent as multipart/form-data (fields: user_id, user_email, cert_type, file)"""
+    check_upload_size(request)
+    try:
+        async with request.form(max_files=1, max_fields=10) as form:
+            upload = UploadForm(form, ["user_id", "user_email", "cert_type"])
+            document = await verification_service.submit_fitness_certification(
+                upload.chunks(),
+                upload.content_type,
+                upload.fields["cert_type"],
+                upload.fields["user_id"],
+                upload.fields["user_email"]
+            )
+        return await queue_verification(document, upload.fields["cert_type"])
+
+    except HTTPException:
+        raise
+    except DocumentTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/verification-status/{user_id}")
 async def get_verification_status(user_id: str):
-    """Get user's verification status"""
+    """Get user's verification status, with the state of their latest submitted documents"""
     try:
         user = await get_user_by_id(user_id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
+        # The user flags only change once a verdict is in; the documents also show uploads still being verified
+        documents = await verification_service.get_verification_status(user_id)
+        
         return {
             "user_id": user_id,
             "age_verified": user.get("age_verified", False),
@@ -884,7 +1351,10 @@ async def get_verification_status(user_id: str):
             "verification_status": user.get("verification_status", "pending"),
             "certification_type": user.get("certification_type"),
             "rejection_reason": user.get("rejection_reason"),
-            "requires_certification": user.get("role") == "trainer"
+            "requires_certification": user.get("role") == "trainer",
+            "document_status": documents["overall_status"],
+            "id_verification": documents["id_verification"],
+            "cert_verification": documents["cert_verification"]
         }
         
     except HTTPException:
@@ -896,17 +1366,12 @@ async def get_verification_status(user_id: str):
 async def update_user_name(user_id: str, request: UpdateUserNameRequest):
     """Update user's name"""
     try:
-        # Update user name in database
-        result = await db.users.update_one(
+        # Update user name in database and get the updated user data back
+        user = await user_cache.find_one_and_update(
             {"id": user_id},
             {"$set": {"name": request.name}}
         )
         
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        # Get updated user data
-        user = await get_user_by_id(user_id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
@@ -949,23 +1414,124 @@ async def create_appointment(trainer_id: str, appointment_data: dict):
     else:
         raise HTTPException(status_code=500, detail="Failed to create appointment")
 
+async def load_availability_configs(trainer_ids: List[str]) -> dict:
+    """Availability config per trainer in one query; trainers without one get the default hours"""
+    configs = {trainer_id: AvailabilityConfig() for trainer_id in trainer_ids}
+    async for doc in db.trainer_availability.find({"trainer_id": {"$in": trainer_ids}}, {"_id": 0}):
+        configs[doc["trainer_id"]] = AvailabilityConfig.from_dict(doc)
+    return configs
+
 @api_router.get("/trainer/{trainer_id}/available-slots")
 async def get_available_slots(trainer_id: str, date: str):
     """Get available time slots for a trainer"""
-    slots = await calendar_service.get_available_slots(trainer_id, date)
+    config_doc = await db.trainer_availability.find_one({"trainer_id": trainer_id}, {"_id": 0})
+    config = AvailabilityConfig.from_dict(config_doc) if config_doc else None
+    slots = await calendar_service.get_available_slots(trainer_id, date, config)
     return {"available_slots": slots}
 
+@api_router.post("/trainers/available-slots")
+async def get_available_slots_batch(request: AvailableSlotsRequest):
+    """Day-by-day slots for many trainers, from one batched set of freebusy queries"""
+    trainer_ids = list(dict.fromkeys(request.trainer_ids))
+    if len(trainer_ids) > AVAILABILITY_SEARCH_MAX_TRAINERS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {AVAILABILITY_SEARCH_MAX_TRAINERS} trainers can be searched per request"
+        )
+    try:
+        first_day = datetime.fromisoformat(request.start_date)
+        last_day = datetime.fromisoformat(request.end_date)
+        search_window(f"{request.start_date}T00:00:00Z", (last_day + timedelta(days=1)).strftime('%Y-%m-%dT00:00:00Z'))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    dates = [(first_day + timedelta(days=i)).strftime('%Y-%m-%d') for i in range((last_day - first_day).days + 1)]
+    
+    configs = await load_availability_configs(trainer_ids)
+    busy_times = await calendar_service.get_busy_times(
+        {trainer_id: config.calendar_id for trainer_id, config in configs.items()},
+        f"{dates[0]}T00:00:00Z", f"{dates[-1]}T23:59:59Z"
+    )
+    
+    trainers = []
+    for trainer_id, config in configs.items():
+        busy = busy_times.get(trainer_id, [])
+        if busy is None:
+            trainers.append({"trainer_id": trainer_id, "error": "calendar_unavailable"})
+            continue
+        busy_index = BusyIndex(busy)
+        trainers.append({
+            "trainer_id": trainer_id,
+            "days": {date: day_slots(config, date, busy_index) for date in dates}
+        })
+    return {"start_date": dates[0], "end_date": dates[-1], "trainers": trainers}
+
+@api_router.get("/trainer/{trainer_id}/availability")
+async def get_availability_config(trainer_id: str):
+    """Working hours, session length and buffer used to build a trainer's slots"""
+    configs = await load_availability_configs([trainer_id])
+    return {"trainer_id": trainer_id, **configs[trainer_id].to_dict()}
+
+@api_router.put("/trainer/{trainer_id}/availability")
+async def update_availability_config(trainer_id: str, config_data: dict):
+    """Set a trainer's working hours, session length and buffer"""
+    try:
+        config = AvailabilityConfig.from_dict(config_data)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid availability config: {e}")
+    
+    await db.trainer_availability.update_one(
+        {"trainer_id": trainer_id},
+        {"$set": {**config.to_dict(), "updated_at": datetime.now().isoformat()}},
+        upsert=True
+    )
+    return {"trainer_id": trainer_id, **config.to_dict()}
+
+@api_router.post("/trainers/availability/search")
+async def search_trainer_availability(request: AvailabilitySearchRequest):
+    """Which of these trainers have a free slot between start and end, with the slots"""
+    trainer_ids = list(dict.fromkeys(request.trainer_ids))
+    if len(trainer_ids) > AVAILABILITY_SEARCH_MAX_TRAINERS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {AVAILABILITY_SEARCH_MAX_TRAINERS} trainers can be searched per request"
+        )
+    try:
+        search_window(request.start, request.end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    configs = await load_availability_configs(trainer_ids)
+    busy_times = await calendar_service.get_busy_times(
+        {trainer_id: config.calendar_id for trainer_id, config in configs.items()}, request.start, request.end
+    )
+    
+    # A trainer whose calendar could not be read is not offered as free
+    unknown = [trainer_id for trainer_id, busy in busy_times.items() if busy is None]
+    for trainer_id in unknown:
+        del configs[trainer_id]
+    
+    available = find_available_trainers(configs, busy_times, request.start, request.end, request.limit_per_trainer)
+    
+    return {
+        "start": request.start,
+        "end": request.end,
+        "trainers_searched": len(trainer_ids),
+        "calendar_errors": unknown,
+        "available_trainers": [
+            {"trainer_id": trainer_id, "slots": slots} for trainer_id, slots in available.items()
+        ]
+    }
+
 # Trainer Earnings
 @api_router.get("/trainer/{trainer_id}/earnings")
 async def get_trainer_earnings(trainer_id: str):
-    """Get trainer earnings data"""
-    earnings = payment_service.get_trainer_earnings(trainer_id)
-    return earnings
+    """Get trainer earnings data from the local payments ledger"""
+    return await payment_ledger.get_trainer_earnings(trainer_id)
 
 @api_router.post("/trainer/{trainer_id}/payout")
 async def request_payout(trainer_id: str, amount: int):
     """Request payout for trainer"""
-    success = payment_service.process_trainer_payout(trainer_id, amount)
+    success = await payment_service.process_trainer_payout(trainer_id, amount)
     if success:
         return {"message": "Payout processed successfully", "amount": amount/100}
     else:
@@ -1016,40 +1582,61 @@ async def respond_to_review(trainer_id: str, review_id: str, response: dict):
 
 # Enhanced session check-in with payment processing
 @api_router.post("/sessions/{session_id}/complete-checkin")
-async def complete_session_checkin(session_id: str, trainer_id: str, client_id: str, session_data: dict):
-    """Complete session check-in with payment processing"""
+async def complete_session_checkin(session_id: str, trainer_id: str, client_id: str, session_data: dict,
+                                   idempotency_key: Optional[str] = Header(None)):
+    """Complete session check-in with payment processing; retries with the same Idempotency-Key replay the first response"""
     try:
-        # Create payment for the session
-        amount = session_data.get("amount", 7500)  # Default $75.00
-        payment = payment_service.create_payment_intent(amount, trainer_id, client_id, session_id)
-        
-        if payment:
-            # Update session in database with completion
-            await db.sessions.update_one(
-                {"id": session_id},
-                {"$set": {
-                    "status": "completed",
-                    "completed_at": datetime.now().isoformat(),
-                    "payment_id": payment["id"],
-                    "amount_paid": amount
-                }}
-            )
-            
-            return {
-                "message": "Session completed and payment processed",
-                "payment_id": payment["id"],
-                "client_secret": payment.get("client_secret"),
-                "amount": amount/100
-            }
-        else:
-            raise HTTPException(status_code=500, detail="Payment processing failed")
-            
+        return await idempotency.run(
+            "complete-checkin", idempotency_key,
+            {"session_id": session_id, "trainer_id": trainer_id, "client_id": client_id, "session_data": session_data},
+            lambda stripe_key: process_session_checkin(session_id, trainer_id, client_id, session_data, stripe_key)
+        )
+    except IdempotencyConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def process_session_checkin(session_id: str, trainer_id: str, client_id: str, session_data: dict,
+                                  stripe_idempotency_key: Optional[str]) -> dict:
+    # Create payment for the session
+    amount = session_data.get("amount", 7500)  # Default $75.00
+    payment = await payment_service.create_payment_intent(
+        amount, trainer_id, client_id, session_id, idempotency_key=stripe_idempotency_key
+    )
+    
+    if payment:
+        await payment_ledger.record_payment_intent(payment, session_data.get("session_type", "Personal Training"))
+        
+        # Update session in database with completion
+        previous = await db.sessions.find_one_and_update(
+            {"id": session_id},
+            {"$set": {
+                "status": "completed",
+                "completed_at": datetime.now().isoformat(),
+                "payment_id": payment["id"],
+                "amount_paid": amount
+            }},
+            projection={"user_id": 1, "status": 1}
+        )
+        
+        # Only the first check-in of a session counts towards progress
+        if previous and previous.get("status") != "completed":
+            await progress_service.record_completion(previous["user_id"])
+        
+        return {
+            "message": "Session completed and payment processed",
+            "payment_id": payment["id"],
+            "client_secret": payment.get("client_secret"),
+            "amount": amount/100
+        }
+    else:
+        raise HTTPException(status_code=500, detail="Payment processing failed")
+
 # New Stripe-specific endpoints
 @api_router.post("/payments/create-session-checkout")
-async def create_session_checkout(request: dict):
+async def create_session_checkout(request: dict, idempotency_key: Optional[str] = Header(None)):
     """Create Stripe checkout session for trainee to pay for session"""
     try:
         amount = request.get("amount", 7500)  # Amount in cents
@@ -1057,15 +1644,20 @@ async def create_session_checkout(request: dict):
         client_email = request.get("client_email")
         session_details = request.get("session_details", {})
         
-        checkout_data = payment_service.create_session_checkout(
-            amount, trainer_id, client_email, session_details
-        )
-        
-        if checkout_data:
+        async def create_checkout(stripe_key):
+            checkout_data = await payment_service.create_session_checkout(
+                amount, trainer_id, client_email, session_details, idempotency_key=stripe_key
+            )
+            if not checkout_data:
+                raise HTTPException(status_code=500, detail="Failed to create checkout session")
             return checkout_data
-        else:
-            raise HTTPException(status_code=500, detail="Failed to create checkout session")
+        
+        return await idempotency.run("create-session-checkout", idempotency_key, request, create_checkout)
             
+    except IdempotencyConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1076,7 +1668,11 @@ async def confirm_payment(request: dict):
         payment_intent_id = request.get("payment_intent_id")
         session_id = request.get("session_id")
         
-        if payment_service.confirm_payment(payment_intent_id):
+        # The webhook usually settles the payment first; only ask Stripe when it has not arrived yet
+        entry = await payment_ledger.get_payment(payment_intent_id)
+        if (entry and entry["status"] == PAYMENT_SUCCEEDED) or await payment_service.confirm_payment(payment_intent_id):
+            await payment_ledger.mark_succeeded(payment_intent_id)
+            
             # Update session as paid
             await db.sessions.update_one(
                 {"id": session_id},
@@ -1093,6 +1689,20 @@ async def confirm_payment(request: dict):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/payments/webhook")
+async def stripe_webhook(request: Request):
+    """Receive Stripe events; they are verified, stored and applied in the background"""
+    payload = await request.body()
+    try:
+        event = verify_event(payload, request.headers.get("stripe-signature"))
+    except WebhookSignatureError as e:
+        logging.warning(f"Rejected Stripe webhook: {e}")
+        raise HTTPException(status_code=400, detail="Invalid webhook signature")
+    
+    # Acknowledge quickly; Stripe retries anything that is not a 2xx
+    job = await payment_event_queue.enqueue(f"stripe:{event['id']}", event)
+    return {"received": True, "job_id": job["id"]}
+
 @api_router.get("/payments/session-cost/{trainer_id}")
 async def get_session_cost(trainer_id: str, session_type: str = "personal_training"):
     """Get the cost for a session with a specific trainer"""
@@ -1114,8 +1724,67 @@ async def get_session_cost(trainer_id: str, session_type: str = "personal_traini
         "currency": "USD"
     }
 
+# Admin endpoints
+@api_router.get("/admin/indexes")
+async def get_index_status():
+    """Report which managed MongoDB indexes exist and which are missing"""
+    try:
+        return await index_report(db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/admin/cache-stats")
+async def get_cache_stats():
+    """Hit, miss and eviction counters for every in-process cache"""
+    return cache_stats()
+
+@api_router.get("/admin/user-cache-stats")
+async def get_user_cache_stats():
+    """User cache hit rate and the MongoDB round trips it saved, per endpoint"""
+    return user_cache.stats()
+
+@api_router.get("/admin/single-flight-stats")
+async def get_single_flight_stats():
+    """How many upstream calls were shared with a concurrent identical call"""
+    return single_flight_stats()
+
+async def track_user_cache_endpoint(request: Request):
+    """Attribute user cache lookups to the endpoint serving the request"""
+    current_endpoint.set(request.scope["endpoint"].__name__)
+
 # Add API router to app
-app.include_router(api_router, prefix="/api")
+app.include_router(api_router, prefix="/api", dependencies=[Depends(track_user_cache_endpoint)])
+
+@app.on_event("startup")
+async def provision_indexes():
+    """Make sure every query path has its index before serving traffic"""
+    try:
+        created = await ensure_indexes(db)
+        print(f"🗂️  MongoDB indexes ready: {sum(len(names) for names in created.values())}")
+    except IndexProvisioningError as e:
+        # Without these indexes duplicate syncs, replayed payments and blob refcounts go wrong silently
+        logging.error(f"Refusing to start: {e}")
+        raise
+    except ConnectionFailure as e:
+        logging.error(f"Refusing to start: MongoDB is unreachable, so required indexes cannot be checked: {e}")
+        raise
+    except Exception as e:
+        logging.error(f"Index provisioning failed: {e}")
+
+@app.on_event("startup")
+async def start_background_workers():
+    await sync_queue.start()
+    await payment_event_queue.start()
+    await verification_queue.start()
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    await sync_queue.stop()
+    await payment_event_queue.stop()
+    await verification_queue.stop()
+    await http_clients.aclose()
+    payment_service.shutdown()
+    verification_service.shutdown()
 
 @app.get("/")
 async def root():
@@ -0,0 +1,114 @@
+"""
+Batched session writes for LiftLink fitness sync
+"""
+import time
+import hashlib
+import logging
+from typing import Dict, List
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+def make_session_key(*parts) -> str:
+    """Deterministic identity for a session imported from an external source"""
+    return hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()
+
+
+class SessionBatchWriter:
+    """Accumulates session documents and writes them in one bulk_write once a size or age threshold is hit.
+
+    Documents carrying a session_key are upserted on it, so re-importing the same external
+    data point is a no-op instead of a duplicate row.
+    """
+
+    def __init__(self, db, progress_service, max_batch_size: int = 500, max_delay_seconds: float = 1.0):
+        self.db = db
+        self.progress_service = progress_service
+        self.max_batch_size = max_batch_size
+        self.max_delay_seconds = max_delay_seconds
+        self._buffer: List[Dict] = []
+        self._oldest_buffered_at = None
+
+        self.inserted = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.flushes = 0
+        self.flush_latency_ms = 0.0
+        self.max_flush_latency_ms = 0.0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.flush()
+
+    async def add(self, session_doc: Dict):
+        """Buffer a session document, flushing when the batch is full or has waited too long"""
+        if not self._buffer:
+            self._oldest_buffered_at = time.monotonic()
+        self._buffer.append(session_doc)
+
+        if (len(self._buffer) >= self.max_batch_size or
+                time.monotonic() - self._oldest_buffered_at >= self.max_delay_seconds):
+            await self.flush()
+
+    async def flush(self):
+        """Write everything buffered in one round trip and roll it into tree progress"""
+        if not self._buffer:
+            return
+
+        batch, self._buffer = self._buffer, []
+        operations = [
+            UpdateOne({"session_key": doc["session_key"]}, {"$setOnInsert": doc}, upsert=True)
+            if doc.get("session_key") else InsertOne(doc)
+            for doc in batch
+        ]
+        upserted_positions = set()
+        failed_positions = set()
+        duplicate_positions = set()
+        started = time.perf_counter()
+
+        try:
+            result = await self.db.sessions.bulk_write(operations, ordered=False)
+            upserted_positions = set(result.upserted_ids or {})
+        except BulkWriteError as e:
+            upserted_positions = {upsert["index"] for upsert in e.details.get("upserted", [])}
+            for error in e.details.get("writeErrors", []):
+                # A concurrent sync upserting the same key loses the race with a duplicate key error
+                if error.get("code") == DUPLICATE_KEY_ERROR and batch[error["index"]].get("session_key"):
+                    duplicate_positions.add(error["index"])
+                else:
+                    failed_positions.add(error["index"])
+            if failed_positions:
+                logging.warning(f"Session batch write: {len(failed_positions)} of {len(batch)} documents failed")
+
+        latency_ms = (time.perf_counter() - started) * 1000
+        self.flushes += 1
+        self.flush_latency_ms += latency_ms
+        self.max_flush_latency_ms = max(self.max_flush_latency_ms, latency_ms)
+
+        inserted_by_user = {}
+        for position, doc in enumerate(batch):
+            if position in failed_positions:
+                self.failed += 1
+            elif position in duplicate_positions or (doc.get("session_key") and position not in upserted_positions):
+                # Upsert matched an existing session
+                self.duplicates += 1
+            else:
+                self.inserted += 1
+                inserted_by_user.setdefault(doc["user_id"], []).append(doc["created_at"])
+        for user_id, inserted_at in inserted_by_user.items():
+            await self.progress_service.record_sessions(user_id, inserted_at)
+
+    def stats(self) -> Dict:
+        """Write counters for reporting back to the caller"""
+        return {
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "flush_latency_ms": round(self.flush_latency_ms, 2),
+            "max_flush_latency_ms": round(self.max_flush_latency_ms, 2)
+        }
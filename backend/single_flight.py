@@ -0,0 +1,57 @@
+"""
+Request coalescing (single-flight) for LiftLink's upstream API calls
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+# Every group by name, for the stats endpoint
+GROUPS: Dict[str, "SingleFlight"] = {}
+
+
+def single_flight_stats() -> Dict[str, Dict]:
+    return {name: group.stats() for name, group in GROUPS.items()}
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time; concurrent callers with the same key share its result.
+
+    The shared call runs as its own task, so a caller that disconnects does not cancel it for the
+    others still waiting. Errors are shared the same way results are.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        GROUPS[name] = self
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Mark the error as seen even if every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "coalesced_rate": round(self.coalesced / self.calls, 4) if self.calls else 0.0,
+            "in_flight": len(self._in_flight)
+        }
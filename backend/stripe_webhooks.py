@@ -0,0 +1,134 @@
+"""
+Stripe webhook verification and event processing for LiftLink payments
+"""
+import os
+import sys
+import json
+import asyncio
+from datetime import datetime
+from typing import Dict
+import stripe
+
+STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
+# Stripe's default replay window for signed payloads
+STRIPE_WEBHOOK_TOLERANCE_SECONDS = int(os.environ.get('STRIPE_WEBHOOK_TOLERANCE_SECONDS', '300'))
+
+
+class WebhookSignatureError(Exception):
+    """The payload was not signed with our webhook secret"""
+
+
+def verify_event(payload: bytes, signature_header: str, secret: str = None) -> Dict:
+    """Check the Stripe-Signature header and return the event as a plain dict"""
+    secret = secret or STRIPE_WEBHOOK_SECRET
+    if not secret:
+        raise WebhookSignatureError("STRIPE_WEBHOOK_SECRET is not configured")
+    try:
+        stripe.WebhookSignature.verify_header(
+            payload.decode("utf-8"), signature_header or "", secret, STRIPE_WEBHOOK_TOLERANCE_SECONDS
+        )
+    except stripe.error.SignatureVerificationError as e:
+        raise WebhookSignatureError(str(e))
+
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        raise WebhookSignatureError("Payload is not valid JSON")
+    if not event.get("id") or not event.get("type"):
+        raise WebhookSignatureError("Payload is not a Stripe event")
+    return event
+
+
+class PaymentEventProcessor:
+    """Applies Stripe events to sessions and the payments ledger.
+
+    Works on plain event dicts, so recorded events can be replayed without the network.
+    Every handler is idempotent: Stripe delivers at least once.
+    """
+
+    def __init__(self, db, payment_ledger):
+        self.db = db
+        self.payment_ledger = payment_ledger
+        self.handlers = {
+            "payment_intent.succeeded": self._payment_intent_succeeded,
+            "payment_intent.payment_failed": self._payment_intent_failed,
+            "payment_intent.canceled": self._payment_intent_canceled,
+            "checkout.session.completed": self._checkout_session_completed,
+        }
+
+    async def process(self, event: Dict) -> Dict:
+        handler = self.handlers.get(event["type"])
+        if handler is None:
+            return {"event_id": event["id"], "type": event["type"], "handled": False}
+
+        result = await handler(event["data"]["object"])
+        print(f"🪝 STRIPE EVENT {event['type']}: {event['id']}")
+        return {"event_id": event["id"], "type": event["type"], "handled": True, **result}
+
+    async def _payment_intent_succeeded(self, intent: Dict) -> Dict:
+        await self._ensure_ledger_entry(intent["id"], intent.get("amount_received") or intent["amount"], intent)
+        settled = await self.payment_ledger.mark_succeeded(intent["id"])
+        sessions = await self._set_payment_status(intent["id"], "paid")
+        return {"payment_id": intent["id"], "ledger_updated": settled is not None, "sessions_updated": sessions}
+
+    async def _payment_intent_failed(self, intent: Dict) -> Dict:
+        # The client can retry the same intent, so it stays pending in the ledger
+        sessions = await self._set_payment_status(intent["id"], "failed")
+        return {"payment_id": intent["id"], "ledger_updated": False, "sessions_updated": sessions}
+
+    async def _payment_intent_canceled(self, intent: Dict) -> Dict:
+        settled = await self.payment_ledger.mark_failed(intent["id"])
+        sessions = await self._set_payment_status(intent["id"], "canceled")
+        return {"payment_id": intent["id"], "ledger_updated": settled is not None, "sessions_updated": sessions}
+
+    async def _checkout_session_completed(self, checkout: Dict) -> Dict:
+        payment_intent_id = checkout.get("payment_intent")
+        if checkout.get("payment_status") != "paid" or not payment_intent_id:
+            return {"payment_id": payment_intent_id, "ledger_updated": False, "sessions_updated": 0}
+
+        await self._ensure_ledger_entry(payment_intent_id, checkout["amount_total"], checkout)
+        settled = await self.payment_ledger.mark_succeeded(payment_intent_id)
+        return {"payment_id": payment_intent_id, "ledger_updated": settled is not None, "sessions_updated": 0}
+
+    async def _ensure_ledger_entry(self, payment_intent_id: str, amount: int, stripe_object: Dict):
+        # Payments started outside complete-checkin (e.g. Checkout) first show up here
+        metadata = stripe_object.get("metadata") or {}
+        if not metadata.get("trainer_id"):
+            return
+        await self.payment_ledger.record_payment_intent({
+            "id": payment_intent_id,
+            "trainer_id": metadata["trainer_id"],
+            "client_id": metadata.get("client_id") or stripe_object.get("customer_email"),
+            "session_id": metadata.get("session_id"),
+            "amount": amount,
+            "currency": stripe_object.get("currency", "usd")
+        })
+
+    async def _set_payment_status(self, payment_intent_id: str, status: str) -> int:
+        update = {"payment_status": status}
+        if status == "paid":
+            update["payment_confirmed_at"] = datetime.now().isoformat()
+        result = await self.db.sessions.update_many(
+            {"payment_id": payment_intent_id, "payment_status": {"$ne": status}},
+            {"$set": update}
+        )
+        return result.modified_count
+
+
+async def replay(paths):
+    """Apply recorded event fixtures to the configured database without verifying signatures"""
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from payment_ledger import PaymentLedger
+
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    db = client.test_database
+    processor = PaymentEventProcessor(db, PaymentLedger(db))
+    for path in paths:
+        with open(path) as f:
+            print(await processor.process(json.load(f)))
+    client.close()
+
+
+if __name__ == "__main__":
+    # python stripe_webhooks.py event.json [event.json ...]
+    asyncio.run(replay(sys.argv[1:]))
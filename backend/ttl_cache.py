@@ -0,0 +1,179 @@
+"""
+In-process LRU + TTL cache with an optional shared MongoDB tier
+"""
+import os
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+CACHE_DEFAULT_TTL_SECONDS = int(os.environ.get('CACHE_DEFAULT_TTL_SECONDS', '60'))
+# With a shared tier, other workers only learn about an invalidation through it, so their
+# local copies are kept at most this long
+CACHE_LOCAL_TTL_WITH_SHARED_SECONDS = int(os.environ.get('CACHE_LOCAL_TTL_WITH_SHARED_SECONDS', '5'))
+
+MISSING = object()
+
+# Every cache by name, for the stats endpoint
+CACHES: Dict[str, "TTLCache"] = {}
+
+
+def cache_index_specs() -> List[Dict]:
+    """Indexes the shared tier collection needs (see db_indexes.INDEX_SPECS)"""
+    return [
+        {"name": "key_unique", "keys": [("key", 1)], "unique": True},
+        {"name": "cache_tags", "keys": [("cache", 1), ("tags", 1)]},
+        {"name": "expires_at_ttl", "keys": [("expires_at", 1)], "expireAfterSeconds": 0},
+    ]
+
+
+def cache_stats() -> Dict[str, Dict]:
+    return {name: cache.stats() for name, cache in CACHES.items()}
+
+
+class TTLCache:
+    """Least-recently-used cache whose entries also expire after a TTL.
+
+    Entries can carry tags so a write can invalidate everything it affects at once. When a
+    shared collection is given, values are written through to MongoDB so other workers can
+    reuse them, and invalidations delete them there too.
+    """
+
+    def __init__(self, name: str, max_entries: int = 1024, ttl_seconds: int = CACHE_DEFAULT_TTL_SECONDS,
+                 shared_collection=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.shared_collection = shared_collection
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, value, tags)
+        self._tagged: Dict[str, Set[str]] = {}
+
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        CACHES[name] = self
+
+    async def get(self, key: str, default=MISSING):
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._drop(key)
+            self.expirations += 1
+
+        if self.shared_collection is not None:
+            shared = await self._shared_get(key)
+            if shared is not None:
+                self.shared_hits += 1
+                remaining = (shared["expires_at"].replace(tzinfo=timezone.utc) - datetime.now(timezone.utc)).total_seconds()
+                self._store(key, shared["value"], shared.get("tags", []), remaining)
+                return shared["value"]
+
+        self.misses += 1
+        return default
+
+    async def set(self, key: str, value: Any, tags: Iterable[str] = (), ttl_seconds: Optional[int] = None):
+        ttl_seconds = ttl_seconds or self.ttl_seconds
+        tags = list(tags)
+        self._store(key, value, tags, ttl_seconds)
+
+        if self.shared_collection is not None:
+            try:
+                await self.shared_collection.update_one(
+                    {"key": self._shared_key(key)},
+                    {"$set": {
+                        "cache": self.name,
+                        "value": value,
+                        "tags": tags,
+                        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds)
+                    }},
+                    upsert=True
+                )
+            except Exception as e:
+                logging.warning(f"Shared cache write failed for {self.name}: {e}")
+
+    async def invalidate(self, key: str):
+        if self._drop(key):
+            self.invalidations += 1
+        if self.shared_collection is not None:
+            try:
+                await self.shared_collection.delete_one({"key": self._shared_key(key)})
+            except Exception as e:
+                logging.warning(f"Shared cache invalidation failed for {self.name}: {e}")
+
+    async def invalidate_tags(self, tags: Iterable[str]):
+        """Drop every entry carrying any of the tags"""
+        tags = list(tags)
+        for tag in tags:
+            for key in list(self._tagged.get(tag, ())):
+                if self._drop(key):
+                    self.invalidations += 1
+        if self.shared_collection is not None and tags:
+            try:
+                await self.shared_collection.delete_many({"cache": self.name, "tags": {"$in": tags}})
+            except Exception as e:
+                logging.warning(f"Shared cache invalidation failed for {self.name}: {e}")
+
+    def clear(self):
+        self._entries.clear()
+        self._tagged.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "shared_tier": self.shared_collection is not None,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.shared_hits) / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations
+        }
+
+    def _store(self, key: str, value: Any, tags: List[str], ttl_seconds: float):
+        if self.shared_collection is not None:
+            ttl_seconds = min(ttl_seconds, CACHE_LOCAL_TTL_WITH_SHARED_SECONDS)
+        self._drop(key)
+        self._entries[key] = (time.monotonic() + ttl_seconds, value, tags)
+        for tag in tags:
+            self._tagged.setdefault(tag, set()).add(key)
+
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def _drop(self, key: str) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        for tag in entry[2]:
+            keys = self._tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tagged[tag]
+        return True
+
+    def _shared_key(self, key: str) -> str:
+        return f"{self.name}:{key}"
+
+    async def _shared_get(self, key: str) -> Optional[Dict]:
+        try:
+            return await self.shared_collection.find_one(
+                {"key": self._shared_key(key), "expires_at": {"$gt": datetime.now(timezone.utc)}},
+                {"_id": 0, "value": 1, "tags": 1, "expires_at": 1}
+            )
+        except Exception as e:
+            logging.warning(f"Shared cache read failed for {self.name}: {e}")
+            return None
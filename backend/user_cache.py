@@ -0,0 +1,121 @@
+"""
+Cached user lookups by id and email, with write-through invalidation
+"""
+import os
+from contextvars import ContextVar
+from typing import Dict, Iterable, Optional
+from pymongo import ReturnDocument
+from ttl_cache import MISSING, TTLCache
+
+USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', '10000'))
+# Short, since other workers' writes only show up here once an entry expires
+USER_CACHE_TTL_SECONDS = int(os.environ.get('USER_CACHE_TTL_SECONDS', '15'))
+
+# Which endpoint a lookup is made for, set per request (see server.track_user_cache_endpoint)
+current_endpoint: ContextVar[str] = ContextVar("user_cache_endpoint", default="background")
+
+
+def _tags(user: Dict) -> list:
+    return [f"id:{user['id']}", f"email:{user['email']}"]
+
+
+def _project(user: Dict, fields: Optional[Iterable[str]]) -> Dict:
+    # Callers get their own copy, so changing it never changes the cached document
+    if fields is None:
+        return dict(user)
+    return {field: user[field] for field in ("id", *fields) if field in user}
+
+
+class UserCache:
+    """Reads users through an LRU + TTL cache and writes them through to MongoDB.
+
+    Whole user documents are cached (they are small), under both their id and email, and each
+    caller can ask for just the fields it needs. Every write goes through update_one /
+    find_one_and_update here, which drop the cached copy, so this worker never reads its own
+    stale writes. Misses are not cached, so a newly created user is found immediately.
+    """
+
+    def __init__(self, collection, max_entries: int = USER_CACHE_MAX_ENTRIES,
+                 ttl_seconds: int = USER_CACHE_TTL_SECONDS):
+        self.collection = collection
+        self.cache = TTLCache("users", max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._endpoints: Dict[str, Dict[str, int]] = {}
+        # Bumped by every write, so a lookup that raced one does not cache what it read
+        self._writes = 0
+
+    async def get_by_id(self, user_id: str, fields: Optional[Iterable[str]] = None,
+                        fresh: bool = False) -> Optional[Dict]:
+        return await self._get(f"id:{user_id}", {"id": user_id}, fields, fresh)
+
+    async def get_by_email(self, email: str, fields: Optional[Iterable[str]] = None,
+                           fresh: bool = False) -> Optional[Dict]:
+        return await self._get(f"email:{email}", {"email": email}, fields, fresh)
+
+    async def _get(self, key: str, query: Dict, fields: Optional[Iterable[str]], fresh: bool) -> Optional[Dict]:
+        user = MISSING if fresh else await self.cache.get(key)
+        self._count(lookups=1, saved=int(user is not MISSING))
+        if user is MISSING:
+            writes = self._writes
+            user = await self.collection.find_one(query, {"_id": 0})
+            if user is None:
+                return None
+            if writes == self._writes:
+                await self._store(user)
+        return _project(user, fields)
+
+    async def _store(self, user: Dict):
+        tags = _tags(user)
+        for key in tags:
+            await self.cache.set(key, user, tags=tags)
+
+    async def update_one(self, query: Dict, update: Dict, **kwargs):
+        """db.users.update_one that also drops the cached copy of the user"""
+        result = await self.collection.update_one(query, update, **kwargs)
+        await self.invalidate(query)
+        return result
+
+    async def find_one_and_update(self, query: Dict, update: Dict, fields: Optional[Iterable[str]] = None) -> Optional[Dict]:
+        """Update a user and return the new document in the same round trip, refreshing the cache with it"""
+        await self.invalidate(query)
+        user = await self.collection.find_one_and_update(
+            query, update, projection={"_id": 0}, return_document=ReturnDocument.AFTER
+        )
+        if user is None:
+            return None
+        # The caller would otherwise read the user back right after writing
+        self._count(saved=1)
+        await self._store(user)
+        return _project(user, fields)
+
+    async def invalidate(self, query: Dict):
+        self._writes += 1
+        tags = [f"{field}:{query[field]}" for field in ("id", "email") if isinstance(query.get(field), str)]
+        if tags:
+            await self.cache.invalidate_tags(tags)
+        else:
+            # A write we cannot pin to one user may have touched any of them
+            self.cache.clear()
+
+    def _count(self, lookups: int = 0, saved: int = 0):
+        counters = self._endpoints.setdefault(current_endpoint.get(), {"lookups": 0, "hits": 0, "saved": 0})
+        counters["lookups"] += lookups
+        if lookups:
+            counters["hits"] += saved
+        counters["saved"] += saved
+
+    def stats(self) -> Dict:
+        endpoints = {
+            endpoint: {
+                "lookups": counters["lookups"],
+                "hits": counters["hits"],
+                "hit_rate": round(counters["hits"] / counters["lookups"], 4) if counters["lookups"] else 0.0,
+                # Cache hits plus read-backs folded into find_one_and_update
+                "db_round_trips_saved": counters["saved"]
+            }
+            for endpoint, counters in sorted(self._endpoints.items())
+        }
+        return {
+            "cache": self.cache.stats(),
+            "db_round_trips_saved": sum(counters["saved"] for counters in self._endpoints.values()),
+            "endpoints": endpoints
+        }
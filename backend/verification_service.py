@@ -3,39 +3,206 @@ Document verification service for age and certification verification
 """
 import os
 import base64
+import binascii
 import uuid
+import asyncio
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, date
-from typing import Dict, Optional, List
+from typing import AsyncIterator, Dict, Optional, List, Tuple
 import logging
 import re
+from document_store import DOCUMENT_PENDING, DocumentStore, RENDITION_ORIGINAL
+from image_pipeline import normalize_image
+
+# Processes for CPU-bound document work (hashing, format checks, normalizing images)
+VERIFICATION_PROCESSES = int(os.environ.get('VERIFICATION_PROCESSES', '2'))
+# Never "fork": the server already runs threads (Motor, the Stripe pool, to_thread workers), and a
+# child forked while one of them holds a lock can deadlock on it
+VERIFICATION_START_METHOD = os.environ.get('VERIFICATION_START_METHOD', 'forkserver')
+
+# Formats that get a review copy and thumbnail; anything else (PDF, HEIC) is kept as uploaded
+NORMALIZED_FORMATS = ("jpeg", "png", "webp")
+
+# What the status endpoint shows of a user's latest document of each type
+STATUS_SUMMARY_FIELDS = ("id", "status", "cert_type", "uploaded_at", "processed_at", "rejection_reason")
+
+# Outcome fields copied from an earlier verdict on the same image
+REUSED_RESULT_FIELDS = (
+    "status", "age", "age_verified", "cert_verified", "expiry_date", "rejection_reason", "detected_format"
+)
+
+DATA_URL_PATTERN = re.compile(r'^data:([\w/+.-]+);base64,')
+
+
+def decode_image_data(image_data: str) -> Tuple[bytes, str]:
+    """Image bytes and content type from a base64 string or data URL; raises ValueError for invalid or empty data"""
+    content_type = "image/jpeg"
+    match = DATA_URL_PATTERN.match(image_data)
+    if match:
+        content_type = match.group(1)
+        image_data = image_data[match.end():]
+    elif ',' in image_data:
+        image_data = image_data.split(',', 1)[1]
+    # Strict, so stray characters are an error instead of being silently dropped; line breaks
+    # from encoders that wrap their output are the only thing tolerated
+    data = base64.b64decode("".join(image_data.split()), validate=True)
+    if not data:
+        raise ValueError("Image data is empty")
+    return data, content_type
+
+
+def inspect_document(data: bytes, normalize: bool = True) -> Dict:
+    """CPU-bound checks on a stored document, plus its normalized renditions; runs in the verification process pool"""
+    if data.startswith(b"\xff\xd8\xff"):
+        detected_format = "jpeg"
+    elif data.startswith(b"\x89PNG\r\n\x1a\n"):
+        detected_format = "png"
+    elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        detected_format = "webp"
+    elif data[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1"):
+        detected_format = "heic"
+    elif data.startswith(b"%PDF"):
+        detected_format = "pdf"
+    else:
+        detected_format = "unknown"
+    return {
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "size_bytes": len(data),
+        "detected_format": detected_format,
+        "normalized": normalize_image(data) if normalize and detected_format in NORMALIZED_FORMATS else None
+    }
+
 
 class VerificationService:
-    def __init__(self):
-        self.verification_storage = {}  # In production, use proper file storage
-        
-    def process_government_id(self, image_data: str, user_id: str, user_email: str) -> Dict:
+    """Stores verification documents on upload and verifies them later, from the verification job queue.
+
+    Hashing and normalizing image bytes is CPU-bound, so it runs in a process pool instead of
+    blocking the event loop; decoding uploads is cheaper than the round trip there and uses a thread.
+    """
+
+    def __init__(self, document_store: DocumentStore, processes: int = VERIFICATION_PROCESSES):
+        self.document_store = document_store
+        self.processes = processes
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.processes, mp_context=multiprocessing.get_context(VERIFICATION_START_METHOD)
+            )
+        return self._pool
+
+    async def _run_cpu(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor(), func, *args)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    async def decode_upload(self, image_data: str) -> Tuple[bytes, str]:
+        """Decode a base64 image or data URL off the event loop; raises ValueError when it is not valid, non-empty base64"""
+        try:
+            # A thread, not the process pool: decoding is one linear pass, and shipping a
+            # multi-megabyte string to another process and the bytes back costs more than that
+            return await asyncio.to_thread(decode_image_data, image_data)
+        except (binascii.Error, ValueError) as e:
+            raise ValueError(f"Invalid image data: {e}")
+
+    async def submit_government_id(self, chunks: AsyncIterator[bytes], content_type: str,
+                                   user_id: str, user_email: str) -> Dict:
+        """Store a government ID for verification; raises DocumentTooLargeError past the size limit"""
+        return await self.document_store.save_stream(
+            "government_id", user_id, user_email, chunks, content_type,
+            doc_id=f"gov_id_{user_id}_{uuid.uuid4().hex[:8]}"
+        )
+
+    async def submit_fitness_certification(self, chunks: AsyncIterator[bytes], content_type: str,
+                                           cert_type: str, user_id: str, user_email: str) -> Dict:
+        """Store a fitness certification for verification; raises DocumentTooLargeError past the size limit"""
+        return await self.document_store.save_stream(
+            "fitness_certification", user_id, user_email, chunks, content_type,
+            doc_id=f"cert_{cert_type}_{user_id}_{uuid.uuid4().hex[:8]}", cert_type=cert_type
+        )
+
+    async def verify_document(self, doc_id: str) -> Dict:
+        """Verify a stored document and record the outcome on it"""
+        document = await self.document_store.get(doc_id)
+        if document is None:
+            raise ValueError(f"Document {doc_id} not found")
+
+        # The same image from the same user gets the same verdict without processing it again
+        previous = await self.document_store.previous_result(document)
+        if previous is not None:
+            return await self._reuse_result(document, previous)
+
+        if document["type"] == "government_id":
+            return await self._verify_government_id(document)
+        return await self._verify_fitness_certification(document)
+
+    async def _reuse_result(self, document: Dict, previous: Dict) -> Dict:
+        verification_result = {field: previous[field] for field in REUSED_RESULT_FIELDS if field in previous}
+        await self.document_store.record_result(document["id"], {**verification_result, "reused_from": previous["id"]})
+
+        print(f"♻️  VERIFICATION RESULT REUSED - User: {document['user_email']}")
+        print(f"   Document ID: {document['id']} (same image as {previous['id']})")
+        print(f"   Status: {verification_result['status']}")
+
+        if document["type"] == "government_id":
+            return self._id_response(document["id"], verification_result)
+        return self._cert_response(document["id"], document["cert_type"], verification_result)
+
+    async def _inspect(self, document: Dict) -> Dict:
+        """Check the original against its hash and, first time round, store its review copy and thumbnail"""
+        blob = await self.document_store.get_blob(document["sha256"])
+        if blob is None:
+            raise ValueError(f"Blob for document {document['id']} not found")
+        data, _ = await self.document_store.read_rendition(blob, RENDITION_ORIGINAL)
+        normalize = "review_key" not in blob
+        inspection = await self._run_cpu(inspect_document, data, normalize)
+        if inspection["sha256"] != document["sha256"]:
+            raise ValueError(f"Stored document {document['id']} does not match its hash")
+        if inspection["normalized"] is not None:
+            await self.document_store.store_renditions(blob, data, inspection["normalized"])
+        return inspection
+
+    def _id_response(self, doc_id: str, verification_result: Dict) -> Dict:
+        return {
+            "document_id": doc_id,
+            "status": verification_result["status"],
+            "age_verified": verification_result.get("age_verified", False),
+            "age": verification_result.get("age"),
+            "rejection_reason": verification_result.get("rejection_reason"),
+            "processed_at": datetime.now().isoformat()
+        }
+
+    def _cert_response(self, doc_id: str, cert_type: str, verification_result: Dict) -> Dict:
+        return {
+            "document_id": doc_id,
+            "cert_type": cert_type,
+            "status": verification_result["status"],
+            "cert_verified": verification_result.get("cert_verified", False),
+            "expiry_date": verification_result.get("expiry_date"),
+            "rejection_reason": verification_result.get("rejection_reason"),
+            "processed_at": datetime.now().isoformat()
+        }
+
+    async def _verify_government_id(self, document: Dict) -> Dict:
         """Process government ID for age verification"""
+        doc_id = document["id"]
+        user_email = document["user_email"]
         try:
             # In production, integrate with ID verification service like Jumio, Onfido, etc.
             # For now, we'll simulate the verification process
-            
-            # Decode base64 image
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
-            
-            # Store the document (in production, use cloud storage)
-            doc_id = f"gov_id_{user_id}_{uuid.uuid4().hex[:8]}"
-            self.verification_storage[doc_id] = {
-                "type": "government_id",
-                "user_id": user_id,
-                "user_email": user_email,
-                "image_data": image_data,
-                "uploaded_at": datetime.now().isoformat(),
-                "status": "pending"
-            }
+            inspection = await self._inspect(document)
             
             # Simulate ID verification logic
-            verification_result = self._simulate_id_verification(image_data, user_email)
+            verification_result = self._simulate_id_verification(document, user_email)
+            await self.document_store.record_result(
+                doc_id, {**verification_result, "detected_format": inspection["detected_format"]}
+            )
             
             print(f"🆔 GOVERNMENT ID VERIFICATION - User: {user_email}")
             print(f"   Document ID: {doc_id}")
@@ -43,46 +210,33 @@ class VerificationService:
             print(f"   Age: {verification_result.get('age', 'Unknown')}")
             print(f"   Valid: {verification_result.get('age_verified', False)}")
             
-            return {
-                "document_id": doc_id,
-                "status": verification_result["status"],
-                "age_verified": verification_result.get("age_verified", False),
-                "age": verification_result.get("age"),
-                "rejection_reason": verification_result.get("rejection_reason"),
-                "processed_at": datetime.now().isoformat()
-            }
+            return self._id_response(doc_id, verification_result)
             
         except Exception as e:
             logging.error(f"Government ID verification failed: {e}")
-            return {
-                "document_id": None,
+            result = {
+                "document_id": doc_id,
                 "status": "error",
                 "age_verified": False,
                 "rejection_reason": "Processing error occurred",
                 "processed_at": datetime.now().isoformat()
             }
+            await self.document_store.record_result(doc_id, {"status": "error", "rejection_reason": result["rejection_reason"]})
+            return result
     
-    def process_fitness_certification(self, image_data: str, cert_type: str, user_id: str, user_email: str) -> Dict:
+    async def _verify_fitness_certification(self, document: Dict) -> Dict:
         """Process fitness certification for trainers"""
+        doc_id = document["id"]
+        user_email = document["user_email"]
+        cert_type = document["cert_type"]
         try:
-            # Decode base64 image
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
-            
-            # Store the certification document
-            doc_id = f"cert_{cert_type}_{user_id}_{uuid.uuid4().hex[:8]}"
-            self.verification_storage[doc_id] = {
-                "type": "fitness_certification",
-                "cert_type": cert_type,
-                "user_id": user_id,
-                "user_email": user_email,
-                "image_data": image_data,
-                "uploaded_at": datetime.now().isoformat(),
-                "status": "pending"
-            }
+            inspection = await self._inspect(document)
             
             # Simulate certification verification logic
-            verification_result = self._simulate_certification_verification(image_data, cert_type, user_email)
+            verification_result = self._simulate_certification_verification(document, cert_type, user_email)
+            await self.document_store.record_result(
+                doc_id, {**verification_result, "detected_format": inspection["detected_format"]}
+            )
             
             print(f"🏋️ FITNESS CERTIFICATION VERIFICATION - User: {user_email}")
             print(f"   Document ID: {doc_id}")
@@ -90,28 +244,22 @@ class VerificationService:
             print(f"   Status: {verification_result['status']}")
             print(f"   Valid: {verification_result.get('cert_verified', False)}")
             
-            return {
-                "document_id": doc_id,
-                "cert_type": cert_type,
-                "status": verification_result["status"],
-                "cert_verified": verification_result.get("cert_verified", False),
-                "expiry_date": verification_result.get("expiry_date"),
-                "rejection_reason": verification_result.get("rejection_reason"),
-                "processed_at": datetime.now().isoformat()
-            }
+            return self._cert_response(doc_id, cert_type, verification_result)
             
         except Exception as e:
             logging.error(f"Certification verification failed: {e}")
-            return {
-                "document_id": None,
+            result = {
+                "document_id": doc_id,
                 "cert_type": cert_type,
                 "status": "error",
                 "cert_verified": False,
                 "rejection_reason": "Processing error occurred",
                 "processed_at": datetime.now().isoformat()
             }
+            await self.document_store.record_result(doc_id, {"status": "error", "rejection_reason": result["rejection_reason"]})
+            return result
     
-    def _simulate_id_verification(self, image_data: str, user_email: str) -> Dict:
+    def _simulate_id_verification(self, document: Dict, user_email: str) -> Dict:
         """Simulate government ID verification (replace with real verification service)"""
         
         # Simulate different verification outcomes based on email
@@ -151,7 +299,7 @@ class VerificationService:
                 "age_verified": True
             }
     
-    def _simulate_certification_verification(self, image_data: str, cert_type: str, user_email: str) -> Dict:
+    def _simulate_certification_verification(self, document: Dict, cert_type: str, user_email: str) -> Dict:
         """Simulate fitness certification verification"""
         
         valid_cert_types = ["NASM", "ACSM", "ACE", "NSCA", "ISSA", "NCSF"]
@@ -192,19 +340,11 @@ class VerificationService:
                 "expiry_date": "2026-06-30"
             }
     
-    def get_verification_status(self, user_id: str) -> Dict:
-        """Get overall verification status for a user"""
-        # In production, query database for user's verification documents
-        user_docs = [doc for doc in self.verification_storage.values() if doc["user_id"] == user_id]
-        
-        id_verification = None
-        cert_verification = None
-        
-        for doc in user_docs:
-            if doc["type"] == "government_id":
-                id_verification = doc
-            elif doc["type"] == "fitness_certification":
-                cert_verification = doc
+    async def get_verification_status(self, user_id: str) -> Dict:
+        """Get overall verification status for a user from their latest documents"""
+        # Latest document of each type, one indexed lookup each
+        id_verification = self._summarize(await self.document_store.latest(user_id, "government_id"))
+        cert_verification = self._summarize(await self.document_store.latest(user_id, "fitness_certification"))
         
         return {
             "user_id": user_id,
@@ -213,22 +353,31 @@ class VerificationService:
             "overall_status": self._calculate_overall_status(id_verification, cert_verification)
         }
     
+    @staticmethod
+    def _summarize(document: Optional[Dict]) -> Optional[Dict]:
+        # Blob keys, hashes and the uploader's email stay internal
+        if document is None:
+            return None
+        return {field: document[field] for field in STATUS_SUMMARY_FIELDS if field in document}
+    
     def _calculate_overall_status(self, id_verification: Optional[Dict], cert_verification: Optional[Dict]) -> str:
         """Calculate overall verification status"""
         if not id_verification:
             return "id_required"
         
+        # Verification runs in the background, so a document can still be waiting for its verdict
+        if id_verification["status"] == DOCUMENT_PENDING:
+            return "id_pending"
         if id_verification["status"] != "approved":
             return "id_rejected"
         
         # If user is a trainer, they also need certification
         if cert_verification is not None:
+            if cert_verification["status"] == DOCUMENT_PENDING:
+                return "cert_pending"
             if cert_verification["status"] != "approved":
                 return "cert_rejected"
             return "fully_verified"
         
         # For trainees, only ID verification is needed
-        return "age_verified"
-
-# Global verification service instance
-verification_service = VerificationService()
\ No newline at end of file
+        return "age_verified"
\ No newline at end of file
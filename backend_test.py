@@ -33,6 +33,15 @@ test_results = {
 def print_separator():
     print("\n" + "="*80 + "\n")
 
+def wait_for_sync_job(job_id, attempts=60):
+    """Poll a queued fitness sync until it finishes; returns the final job, or None on timeout"""
+    for _ in range(attempts):
+        response = requests.get(f"{BACKEND_URL}/sync/jobs/{job_id}")
+        if response.status_code == 200 and response.json()["status"] in ("succeeded", "failed"):
+            return response.json()
+        time.sleep(1)
+    return None
+
 def test_user_registration():
     print_separator()
     print("TESTING USER REGISTRATION FLOW")
@@ -240,7 +249,7 @@ def test_session_management_and_tree_progression(user):
     response = requests.get(f"{BACKEND_URL}/users/{user_id}/sessions")
     
     if response.status_code == 200:
-        sessions = response.json()
+        sessions = response.json()["sessions"]
         print(f"Retrieved {len(sessions)} sessions")
         
         if len(sessions) != sum(session_counts):
@@ -256,6 +265,42 @@ def test_session_management_and_tree_progression(user):
         print(f"Response: {response.text}")
         test_results["session_management"]["details"] += f"Failed to get user sessions. Status code: {response.status_code}. "
         return False
+    
+    # Page through the history a few sessions at a time
+    print("\nPaging through session history with next_cursor...")
+    paged_ids = []
+    cursor = None
+    while True:
+        params = {"limit": 4}
+        if cursor:
+            params["cursor"] = cursor
+        response = requests.get(f"{BACKEND_URL}/users/{user_id}/sessions", params=params)
+        if response.status_code != 200:
+            print(f"ERROR: Failed to page user sessions. Status code: {response.status_code}")
+            test_results["session_management"]["details"] += f"Failed to page user sessions. Status code: {response.status_code}. "
+            test_results["session_management"]["success"] = False
+            return False
+        page = response.json()
+        paged_ids.extend(session["id"] for session in page["sessions"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    
+    if len(paged_ids) != len(set(paged_ids)) or len(paged_ids) != sum(session_counts):
+        print(f"ERROR: Paging returned {len(paged_ids)} sessions ({len(set(paged_ids))} unique), expected {sum(session_counts)}")
+        test_results["session_management"]["details"] += f"Paging returned {len(paged_ids)} sessions ({len(set(paged_ids))} unique), expected {sum(session_counts)}. "
+        test_results["session_management"]["success"] = False
+        return False
+    print(f"Paged through {len(paged_ids)} sessions with no duplicates")
+    
+    # A cursor the server did not issue is rejected
+    response = requests.get(f"{BACKEND_URL}/users/{user_id}/sessions", params={"cursor": "not-a-cursor"})
+    if response.status_code != 400:
+        print(f"ERROR: Expected 400 for a malformed cursor but got {response.status_code}")
+        test_results["session_management"]["details"] += f"Malformed cursor returned {response.status_code} instead of 400. "
+        test_results["session_management"]["success"] = False
+        return False
+    print("Malformed cursor correctly rejected with 400")
         
     return True
 
@@ -692,9 +737,14 @@ def test_fitness_data_sync(user):
     
     response = requests.post(f"{BACKEND_URL}/sync/workouts", json=sync_data)
     
-    if response.status_code == 200:
-        result = response.json()
-        print(f"Sync workouts response: {json.dumps(result, indent=2)}")
+    if response.status_code == 202:
+        print(f"Sync workouts response: {json.dumps(response.json(), indent=2)}")
+        job = wait_for_sync_job(response.json()["job_id"])
+        if not job or job["status"] != "succeeded":
+            print(f"ERROR: Sync job did not succeed: {json.dumps(job, indent=2)}")
+            test_results["fitness_data_sync"]["details"] += f"Sync job did not succeed. "
+            return False
+        result = job["result"]
         
         # Verify response structure
         if "synced_workouts" in result:
@@ -1141,7 +1191,7 @@ def test_complete_user_journey():
     response = requests.get(f"{BACKEND_URL}/users/{user['id']}/sessions")
     
     if response.status_code == 200:
-        sessions = response.json()
+        sessions = response.json()["sessions"]
         print(f"Retrieved {len(sessions)} sessions")
         
         if len(sessions) == 3:
@@ -1447,10 +1497,15 @@ def test_google_api_integration():
     
     response = requests.post(f"{BACKEND_URL}/sync/workouts", json=sync_data)
     
-    if response.status_code == 200:
-        sync_result = response.json()
+    if response.status_code == 202:
         print(f"✅ Workout sync endpoint working")
-        print(f"Sync response: {json.dumps(sync_result, indent=2)}")
+        job = wait_for_sync_job(response.json()["job_id"])
+        if not job or job["status"] != "succeeded":
+            print(f"❌ ERROR: Sync job did not succeed: {json.dumps(job, indent=2)}")
+            test_results["google_api_integration"] = {"success": False, "details": "Sync job did not succeed. "}
+            return False
+        sync_result = job["result"]
+        print(f"Sync result: {json.dumps(sync_result, indent=2)}")
         
         # Verify sync response
         if "synced_workouts" in sync_result:
@@ -2749,7 +2804,7 @@ def test_dashboard_endpoints():
     response = requests.get(f"{BACKEND_URL}/users/{user_id}/sessions")
     
     if response.status_code == 200:
-        sessions = response.json()
+        sessions = response.json()["sessions"]
         print(f"✅ User sessions retrieved: {len(sessions)} sessions")
         
         if len(sessions) > 0:
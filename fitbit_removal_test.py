@@ -15,6 +15,7 @@ Test Requirements:
 
 import requests
 import json
+import time
 import uuid
 from datetime import datetime
 
@@ -24,6 +25,15 @@ BACKEND_URL = "https://523da7e0-8e2a-470e-93ce-84d37811eda4.preview.emergentagen
 def print_separator():
     print("\n" + "="*80 + "\n")
 
+def wait_for_sync_job(job_id, attempts=60):
+    """Poll a queued fitness sync until it finishes; returns the final job, or None on timeout"""
+    for _ in range(attempts):
+        response = requests.get(f"{BACKEND_URL}/sync/jobs/{job_id}")
+        if response.status_code == 200 and response.json()["status"] in ("succeeded", "failed"):
+            return response.json()
+        time.sleep(1)
+    return None
+
 def print_test_header(test_name):
     print_separator()
     print(f"TESTING: {test_name}")
@@ -204,9 +214,13 @@ def test_sync_workouts_without_fitbit(user):
     
     response = requests.post(f"{BACKEND_URL}/sync/workouts", json=sync_data)
     
-    if response.status_code == 200:
-        result = response.json()
-        print(f"Sync workouts response: {json.dumps(result, indent=2)}")
+    if response.status_code == 202:
+        print(f"Sync workouts response: {json.dumps(response.json(), indent=2)}")
+        job = wait_for_sync_job(response.json()["job_id"])
+        if not job or job["status"] != "succeeded":
+            print(f"❌ ERROR: Sync job did not succeed: {json.dumps(job, indent=2)}")
+            return False
+        result = job["result"]
         
         # Verify response structure
         if "synced_workouts" in result:
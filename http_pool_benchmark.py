@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Benchmark: fresh httpx.AsyncClient per call vs. the shared pooled client from backend/http_clients.py
+
+Runs a local HTTPS (or --plain HTTP) stub server, then issues the same requests both ways and
+prints p50/p99 latency. Usage: python http_pool_benchmark.py [--requests 500] [--concurrency 10] [--plain]
+"""
+import os
+import ssl
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from http_clients import HttpClientRegistry
+
+RESPONSE_BODY = json.dumps({"kind": "calendar#events", "items": []}).encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True  # headers and body are separate writes
+
+    def _respond(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(RESPONSE_BODY)))
+        self.end_headers()
+        self.wfile.write(RESPONSE_BODY)
+
+    do_GET = _respond
+    do_POST = _respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+def self_signed_cert(directory: str) -> tuple:
+    """Write a throwaway localhost certificate and key, return their paths"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(datetime.utcnow() - timedelta(days=1))
+        .not_valid_after(datetime.utcnow() + timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost")]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()
+        ))
+    return cert_path, key_path
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # the default backlog of 5 turns connection bursts into SYN retries
+
+
+def start_stub_server(tls_dir: str = None) -> str:
+    server = StubServer(("127.0.0.1", 0), StubHandler)
+    scheme = "http"
+    if tls_dir:
+        cert_path, key_path = self_signed_cert(tls_dir)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_path, key_path)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = "https"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"{scheme}://localhost:{server.server_address[1]}/calendars/primary/events"
+
+
+def percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run(label: str, url: str, requests: int, concurrency: int, call) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            response = await call(url)
+            response.raise_for_status()
+            samples.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "label": label,
+        "p50_ms": round(percentile(samples, 50), 2),
+        "p99_ms": round(percentile(samples, 99), 2),
+        "requests_per_second": round(requests / elapsed, 1)
+    }
+    print(f"{label:<28} p50 {result['p50_ms']:>8.2f} ms   p99 {result['p99_ms']:>8.2f} ms   {result['requests_per_second']:>8.1f} req/s")
+    return result
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as tls_dir:
+        url = start_stub_server(None if args.plain else tls_dir)
+        verify = True if args.plain else os.path.join(tls_dir, "cert.pem")
+        print(f"Stub server: {url}  ({args.requests} requests, concurrency {args.concurrency})\n")
+
+        # Current pattern: a new client (new TCP + TLS handshake) per call
+        async def fresh_client_call(target):
+            async with httpx.AsyncClient(verify=verify) as client:
+                return await client.get(target)
+
+        registry = HttpClientRegistry()
+        registry.register("stub", verify=verify)
+
+        async def pooled_call(target):
+            return await registry.get("stub").get(target)
+
+        before = await run("fresh AsyncClient per call", url, args.requests, args.concurrency, fresh_client_call)
+        after = await run("shared pooled client", url, args.requests, args.concurrency, pooled_call)
+        await registry.aclose()
+
+        print(f"\np50 speedup: {before['p50_ms'] / max(after['p50_ms'], 0.001):.1f}x   "
+              f"p99 speedup: {before['p99_ms'] / max(after['p99_ms'], 0.001):.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--plain", action="store_true", help="plain HTTP instead of TLS")
+    asyncio.run(main(parser.parse_args()))
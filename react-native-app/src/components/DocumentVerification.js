@@ -83,6 +83,21 @@ const DocumentVerification = ({ route, navigation }) => {
     });
   };
 
+  // Verification runs in the background on the server; poll its job until it finishes
+  const waitForVerification = async (jobId) => {
+    for (let attempt = 0; attempt < 60; attempt++) {
+      const { data: job } = await axios.get(`${API}/verification/jobs/${jobId}`);
+      if (job.status === 'succeeded') {
+        return job.result;
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Verification failed');
+      }
+      await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+    throw new Error('Verification is taking longer than expected');
+  };
+
   const handleIdVerification = async () => {
     if (!idImage) {
       setError('Please select a government ID image');
@@ -99,10 +114,11 @@ const DocumentVerification = ({ route, navigation }) => {
         user_email: user.email,
         image_data: idImage.base64
       });
+      const result = await waitForVerification(response.data.job_id);
 
-      if (response.data.age_verified) {
+      if (result.age_verified) {
         setSuccess('Age verification successful! You are confirmed to be 18 or older.');
-        setVerificationResults(prev => ({ ...prev, id: response.data }));
+        setVerificationResults(prev => ({ ...prev, id: result }));
         
         if (user.role === 'trainer') {
           setTimeout(() => {
@@ -121,7 +137,7 @@ const DocumentVerification = ({ route, navigation }) => {
           }, 3000);
         }
       } else {
-        setError(response.data.rejection_reason || 'Age verification failed. You must be 18 or older to use this app.');
+        setError(result.rejection_reason || 'Age verification failed. You must be 18 or older to use this app.');
       }
     } catch (error) {
       console.error('ID verification failed:', error);
@@ -148,10 +164,11 @@ const DocumentVerification = ({ route, navigation }) => {
         cert_type: certType,
         image_data: certImage.base64
       });
+      const result = await waitForVerification(response.data.job_id);
 
-      if (response.data.cert_verified) {
+      if (result.cert_verified) {
         setSuccess('Certification verification successful! You are now verified as a qualified trainer.');
-        setVerificationResults(prev => ({ ...prev, cert: response.data }));
+        setVerificationResults(prev => ({ ...prev, cert: result }));
         
         setTimeout(async () => {
           const updatedUser = {
@@ -164,7 +181,7 @@ const DocumentVerification = ({ route, navigation }) => {
           navigation.replace('Main');
         }, 3000);
       } else {
-        setError(response.data.rejection_reason || 'Certification verification failed. Please ensure your certification is valid and current.');
+        setError(result.rejection_reason || 'Certification verification failed. Please ensure your certification is valid and current.');
       }
     } catch (error) {
       console.error('Certification verification failed:', error);
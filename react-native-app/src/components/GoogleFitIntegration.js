@@ -116,15 +116,31 @@ const GoogleFitIntegration = ({ user }) => {
     }
   };
 
+  const waitForSync = async (jobId) => {
+    for (let attempt = 0; attempt < 60; attempt++) {
+      const { data: job } = await axios.get(`${API}/sync/jobs/${jobId}`);
+      if (job.status === 'succeeded') {
+        return job.result;
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Sync failed');
+      }
+      await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+    throw new Error('Sync is taking longer than expected');
+  };
+
   const syncWorkoutData = async () => {
     try {
+      // The sync runs in the background; the POST only queues it
       const response = await axios.post(`${API}/sync/workouts`, {
         user_id: user.id,
         source: 'google_fit'
       });
+      const result = await waitForSync(response.data.job_id);
 
-      if (response.data.synced_workouts) {
-        setFitnessData(response.data.synced_workouts);
+      if (result.synced_workouts) {
+        setFitnessData(result.synced_workouts);
         setLastSync(new Date().toISOString());
       }
     } catch (error) {
@@ -0,0 +1,25 @@
+"""
+Shared fixtures: backend modules on the path, and an in-memory MongoDB
+"""
+import os
+import sys
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from db_indexes import ensure_indexes  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def db():
+    """A fresh in-memory database with every index from db_indexes.INDEX_SPECS"""
+    database = AsyncMongoMockClient().test_database
+    await ensure_indexes(database)
+    return database
@@ -0,0 +1,123 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from availability_engine import (
+    AvailabilityConfig, BusyIndex, day_slots, find_available_trainers, format_timestamp, merge_intervals
+)
+
+# The seven one-hour slots CalendarService._calculate_available_slots hard-coded before the engine
+LEGACY_WORKING_HOURS = [
+    ("09:00", "10:00"), ("10:00", "11:00"), ("11:00", "12:00"),
+    ("14:00", "15:00"), ("15:00", "16:00"), ("16:00", "17:00"), ("17:00", "18:00")
+]
+
+
+def legacy_day_slots(busy_times, date):
+    """The old per-slot x per-busy check (in UTC, as the engine works)"""
+    slots = []
+    for start_time, end_time in LEGACY_WORKING_HOURS:
+        slot_start = datetime.fromisoformat(f"{date}T{start_time}:00+00:00")
+        slot_end = datetime.fromisoformat(f"{date}T{end_time}:00+00:00")
+        is_available = True
+        for busy_time in busy_times:
+            busy_start = datetime.fromisoformat(busy_time['start'].replace('Z', '+00:00'))
+            busy_end = datetime.fromisoformat(busy_time['end'].replace('Z', '+00:00'))
+            if slot_start < busy_end and slot_end > busy_start:
+                is_available = False
+                break
+        slots.append({"start_time": start_time, "end_time": end_time, "available": is_available})
+    return slots
+
+
+def random_busy_times(rng, first_day, days, per_day):
+    busy = []
+    for day in range(days):
+        day_start = first_day + timedelta(days=day)
+        for _ in range(per_day):
+            # Quarter-hour starts land exactly on slot edges often enough to exercise touching intervals
+            start = day_start + timedelta(minutes=rng.randrange(6 * 60, 20 * 60, 15))
+            end = start + timedelta(minutes=rng.choice([15, 30, 60, 90, 180]))
+            busy.append({"start": start.isoformat() + "Z", "end": end.isoformat() + "Z"})
+    rng.shuffle(busy)
+    return busy
+
+
+# Interval merging
+
+@pytest.mark.parametrize("intervals, merged", [
+    ([(1, 3), (3, 5)], [(1, 5)]),                       # touching
+    ([(1, 4), (2, 6)], [(1, 6)]),                       # overlapping
+    ([(1, 10), (2, 3), (4, 5)], [(1, 10)]),             # nested
+    ([(8, 9), (1, 2), (5, 6), (2, 3)], [(1, 3), (5, 6), (8, 9)]),  # unsorted, with a gap
+    ([(4, 4), (6, 5), (1, 2)], [(1, 2)]),               # empty and inverted intervals are dropped
+    ([], []),
+])
+def test_merge_intervals(intervals, merged):
+    assert merge_intervals(intervals) == merged
+
+
+@pytest.mark.parametrize("start, end, overlaps", [
+    (0, 10, False),    # ends exactly where busy time starts
+    (20, 30, False),   # starts exactly where busy time ends
+    (5, 11, True),     # overlaps the start
+    (19, 25, True),    # overlaps the end
+    (12, 15, True),    # nested inside busy time
+    (5, 25, True),     # busy time nested inside
+    (20, 40, False),   # the whole gap
+    (39, 41, True),    # into the next busy block
+])
+def test_busy_index_conflicts_at_interval_edges(start, end, overlaps):
+    busy = BusyIndex([(10, 20), (40, 50)])
+    assert busy.overlaps(start, end) is overlaps
+
+
+def test_busy_index_matches_a_linear_scan():
+    rng = random.Random(7)
+    for _ in range(200):
+        intervals = [(start, start + rng.randrange(1, 40)) for start in (rng.randrange(0, 200) for _ in range(12))]
+        busy = BusyIndex(intervals)
+        for _ in range(50):
+            start = rng.randrange(-10, 240)
+            end = start + rng.randrange(1, 60)
+            expected = any(start < busy_end and end > busy_start for busy_start, busy_end in intervals)
+            assert busy.overlaps(start, end) is expected, (intervals, start, end)
+
+
+# Equivalence with the legacy slot generation
+
+def test_default_config_offers_the_legacy_slots():
+    assert [(slot["start_time"], slot["end_time"]) for slot in day_slots(AvailabilityConfig(), "2025-01-06", BusyIndex())] \
+        == LEGACY_WORKING_HOURS
+
+
+def test_day_slots_match_the_legacy_calculation():
+    rng = random.Random(11)
+    first_day = datetime(2025, 1, 6)
+    for _ in range(100):
+        busy = random_busy_times(rng, first_day, days=1, per_day=rng.randrange(0, 8))
+        assert day_slots(AvailabilityConfig(), "2025-01-06", BusyIndex(busy)) == legacy_day_slots(busy, "2025-01-06")
+
+
+def test_multi_trainer_search_matches_the_legacy_loop():
+    rng = random.Random(3)
+    first_day = datetime(2025, 1, 6)
+    days = 14
+    busy_times = {f"trainer_{index}": random_busy_times(rng, first_day, days, per_day=6) for index in range(20)}
+
+    found = find_available_trainers(
+        {trainer_id: AvailabilityConfig() for trainer_id in busy_times}, busy_times,
+        first_day.isoformat() + "Z", (first_day + timedelta(days=days)).isoformat() + "Z"
+    )
+
+    expected = {}
+    for trainer_id, busy in busy_times.items():
+        for day in range(days):
+            date = (first_day + timedelta(days=day)).strftime("%Y-%m-%d")
+            expected.setdefault(trainer_id, []).extend(
+                format_timestamp(int(datetime.fromisoformat(f"{date}T{slot['start_time']}:00+00:00").timestamp()))
+                for slot in legacy_day_slots(busy, date) if slot["available"]
+            )
+    expected = {trainer_id: starts for trainer_id, starts in expected.items() if starts}
+    assert {trainer_id: [slot["start"] for slot in slots] for trainer_id, slots in found.items()} == expected
@@ -0,0 +1,66 @@
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import ServerSelectionTimeoutError
+
+from db_indexes import INDEX_SPECS, IndexProvisioningError, ensure_indexes
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def empty_db():
+    return AsyncMongoMockClient().test_database
+
+
+def test_replay_and_dedup_indexes_are_required():
+    required = {
+        f"{collection}.{spec['name']}"
+        for collection, specs in INDEX_SPECS.items() for spec in specs if spec.get("required")
+    }
+    assert required == {
+        "idempotency_keys.key_unique",
+        "sync_jobs.queued_coalesce_key_unique",
+        "stripe_events.queued_coalesce_key_unique",
+        "verification_jobs.queued_coalesce_key_unique",
+        "document_blobs.sha256_unique",
+        "sessions.session_key_unique",
+    }
+
+
+async def test_ensure_indexes_creates_everything_on_a_clean_database(empty_db):
+    created = await ensure_indexes(empty_db)
+    assert created == {collection: [spec["name"] for spec in specs] for collection, specs in INDEX_SPECS.items()}
+
+
+async def test_blocked_required_index_aborts_provisioning(empty_db):
+    # Duplicates left behind while the index was missing
+    await empty_db.idempotency_keys.insert_many([{"key": "k1"}, {"key": "k1"}])
+
+    with pytest.raises(IndexProvisioningError, match="idempotency_keys.key_unique"):
+        await ensure_indexes(empty_db)
+
+    # Every other index was still attempted
+    assert "session_key_unique" in await empty_db.sessions.index_information()
+
+
+async def test_blocked_optional_index_is_only_logged(empty_db, caplog):
+    await empty_db.trainer_availability.insert_many([{"trainer_id": "t1"}, {"trainer_id": "t1"}])
+
+    created = await ensure_indexes(empty_db)
+
+    assert "trainer_availability" not in created
+    assert "trainer_availability.trainer_id_unique could not be created" in caplog.text
+
+
+async def test_unreachable_server_fails_on_the_first_index(empty_db, monkeypatch):
+    attempts = []
+
+    async def unreachable(self, keys, **options):
+        attempts.append(options["name"])
+        raise ServerSelectionTimeoutError("localhost:27017: [Errno 111] Connection refused")
+
+    monkeypatch.setattr(type(empty_db.users), "create_index", unreachable)
+
+    with pytest.raises(ServerSelectionTimeoutError):
+        await ensure_indexes(empty_db)
+    assert len(attempts) == 1
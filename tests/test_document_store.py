@@ -0,0 +1,56 @@
+import pytest
+
+from document_store import DocumentStore, LocalBlobStore, content_key
+
+pytestmark = pytest.mark.anyio
+
+IMAGE = b"\x89PNG\r\n\x1a\nsame image"
+
+
+@pytest.fixture
+def store(db, tmp_path):
+    return DocumentStore(db.verification_documents, db.document_blobs, blobs=LocalBlobStore(str(tmp_path / "hot")),
+                         cold_blobs=LocalBlobStore(str(tmp_path / "cold")))
+
+
+async def test_identical_uploads_share_one_blob(store, tmp_path):
+    first = await store.save("government_id", "u1", "u1@example.com", IMAGE, "image/png", doc_id="doc_1")
+    second = await store.save("government_id", "u2", "u2@example.com", IMAGE, "image/png", doc_id="doc_2")
+
+    assert (first["deduplicated"], second["deduplicated"]) == (False, True)
+    blob = await store.blob_refs.find_one({"sha256": first["sha256"]})
+    assert (blob["ref_count"], blob["doc_ids"]) == (2, ["doc_1", "doc_2"])
+    # Both staged uploads are gone; only the content-addressed copy is left
+    assert list((tmp_path / "hot").glob("uploads/*")) == []
+    assert await store.blobs.get(content_key(first["sha256"])) == IMAGE
+
+
+async def test_deleting_the_last_reference_during_an_identical_upload_keeps_the_blob(store):
+    await store.save("government_id", "u1", "u1@example.com", IMAGE, "image/png", doc_id="doc_1")
+
+    # The old reference goes away while the new upload decides what to do with its staged copy
+    delete_blob = store.blobs.delete
+
+    async def delete_during_upload(key):
+        if key == "uploads/doc_2":
+            assert await store.delete("doc_1")
+        await delete_blob(key)
+
+    store.blobs.delete = delete_during_upload
+    document = await store.save("government_id", "u1", "u1@example.com", IMAGE, "image/png", doc_id="doc_2")
+
+    assert document["deduplicated"]
+    blob = await store.blob_refs.find_one({"sha256": document["sha256"]})
+    assert (blob["ref_count"], blob["doc_ids"]) == (1, ["doc_2"])
+    assert await store.read_image("doc_2") == (IMAGE, "image/png")
+
+
+async def test_failed_promotion_releases_the_reference(store):
+    async def unavailable(source, destination):
+        raise OSError("disk full")
+
+    store.blobs.move = unavailable
+
+    with pytest.raises(OSError):
+        await store.save("government_id", "u1", "u1@example.com", IMAGE, "image/png", doc_id="doc_1")
+    assert await store.blob_refs.count_documents({}) == 0
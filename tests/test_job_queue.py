@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from job_queue import JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JobQueue
+
+pytestmark = pytest.mark.anyio
+
+
+async def _noop(payload, report_progress):
+    return {}
+
+
+async def test_enqueue_coalesces_onto_the_queued_job(db):
+    queue = JobQueue(db.sync_jobs, _noop)
+    first = await queue.enqueue("sync:u1", {"user_id": "u1"})
+    second = await queue.enqueue("sync:u1", {"user_id": "u1"})
+
+    assert (first["coalesced"], second["coalesced"]) == (False, True)
+    assert second["id"] == first["id"]
+    assert await db.sync_jobs.count_documents({}) == 1
+
+
+async def test_enqueue_raises_when_both_attempts_collide():
+    class AlwaysColliding:
+        async def find_one_and_update(self, *args, **kwargs):
+            raise DuplicateKeyError("E11000 duplicate key error")
+
+    queue = JobQueue(AlwaysColliding(), _noop)
+    with pytest.raises(RuntimeError):
+        await queue.enqueue("sync:u1", {"user_id": "u1"})
+
+
+async def _abandon(db, queue, attempts):
+    """A running job whose worker died: its lease has expired"""
+    job = await queue.enqueue("sync:u1", {"user_id": "u1"})
+    await db.sync_jobs.update_one({"id": job["id"]}, {"$set": {
+        "status": JOB_RUNNING,
+        "attempts": attempts,
+        "lease_expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)
+    }})
+    return job["id"]
+
+
+async def test_expired_lease_is_reclaimed_while_attempts_remain(db):
+    queue = JobQueue(db.sync_jobs, _noop, max_attempts=3)
+    job_id = await _abandon(db, queue, attempts=2)
+
+    assert await queue._fail_abandoned() == 0
+    claimed = await queue._claim()
+    assert claimed["id"] == job_id
+    assert (await queue.get(job_id))["attempts"] == 3
+
+
+async def test_expired_lease_on_the_last_attempt_fails_the_job(db):
+    queue = JobQueue(db.sync_jobs, _noop, max_attempts=3)
+    job_id = await _abandon(db, queue, attempts=3)
+
+    assert await queue._claim() is None
+    assert await queue._fail_abandoned() == 1
+
+    job = await queue.get(job_id)
+    assert job["status"] == JOB_FAILED
+    assert job["error"]
+    assert job["expires_at"] > datetime.now(timezone.utc).replace(tzinfo=None)
+    assert "lease_expires_at" not in job
+    # A new sync for the same user can be queued again
+    assert (await queue.enqueue("sync:u1", {"user_id": "u1"}))["status"] == JOB_QUEUED
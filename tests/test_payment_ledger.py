@@ -0,0 +1,79 @@
+from datetime import datetime
+
+import pytest
+
+from payment_ledger import PaymentLedger
+
+pytestmark = pytest.mark.anyio
+
+
+def _intent(intent_id, status, created, amount=5000, trainer_id="t1"):
+    """A PaymentIntent as Stripe lists it (only the fields the backfill reads)"""
+    return {
+        "id": intent_id,
+        "object": "payment_intent",
+        "amount": amount,
+        "currency": "usd",
+        "status": status,
+        "created": int(created.timestamp()),
+        "metadata": {"trainer_id": trainer_id, "client_id": "c1", "session_id": f"s_{intent_id}"} if trainer_id else {}
+    }
+
+
+# Newest first, the order Stripe lists them in
+STRIPE_INTENTS = [
+    _intent("pi_open", "requires_payment_method", datetime(2025, 3, 2), amount=7000),
+    _intent("pi_march", "succeeded", datetime(2025, 3, 1), amount=6000),
+    _intent("pi_other", "succeeded", datetime(2025, 2, 20), trainer_id=None),
+    _intent("pi_canceled", "canceled", datetime(2025, 2, 15), amount=3000),
+    _intent("pi_feb", "succeeded", datetime(2025, 2, 10), amount=5000),
+]
+
+
+async def test_backfill_loads_trainer_payments_from_stripe(db):
+    ledger = PaymentLedger(db)
+    counts = await ledger.backfill(STRIPE_INTENTS)
+
+    assert counts == {"recorded": 4, "succeeded": 2, "failed": 1, "skipped": 1}
+    summary = await db.trainer_earnings.find_one({"trainer_id": "t1"})
+    assert summary["total_cents"] == 11000
+    assert summary["pending_cents"] == 7000
+    assert summary["completed_sessions"] == 2
+    # Filed under the month each payment was made, not the month of the backfill
+    assert summary["monthly_cents"] == {"2025-02": 5000, "2025-03": 6000}
+    assert [payment["id"] for payment in summary["recent_payments"]] == ["pi_march", "pi_feb"]
+    assert (await ledger.get_payment("pi_canceled"))["status"] == "failed"
+
+
+async def test_backfill_is_idempotent(db):
+    ledger = PaymentLedger(db)
+    await ledger.backfill(STRIPE_INTENTS)
+    before = await db.trainer_earnings.find_one({"trainer_id": "t1"}, {"_id": 0, "updated_at": 0})
+
+    counts = await ledger.backfill(STRIPE_INTENTS)
+
+    assert (counts["succeeded"], counts["failed"]) == (0, 0)
+    assert await db.trainer_earnings.find_one({"trainer_id": "t1"}, {"_id": 0, "updated_at": 0}) == before
+    assert await db.payments.count_documents({}) == 4
+
+
+async def test_backfill_settles_payments_the_ledger_recorded_as_pending(db):
+    ledger = PaymentLedger(db)
+    await ledger.record_payment_intent({"id": "pi_march", "trainer_id": "t1", "amount": 6000})
+
+    await ledger.backfill(STRIPE_INTENTS[1:2])
+
+    summary = await db.trainer_earnings.find_one({"trainer_id": "t1"})
+    assert (summary["total_cents"], summary["pending_cents"], summary["completed_sessions"]) == (6000, 0, 1)
+
+
+async def test_recent_payments_stay_newest_first(db):
+    ledger = PaymentLedger(db)
+    for index, paid_at in enumerate([datetime(2025, 1, day) for day in (3, 1, 7, 2, 9, 5, 4)]):
+        await ledger.record_payment_intent({"id": f"pi_{index}", "trainer_id": "t1", "amount": 1000})
+        await ledger.mark_succeeded(f"pi_{index}", paid_at=paid_at)
+
+    earnings = await ledger.get_trainer_earnings("t1")
+    assert [payment["date"][:10] for payment in earnings["recent_payments"]] == [
+        "2025-01-09", "2025-01-07", "2025-01-05", "2025-01-04", "2025-01-03"
+    ]
@@ -0,0 +1,97 @@
+from datetime import date
+
+import pytest
+
+from progress_service import ProgressService, advance_streak, current_streak
+
+pytestmark = pytest.mark.anyio
+
+
+def test_first_active_day_starts_a_streak():
+    assert advance_streak({}, date(2025, 1, 6)) == {
+        "current_streak": 1, "longest_streak": 1, "last_active_day": "2025-01-06"
+    }
+
+
+def test_same_day_is_a_no_op():
+    state = {"current_streak": 3, "longest_streak": 5, "last_active_day": "2025-01-06"}
+    assert advance_streak(state, date(2025, 1, 6)) is state
+
+
+def test_consecutive_days_extend_the_streak():
+    state = {}
+    for day in range(6, 10):
+        state = advance_streak(state, date(2025, 1, day))
+    assert state == {"current_streak": 4, "longest_streak": 4, "last_active_day": "2025-01-09"}
+
+
+def test_missed_day_resets_the_streak_but_keeps_the_longest():
+    state = {"current_streak": 4, "longest_streak": 4, "last_active_day": "2025-01-09"}
+    state = advance_streak(state, date(2025, 1, 11))
+    assert state == {"current_streak": 1, "longest_streak": 4, "last_active_day": "2025-01-11"}
+
+
+def test_older_day_cannot_be_applied():
+    state = {"current_streak": 2, "longest_streak": 2, "last_active_day": "2025-01-09"}
+    assert advance_streak(state, date(2025, 1, 8)) is None
+
+
+def test_current_streak_lapses_after_a_missed_day():
+    progress = {"current_streak": 3, "last_active_day": "2025-01-09"}
+    assert current_streak(progress, today=date(2025, 1, 9)) == 3
+    assert current_streak(progress, today=date(2025, 1, 10)) == 3
+    assert current_streak(progress, today=date(2025, 1, 11)) == 0
+    assert current_streak({"last_active_day": None}, today=date(2025, 1, 11)) == 0
+
+
+async def _add_sessions(db, service, user_id, days):
+    created_at = [f"2025-01-{day:02d}T10:00:00" for day in days]
+    await db.sessions.insert_many(
+        [{"id": f"{user_id}_{value}_{index}", "user_id": user_id, "created_at": value} for index, value in enumerate(created_at)]
+    )
+    await service.record_sessions(user_id, created_at)
+
+
+async def test_record_sessions_advances_the_stored_streak(db):
+    service = ProgressService(db)
+    await _add_sessions(db, service, "u1", [6, 7])
+    await _add_sessions(db, service, "u1", [7, 8])
+
+    progress = await service.get_progress("u1")
+    assert progress["total_sessions"] == 4
+    assert (progress["current_streak"], progress["longest_streak"], progress["last_active_day"]) == (3, 3, "2025-01-08")
+
+
+async def test_backdated_session_falls_back_to_a_rebuild(db):
+    service = ProgressService(db)
+    await _add_sessions(db, service, "u1", [6, 7, 9])
+    rebuilds = []
+    original_rebuild = service.rebuild
+
+    async def tracking_rebuild(user_id):
+        rebuilds.append(user_id)
+        return await original_rebuild(user_id)
+
+    service.rebuild = tracking_rebuild
+    # The 8th closes the gap, but it is older than the last active day
+    await _add_sessions(db, service, "u1", [8])
+
+    assert rebuilds == ["u1"]
+    progress = await service.get_progress("u1")
+    assert progress["total_sessions"] == 4
+    assert (progress["current_streak"], progress["longest_streak"], progress["last_active_day"]) == (4, 4, "2025-01-09")
+
+
+async def test_first_sync_after_deploy_counts_a_legacy_users_history(db):
+    service = ProgressService(db)
+    # Sessions written before tree_progress existed: no progress document at all
+    await db.sessions.insert_many([
+        {"id": f"legacy_{index}", "user_id": "u1", "created_at": f"2025-01-{day:02d}T10:00:00"}
+        for index, day in enumerate([2, 3, 4, 6, 7, 8, 9] * 7 + [9])
+    ])
+
+    await _add_sessions(db, service, "u1", [10])
+
+    progress = await service.get_progress("u1")
+    assert progress["total_sessions"] == 51
+    assert (progress["current_streak"], progress["longest_streak"], progress["last_active_day"]) == (5, 5, "2025-01-10")
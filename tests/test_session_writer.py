@@ -0,0 +1,111 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from session_writer import SessionBatchWriter, make_session_key
+
+pytestmark = pytest.mark.anyio
+
+
+class RecordingProgress:
+    """Stands in for ProgressService, remembering which sessions were rolled into progress"""
+
+    def __init__(self):
+        self.recorded = {}
+
+    async def record_sessions(self, user_id, created_ats):
+        self.recorded.setdefault(user_id, []).extend(created_ats)
+
+
+def _session(session_id, user_id="u1", key_parts=None, day=6):
+    doc = {
+        "id": session_id,
+        "user_id": user_id,
+        "session_type": "workout",
+        "completed": True,
+        "created_at": datetime(2025, 1, day, 9, 0)
+    }
+    if key_parts is not None:
+        doc["session_key"] = make_session_key(user_id, *key_parts)
+    return doc
+
+
+async def test_repeated_session_keys_keep_one_session_per_key(db):
+    progress = RecordingProgress()
+    async with SessionBatchWriter(db, progress, max_batch_size=100) as first:
+        await first.add(_session("s1", key_parts=("fit", 1)))
+        await first.add(_session("s2", key_parts=("fit", 1)))
+        await first.add(_session("s3", key_parts=("fit", 2)))
+    assert (first.stats()["inserted"], first.stats()["duplicates"]) == (2, 1)
+
+    # A later sync importing the same data points again
+    async with SessionBatchWriter(db, progress, max_batch_size=100) as writer:
+        await writer.add(_session("s4", key_parts=("fit", 1)))
+        await writer.add(_session("s5", key_parts=("fit", 2)))
+
+    for key_parts in (("fit", 1), ("fit", 2)):
+        assert await db.sessions.count_documents({"session_key": make_session_key("u1", *key_parts)}) == 1
+    assert await db.sessions.count_documents({}) == 2
+    assert (writer.stats()["inserted"], writer.stats()["duplicates"]) == (0, 2)
+    # Only the first copy of each key reached tree progress
+    assert len(progress.recorded["u1"]) == 2
+
+
+
+async def test_partial_failure_does_not_stop_the_rest_of_the_batch(db):
+    await db.sessions.insert_one(_session("taken"))
+    progress = RecordingProgress()
+
+    async with SessionBatchWriter(db, progress, max_batch_size=100) as writer:
+        await writer.add(_session("a", day=6))
+        # Collides with an existing id, so this one write fails
+        await writer.add(_session("taken", day=7))
+        await writer.add(_session("b", day=8))
+
+    stats = writer.stats()
+    assert (stats["inserted"], stats["duplicates"], stats["failed"], stats["flushes"]) == (2, 0, 1, 1)
+    # Unordered, so the write after the failed one still landed
+    assert sorted(await db.sessions.distinct("id")) == ["a", "b", "taken"]
+    assert [created_at.day for created_at in progress.recorded["u1"]] == [6, 8]
+
+
+class FailingSessions:
+    """A sessions collection whose bulk_write fails part-way, reporting errors the way MongoDB does"""
+
+    def __init__(self, details):
+        self.details = details
+        self.ordered = None
+
+    async def bulk_write(self, operations, ordered=True):
+        self.ordered = ordered
+        raise BulkWriteError(self.details)
+
+
+async def test_bulk_write_errors_are_attributed_per_item():
+    # Position 1 is a keyed upsert that lost a race with a concurrent sync, position 3 a
+    # document MongoDB rejected; 0 and 4 are plain inserts and 2 is a fresh upsert
+    details = {
+        "writeErrors": [
+            {"index": 1, "code": 11000, "errmsg": "E11000 duplicate key error"},
+            {"index": 3, "code": 121, "errmsg": "Document failed validation"}
+        ],
+        "upserted": [{"index": 2, "_id": "x"}],
+        "nInserted": 2, "nUpserted": 1, "nMatched": 0, "nModified": 0, "nRemoved": 0,
+        "writeConcernErrors": []
+    }
+    sessions = FailingSessions(details)
+    progress = RecordingProgress()
+
+    async with SessionBatchWriter(SimpleNamespace(sessions=sessions), progress) as writer:
+        await writer.add(_session("a", day=6))
+        await writer.add(_session("b", key_parts=("fit", 1), day=7))
+        await writer.add(_session("c", key_parts=("fit", 2), day=8))
+        await writer.add(_session("d", day=9))
+        await writer.add(_session("e", day=10))
+
+    assert sessions.ordered is False
+    stats = writer.stats()
+    assert (stats["inserted"], stats["duplicates"], stats["failed"]) == (3, 1, 1)
+    assert [created_at.day for created_at in progress.recorded["u1"]] == [6, 8, 10]
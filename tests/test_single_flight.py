@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+
+class Upstream:
+    """An upstream call that blocks until released and counts how often it ran"""
+
+    def __init__(self, result="data", error=None):
+        self.result = result
+        self.error = error
+        self.started = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.started += 1
+        await self.release.wait()
+        if self.error:
+            raise self.error
+        return self.result
+
+
+async def test_concurrent_calls_with_one_key_share_one_execution():
+    group = SingleFlight("test_coalescing")
+    upstream = Upstream()
+
+    waiters = [asyncio.create_task(group.do("user_1", upstream)) for _ in range(5)]
+    await asyncio.sleep(0)
+    upstream.release.set()
+
+    assert await asyncio.gather(*waiters) == ["data"] * 5
+    assert upstream.started == 1
+    stats = group.stats()
+    assert (stats["calls"], stats["executions"], stats["coalesced"], stats["in_flight"]) == (5, 1, 4, 0)
+
+
+async def test_different_keys_run_separately():
+    group = SingleFlight("test_keys")
+    first, second = Upstream("one"), Upstream("two")
+
+    waiters = [asyncio.create_task(group.do("user_1", first)), asyncio.create_task(group.do("user_2", second))]
+    await asyncio.sleep(0)
+    first.release.set()
+    second.release.set()
+
+    assert await asyncio.gather(*waiters) == ["one", "two"]
+    assert (first.started, second.started) == (1, 1)
+
+
+async def test_finished_call_is_not_reused():
+    group = SingleFlight("test_sequential")
+    upstream = Upstream()
+    upstream.release.set()
+
+    await group.do("user_1", upstream)
+    await group.do("user_1", upstream)
+
+    assert upstream.started == 2
+    assert group.stats()["coalesced"] == 0
+
+
+async def test_exception_propagates_to_every_waiter():
+    group = SingleFlight("test_errors")
+    upstream = Upstream(error=RuntimeError("upstream 503"))
+
+    waiters = [asyncio.create_task(group.do("user_1", upstream)) for _ in range(3)]
+    await asyncio.sleep(0)
+    upstream.release.set()
+
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) and str(result) == "upstream 503" for result in results)
+    assert upstream.started == 1
+    # A failed call is forgotten, so the next caller retries
+    assert group.stats()["in_flight"] == 0
+
+
+async def test_cancelled_waiter_does_not_cancel_the_shared_call():
+    group = SingleFlight("test_cancel")
+    upstream = Upstream()
+
+    leaving = asyncio.create_task(group.do("user_1", upstream))
+    staying = asyncio.create_task(group.do("user_1", upstream))
+    await asyncio.sleep(0)
+    leaving.cancel()
+    await asyncio.sleep(0)
+    upstream.release.set()
+
+    assert await staying == "data"
+    assert leaving.cancelled()
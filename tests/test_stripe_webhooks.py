@@ -0,0 +1,203 @@
+import hashlib
+import hmac
+import json
+import os
+import time
+
+import pytest
+
+from job_queue import JobQueue
+from payment_ledger import PaymentLedger
+from stripe_webhooks import PaymentEventProcessor, WebhookSignatureError, verify_event
+
+pytestmark = pytest.mark.anyio
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "stripe")
+SECRET = "whsec_test_liftlink"
+
+
+def load_event(event_type):
+    with open(os.path.join(FIXTURES, f"{event_type}.json")) as f:
+        return json.load(f)
+
+
+def sign(payload: bytes, secret=SECRET, timestamp=None):
+    """A Stripe-Signature header for payload, computed the way Stripe does"""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signature = hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+@pytest.fixture
+async def ledger(db):
+    return PaymentLedger(db)
+
+
+@pytest.fixture
+async def processor(db, ledger):
+    return PaymentEventProcessor(db, ledger)
+
+
+async def _checkin(db, ledger, intent_id="pi_3QLiftLinkTest0001", amount=7500):
+    """What complete-checkin leaves behind: a pending ledger entry and an unpaid session"""
+    await ledger.record_payment_intent({"id": intent_id, "trainer_id": "trainer_001", "amount": amount})
+    await db.sessions.insert_one({"id": "session_001", "user_id": "client_001", "payment_id": intent_id,
+                                  "payment_status": "pending"})
+
+
+async def _earnings(db):
+    return await db.trainer_earnings.find_one({"trainer_id": "trainer_001"}, {"_id": 0})
+
+
+# Event processing
+
+async def test_payment_succeeded_moves_the_payment_into_earnings(db, ledger, processor):
+    await _checkin(db, ledger)
+
+    result = await processor.process(load_event("payment_intent.succeeded"))
+
+    assert (result["handled"], result["ledger_updated"], result["sessions_updated"]) == (True, True, 1)
+    earnings = await _earnings(db)
+    assert (earnings["total_cents"], earnings["pending_cents"], earnings["completed_sessions"]) == (7500, 0, 1)
+    session = await db.sessions.find_one({"id": "session_001"})
+    assert session["payment_status"] == "paid"
+    assert session["payment_confirmed_at"]
+
+
+async def test_payment_succeeded_records_a_payment_the_ledger_never_saw(db, processor):
+    await processor.process(load_event("payment_intent.succeeded"))
+
+    payment = await db.payments.find_one({"id": "pi_3QLiftLinkTest0001"})
+    assert (payment["status"], payment["amount"], payment["client_id"]) == ("succeeded", 7500, "client_001")
+    assert (await _earnings(db))["total_cents"] == 7500
+
+
+async def test_payment_failed_leaves_the_payment_pending(db, ledger, processor):
+    await _checkin(db, ledger)
+
+    result = await processor.process(load_event("payment_intent.payment_failed"))
+
+    assert (result["ledger_updated"], result["sessions_updated"]) == (False, 1)
+    assert (await ledger.get_payment("pi_3QLiftLinkTest0001"))["status"] == "pending"
+    assert (await _earnings(db))["pending_cents"] == 7500
+    assert (await db.sessions.find_one({"id": "session_001"}))["payment_status"] == "failed"
+
+
+async def test_payment_canceled_drops_the_pending_amount(db, ledger, processor):
+    await _checkin(db, ledger)
+
+    result = await processor.process(load_event("payment_intent.canceled"))
+
+    assert (result["ledger_updated"], result["sessions_updated"]) == (True, 1)
+    assert (await ledger.get_payment("pi_3QLiftLinkTest0001"))["status"] == "failed"
+    earnings = await _earnings(db)
+    assert (earnings["pending_cents"], earnings.get("total_cents", 0)) == (0, 0)
+    assert (await db.sessions.find_one({"id": "session_001"}))["payment_status"] == "canceled"
+
+
+async def test_checkout_completed_counts_the_checkout_payment(db, ledger, processor):
+    result = await processor.process(load_event("checkout.session.completed"))
+
+    assert (result["payment_id"], result["ledger_updated"]) == ("pi_3QLiftLinkTest0002", True)
+    payment = await ledger.get_payment("pi_3QLiftLinkTest0002")
+    assert (payment["amount"], payment["client_id"]) == (12500, "client@example.com")
+    assert (await _earnings(db))["total_cents"] == 12500
+
+
+async def test_unpaid_checkout_is_ignored(db, processor):
+    event = load_event("checkout.session.completed")
+    event["data"]["object"]["payment_status"] = "unpaid"
+
+    result = await processor.process(event)
+
+    assert result["ledger_updated"] is False
+    assert await db.payments.count_documents({}) == 0
+
+
+async def test_unhandled_event_types_are_acknowledged(processor):
+    event = load_event("payment_intent.succeeded")
+    event["type"] = "charge.refund.updated"
+
+    assert (await processor.process(event))["handled"] is False
+
+
+async def test_every_fixture_applies_twice_without_double_counting(db, ledger, processor):
+    await _checkin(db, ledger)
+    for event_type in ("payment_intent.payment_failed", "payment_intent.succeeded", "checkout.session.completed"):
+        await processor.process(load_event(event_type))
+    once = await _earnings(db)
+
+    for event_type in ("payment_intent.payment_failed", "payment_intent.succeeded", "checkout.session.completed"):
+        await processor.process(load_event(event_type))
+
+    again = await _earnings(db)
+    assert {key: again[key] for key in ("total_cents", "pending_cents", "completed_sessions", "monthly_cents")} == \
+        {key: once[key] for key in ("total_cents", "pending_cents", "completed_sessions", "monthly_cents")}
+    assert (once["total_cents"], once["completed_sessions"]) == (20000, 2)
+
+
+# Signature verification
+
+def test_verify_event_accepts_a_correctly_signed_payload():
+    payload = json.dumps(load_event("payment_intent.succeeded")).encode()
+
+    event = verify_event(payload, sign(payload), SECRET)
+
+    assert (event["id"], event["type"]) == ("evt_3QLiftLinkSucceeded", "payment_intent.succeeded")
+
+
+def test_verify_event_rejects_a_bad_signature():
+    payload = json.dumps(load_event("payment_intent.succeeded")).encode()
+
+    with pytest.raises(WebhookSignatureError):
+        verify_event(payload, sign(payload, secret="whsec_someone_else"), SECRET)
+    with pytest.raises(WebhookSignatureError):
+        verify_event(payload, None, SECRET)
+
+
+def test_verify_event_rejects_a_tampered_payload():
+    payload = json.dumps(load_event("payment_intent.succeeded")).encode()
+    tampered = payload.replace(b'"amount_received": 7500', b'"amount_received": 750000')
+
+    with pytest.raises(WebhookSignatureError):
+        verify_event(tampered, sign(payload), SECRET)
+
+
+def test_verify_event_rejects_a_stale_timestamp():
+    payload = json.dumps(load_event("payment_intent.succeeded")).encode()
+
+    with pytest.raises(WebhookSignatureError):
+        verify_event(payload, sign(payload, timestamp=int(time.time()) - 3600), SECRET)
+
+
+def test_verify_event_rejects_signed_payloads_that_are_not_events():
+    payload = b'{"object": "payment_intent"}'
+
+    with pytest.raises(WebhookSignatureError):
+        verify_event(payload, sign(payload), SECRET)
+
+
+async def test_redelivered_event_is_applied_once(db, ledger, processor):
+    """The webhook path end to end: verify, enqueue under stripe:{event id}, then run the job"""
+    queue = JobQueue(db.stripe_events, lambda event, report_progress: processor.process(event))
+    await _checkin(db, ledger)
+    payload = json.dumps(load_event("payment_intent.succeeded")).encode()
+
+    async def deliver():
+        event = verify_event(payload, sign(payload), SECRET)
+        return await queue.enqueue(f"stripe:{event['id']}", event)
+
+    # Stripe retries before our worker got to the first delivery: both share one job
+    first, second = await deliver(), await deliver()
+    assert second["coalesced"] and second["id"] == first["id"]
+    await queue._run(await queue._claim())
+
+    # A retry after the job ran gets a new job, which must not count the payment again
+    third = await deliver()
+    assert not third["coalesced"]
+    await queue._run(await queue._claim())
+
+    jobs = await db.stripe_events.find({}, {"_id": 0}).sort("created_at", 1).to_list(length=None)
+    assert [job["result"]["ledger_updated"] for job in jobs] == [True, False]
+    earnings = await _earnings(db)
+    assert (earnings["total_cents"], earnings["completed_sessions"]) == (7500, 1)
@@ -0,0 +1,145 @@
+import pytest
+
+import ttl_cache
+from ttl_cache import MISSING, TTLCache
+
+pytestmark = pytest.mark.anyio
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ttl_cache.time, "monotonic", clock)
+    return clock
+
+
+class BrokenCollection:
+    """A shared tier whose MongoDB is unreachable"""
+
+    async def _fail(self, *args, **kwargs):
+        raise ConnectionError("connection refused")
+
+    find_one = update_one = delete_one = delete_many = _fail
+
+
+async def test_entries_expire_after_their_ttl(clock):
+    cache = TTLCache("test_expiry", ttl_seconds=10)
+    await cache.set("a", 1)
+    await cache.set("b", 2, ttl_seconds=30)
+
+    clock.now += 9.9
+    assert await cache.get("a") == 1
+    clock.now += 0.2
+    assert await cache.get("a") is MISSING
+    assert await cache.get("b") == 2
+    assert await cache.get("a", default=None) is None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["expirations"], stats["size"]) == (2, 2, 1, 1)
+
+
+async def test_least_recently_used_entry_is_evicted_at_capacity(clock):
+    cache = TTLCache("test_lru", max_entries=3)
+    for key in ("a", "b", "c"):
+        await cache.set(key, key.upper())
+    # Reading a makes b the least recently used
+    await cache.get("a")
+
+    await cache.set("d", "D")
+
+    assert await cache.get("b") is MISSING
+    assert [await cache.get(key) for key in ("a", "c", "d")] == ["A", "C", "D"]
+    assert (cache.stats()["size"], cache.stats()["evictions"]) == (3, 1)
+
+
+async def test_overwriting_a_key_does_not_count_against_capacity(clock):
+    cache = TTLCache("test_overwrite", max_entries=2)
+    await cache.set("a", 1)
+    await cache.set("b", 2)
+    await cache.set("a", 3, tags=["t"])
+
+    assert (await cache.get("a"), await cache.get("b")) == (3, 2)
+    assert cache.stats()["evictions"] == 0
+
+
+async def test_invalidate_tags_drops_every_tagged_entry(clock):
+    cache = TTLCache("test_tags")
+    await cache.set("id:u1", "user 1", tags=["id:u1", "email:a@example.com"])
+    await cache.set("email:a@example.com", "user 1", tags=["id:u1", "email:a@example.com"])
+    await cache.set("id:u2", "user 2", tags=["id:u2"])
+
+    await cache.invalidate_tags(["id:u1"])
+
+    assert await cache.get("id:u1") is MISSING
+    assert await cache.get("email:a@example.com") is MISSING
+    assert await cache.get("id:u2") == "user 2"
+    assert cache.stats()["invalidations"] == 2
+    # Dropped keys are no longer tracked under their tags
+    assert "id:u1" not in cache._tagged
+
+
+async def test_evicted_entries_leave_no_tags_behind(clock):
+    cache = TTLCache("test_evicted_tags", max_entries=1)
+    await cache.set("a", 1, tags=["t"])
+    await cache.set("b", 2)
+
+    assert cache._tagged == {}
+    await cache.invalidate_tags(["t"])
+    assert cache.stats()["invalidations"] == 0
+
+
+async def test_shared_tier_serves_other_workers(db, clock):
+    worker_a = TTLCache("test_shared", shared_collection=db.cache_entries)
+    worker_b = TTLCache("test_shared", shared_collection=db.cache_entries)
+    await worker_a.set("k", {"answer": 42}, tags=["t"])
+
+    assert await worker_b.get("k") == {"answer": 42}
+    assert worker_b.stats()["shared_hits"] == 1
+    # Now cached locally as well
+    assert await worker_b.get("k") == {"answer": 42}
+    assert worker_b.stats()["hits"] == 1
+
+
+async def test_local_copies_fall_back_to_the_shared_tier(db, clock):
+    cache = TTLCache("test_shared_fallback", ttl_seconds=60, shared_collection=db.cache_entries)
+    await cache.set("k", "v")
+
+    # Local copies only live CACHE_LOCAL_TTL_WITH_SHARED_SECONDS, the shared one the full TTL
+    clock.now += ttl_cache.CACHE_LOCAL_TTL_WITH_SHARED_SECONDS + 1
+    assert await cache.get("k") == "v"
+    cache.clear()
+    assert await cache.get("k") == "v"
+    assert cache.stats()["shared_hits"] == 2
+
+
+async def test_invalidation_reaches_the_shared_tier(db, clock):
+    worker_a = TTLCache("test_shared_invalidation", shared_collection=db.cache_entries)
+    worker_b = TTLCache("test_shared_invalidation", shared_collection=db.cache_entries)
+    await worker_a.set("k1", 1, tags=["t"])
+    await worker_a.set("k2", 2)
+
+    await worker_a.invalidate_tags(["t"])
+    await worker_a.invalidate("k2")
+
+    assert await worker_b.get("k1") is MISSING
+    assert await worker_b.get("k2") is MISSING
+    assert await db.cache_entries.count_documents({}) == 0
+
+
+async def test_shared_tier_failures_fall_back_to_local_only(clock):
+    cache = TTLCache("test_shared_down", shared_collection=BrokenCollection())
+
+    await cache.set("k", "v", tags=["t"])
+    assert await cache.get("k") == "v"
+    await cache.invalidate_tags(["t"])
+    assert await cache.get("k") is MISSING
+    await cache.invalidate("k")
+    assert cache.stats()["misses"] == 1
@@ -0,0 +1,80 @@
+import base64
+
+import pytest
+
+from document_store import DocumentStore, LocalBlobStore
+from verification_service import VerificationService, decode_image_data
+
+pytestmark = pytest.mark.anyio
+
+JPEG_BYTES = b"\xff\xd8\xff\xe0 not really a jpeg"
+
+
+@pytest.fixture
+def service():
+    # decode_upload never touches the document store
+    return VerificationService(None)
+
+
+@pytest.mark.parametrize("image_data, content_type", [
+    (base64.b64encode(JPEG_BYTES).decode(), "image/jpeg"),
+    ("data:image/png;base64," + base64.b64encode(JPEG_BYTES).decode(), "image/png"),
+    # Encoders that wrap their output at 76 characters
+    ("\n".join(base64.encodebytes(JPEG_BYTES * 10).decode().split("\n")), "image/jpeg"),
+])
+def test_decode_image_data(image_data, content_type):
+    data, detected_type = decode_image_data(image_data)
+    assert data.startswith(JPEG_BYTES)
+    assert detected_type == content_type
+
+
+@pytest.mark.parametrize("image_data", [
+    "!!!",                                      # not base64 at all
+    "aGVsbG8*d29ybGQ=",                         # valid base64 with a stray character in it
+    "data:image/jpeg;base64,aGVsbG8",           # truncated padding
+])
+async def test_invalid_base64_is_rejected(service, image_data):
+    with pytest.raises(ValueError, match="Invalid image data"):
+        await service.decode_upload(image_data)
+
+
+@pytest.mark.parametrize("image_data", ["", "data:image/jpeg;base64,", "   "])
+async def test_empty_upload_is_rejected(service, image_data):
+    with pytest.raises(ValueError, match="empty"):
+        await service.decode_upload(image_data)
+
+
+@pytest.fixture
+def store(db, tmp_path):
+    return DocumentStore(db.verification_documents, db.document_blobs, blobs=LocalBlobStore(str(tmp_path)))
+
+
+async def add_document(store, doc_type, status, uploaded_at):
+    await store.collection.insert_one({
+        "id": f"{doc_type}_{uploaded_at}", "type": doc_type, "user_id": "u1", "user_email": "u1@example.com",
+        "blob_key": "blobs/ab/abc", "sha256": "abc", "status": status, "uploaded_at": uploaded_at
+    })
+
+
+@pytest.mark.parametrize("documents, overall_status", [
+    ([], "id_required"),
+    ([("government_id", "pending")], "id_pending"),
+    ([("government_id", "rejected")], "id_rejected"),
+    ([("government_id", "approved")], "age_verified"),
+    ([("government_id", "approved"), ("fitness_certification", "pending")], "cert_pending"),
+    ([("government_id", "approved"), ("fitness_certification", "rejected")], "cert_rejected"),
+    ([("government_id", "approved"), ("fitness_certification", "approved")], "fully_verified"),
+])
+async def test_verification_status_reports_the_latest_documents(store, documents, overall_status):
+    for doc_type, status in documents:
+        # An older rejected upload, superseded by the document under test
+        await add_document(store, doc_type, "rejected", "2025-01-01T00:00:00")
+        await add_document(store, doc_type, status, "2025-01-02T00:00:00")
+
+    status = await VerificationService(store).get_verification_status("u1")
+
+    assert status["overall_status"] == overall_status
+    if documents:
+        assert status["id_verification"] == {
+            "id": "government_id_2025-01-02T00:00:00", "status": documents[0][1], "uploaded_at": "2025-01-02T00:00:00"
+        }
@@ -5,6 +5,7 @@ Tests the updated user profile management endpoints with name field support
 """
 import requests
 import json
+import time
 import uuid
 from datetime import datetime
 
@@ -364,7 +365,16 @@ def test_login_with_name_field():
         
         verify_response = requests.post(f"{BACKEND_URL}/verify-government-id", json=verification_data)
         
-        if verify_response.status_code == 200:
+        # Verification runs in the background; wait for the queued job to finish
+        job = None
+        if verify_response.status_code == 202:
+            for _ in range(60):
+                job = requests.get(f"{BACKEND_URL}/verification/jobs/{verify_response.json()['job_id']}").json()
+                if job["status"] in ("succeeded", "failed"):
+                    break
+                time.sleep(1)
+        
+        if job and job["status"] == "succeeded":
             print("✅ Age verification completed")
             
             # Now try login again
@@ -7,6 +7,7 @@ import requests
 import json
 import uuid
 import base64
+import time
 from datetime import datetime
 
 # Get the backend URL from the frontend .env file
@@ -24,6 +25,26 @@ verification_test_results = {
 def print_separator():
     print("\n" + "="*80 + "\n")
 
+def submit_verification(endpoint, verification_request, attempts=60):
+    """POST a verification request and poll its background job; returns the job result, or None if it did not succeed"""
+    response = requests.post(f"{BACKEND_URL}/{endpoint}", json=verification_request)
+    if response.status_code != 202:
+        print(f"❌ ERROR: {endpoint} returned {response.status_code}: {response.text}")
+        return None
+    
+    queued = response.json()
+    print(f"Verification queued: {json.dumps(queued, indent=2)}")
+    for _ in range(attempts):
+        job = requests.get(f"{BACKEND_URL}/verification/jobs/{queued['job_id']}").json()
+        if job["status"] == "succeeded":
+            return job["result"]
+        if job["status"] == "failed":
+            print(f"❌ ERROR: Verification job {queued['job_id']} failed: {job.get('error')}")
+            return None
+        time.sleep(1)
+    print(f"❌ ERROR: Verification job {queued['job_id']} did not finish in {attempts}s")
+    return None
+
 def create_mock_image_data():
     """Create mock base64 image data for testing"""
     # Create a simple mock image data (just some text encoded as base64)
@@ -115,11 +136,10 @@ def test_government_id_verification():
             }
             
             print(f"Submitting government ID verification...")
-            response = requests.post(f"{BACKEND_URL}/verify-government-id", json=verification_request)
+            result = submit_verification("verify-government-id", verification_request)
             
-            if response.status_code == 200:
-                result = response.json()
-                print(f"Verification response: {json.dumps(result, indent=2)}")
+            if result is not None:
+                print(f"Verification result: {json.dumps(result, indent=2)}")
                 
                 # Verify response structure
                 required_fields = ["status", "age_verified"]
@@ -148,9 +168,8 @@ def test_government_id_verification():
                     verification_test_results["government_id_verification"]["details"] += f"Incorrect result for {scenario['name']}. "
                     
             else:
-                print(f"❌ ERROR: Government ID verification failed. Status code: {response.status_code}")
-                print(f"Response: {response.text}")
-                verification_test_results["government_id_verification"]["details"] += f"API call failed for {scenario['name']}. Status code: {response.status_code}. "
+                print(f"❌ ERROR: Government ID verification failed")
+                verification_test_results["government_id_verification"]["details"] += f"Verification job failed for {scenario['name']}. "
                 
         else:
             print(f"❌ ERROR: Failed to create user for {scenario['name']}. Status code: {response.status_code}")
@@ -265,11 +284,10 @@ def test_fitness_certification_verification():
             }
             
             print(f"Submitting fitness certification verification...")
-            response = requests.post(f"{BACKEND_URL}/verify-fitness-certification", json=cert_verification_request)
+            result = submit_verification("verify-fitness-certification", cert_verification_request)
             
-            if response.status_code == 200:
-                result = response.json()
-                print(f"Certification verification response: {json.dumps(result, indent=2)}")
+            if result is not None:
+                print(f"Certification verification result: {json.dumps(result, indent=2)}")
                 
                 # Verify response structure
                 required_fields = ["status", "cert_verified"]
@@ -298,9 +316,8 @@ def test_fitness_certification_verification():
                     verification_test_results["fitness_certification_verification"]["details"] += f"Incorrect result for {scenario['name']}. "
                     
             else:
-                print(f"❌ ERROR: Fitness certification verification failed. Status code: {response.status_code}")
-                print(f"Response: {response.text}")
-                verification_test_results["fitness_certification_verification"]["details"] += f"API call failed for {scenario['name']}. Status code: {response.status_code}. "
+                print(f"❌ ERROR: Fitness certification verification failed")
+                verification_test_results["fitness_certification_verification"]["details"] += f"Verification job failed for {scenario['name']}. "
                 
         else:
             print(f"❌ ERROR: Failed to create trainer for {scenario['name']}. Status code: {response.status_code}")
@@ -384,9 +401,8 @@ def test_login_verification_blocking():
             "image_data": mock_image
         }
         
-        response = requests.post(f"{BACKEND_URL}/verify-government-id", json=id_verification_request)
-        if response.status_code == 200:
-            result = response.json()
+        result = submit_verification("verify-government-id", id_verification_request)
+        if result is not None:
             if result.get("age_verified"):
                 test_users.append(("verified_enthusiast", verified_enthusiast, verified_enthusiast_email))
                 print(f"✅ Created and verified enthusiast: {verified_enthusiast['id']}")
@@ -421,8 +437,8 @@ def test_login_verification_blocking():
             "image_data": mock_image
         }
         
-        response = requests.post(f"{BACKEND_URL}/verify-government-id", json=id_verification_request)
-        if response.status_code == 200 and response.json().get("age_verified"):
+        result = submit_verification("verify-government-id", id_verification_request)
+        if result and result.get("age_verified"):
             
             # Then verify their certification
             cert_verification_request = {
@@ -432,9 +448,8 @@ def test_login_verification_blocking():
                 "image_data": mock_image
             }
             
-            response = requests.post(f"{BACKEND_URL}/verify-fitness-certification", json=cert_verification_request)
-            if response.status_code == 200:
-                result = response.json()
+            result = submit_verification("verify-fitness-certification", cert_verification_request)
+            if result is not None:
                 if result.get("cert_verified"):
                     test_users.append(("fully_verified_trainer", fully_verified_trainer, fully_verified_trainer_email))
                     print(f"✅ Created and fully verified trainer: {fully_verified_trainer['id']}")
@@ -584,8 +599,8 @@ def test_verification_status_endpoint():
         "image_data": mock_image
     }
     
-    response = requests.post(f"{BACKEND_URL}/verify-government-id", json=id_verification_request)
-    if response.status_code == 200 and response.json().get("age_verified"):
+    result = submit_verification("verify-government-id", id_verification_request)
+    if result and result.get("age_verified"):
         print("✅ ID verification successful")
         
         # Check status again
@@ -618,8 +633,8 @@ def test_verification_status_endpoint():
         "image_data": mock_image
     }
     
-    response = requests.post(f"{BACKEND_URL}/verify-fitness-certification", json=cert_verification_request)
-    if response.status_code == 200 and response.json().get("cert_verified"):
+    result = submit_verification("verify-fitness-certification", cert_verification_request)
+    if result and result.get("cert_verified"):
         print("✅ Certification verification successful")
         
         # Check final status